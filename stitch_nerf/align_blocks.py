@@ -1,29 +1,26 @@
-import open3d as o3d
 import numpy as np
 import os
-import sqlite3
 import argparse
-
-import open3d as o3d
-import numpy as np
 import copy
+import csv
+import hashlib
 import json
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
 
-def load_camera_centers(transforms_path: str) -> np.ndarray:
-    with open(transforms_path) as f:
-        data = json.load(f)
-
-    centers = []
-    for frame in data["frames"]:
-        T = np.array(frame["transform_matrix"])
-        center = T[:3, 3]
-        centers.append(center)
-    return np.array(centers)
+import se3
+import metadata_db
+import icp_engine
+import cloud_store
+from camera_poses import file_digest, load_camera_centers
+from block_index import world_aabb
 
 def visualize_global_camera_centers(path_A, path_B, transform_A_to_global, transform_B_to_global):
     """
     Loads camera centers from paths A and B, applies global transforms, and visualizes them.
     """
+    o3d = icp_engine.load_open3d()
     points_A = load_camera_centers(path_A)
     points_B = load_camera_centers(path_B)
 
@@ -49,90 +46,61 @@ def visualize_global_camera_centers(path_A, path_B, transform_A_to_global, trans
     # Visualize
     o3d.visualization.draw_geometries([pcd_A, pcd_B, axis])
 
-def store_transform_sqlite(db_path: str, block_name: str, transform: np.ndarray):
+ICP_CACHE_VERSION = 1
+
+def icp_input_key(path_A: str, path_B: str, init_transform_path: str, threshold: float,
+                  engine: str = "auto", levels: int = 1, voxel_size: float = 0.05) -> str:
     """
-    Stores the transformation matrix in a SQLite database.
-    The transformation matrix is stored as a flattened 1D array.
+    Hash of everything a pairwise alignment depends on: the block names, the
+    contents of both clouds and of the initial transform, and the ICP parameters.
     """
-    print("Storing transform in SQLite database:", db_path)
-    conn = sqlite3.connect(db_path)
-    c = conn.cursor()
-
-    flat = transform.flatten().tolist()
-    values = [block_name] + flat
-    placeholders = ', '.join(['?'] * len(values))
-    columns = ', '.join(
-        ['block_name'] + [f"t{i}{j}" for i in range(4) for j in range(4)]
-    )
-
-    c.execute(f"""
-        INSERT INTO block_transforms ({columns})
-        VALUES ({placeholders})
-        """, values
-    )
-
-    conn.commit()
-    conn.close()
-
-def load_transform_from_sqlite(db_path: str, block_name: str) -> np.ndarray:
-    """
-    Loads the transformation matrix for a given block name from the SQLite database.
-    The transformation matrix is returned as a 4x4 numpy array.
-    """
-    conn = sqlite3.connect(db_path)
-    c = conn.cursor()
-    c.execute("SELECT " + ", ".join([f"t{i}{j}" for i in range(4) for j in range(4)]) + " FROM block_transforms WHERE block_name = ?", (block_name,))
-    row = c.fetchone()
-    conn.close()
-    if row is None:
-        raise ValueError(f"No transform found for block '{block_name}'")
-    return np.array(row).reshape(4, 4)
-
-def ensure_block_table_exists(db_path: str):
-    conn = sqlite3.connect(db_path)
-    c = conn.cursor()
-    c.execute("""
-        CREATE TABLE IF NOT EXISTS block_transforms (
-            block_name TEXT PRIMARY KEY,
-            t00 REAL, t01 REAL, t02 REAL, t03 REAL,
-            t10 REAL, t11 REAL, t12 REAL, t13 REAL,
-            t20 REAL, t21 REAL, t22 REAL, t23 REAL,
-            t30 REAL, t31 REAL, t32 REAL, t33 REAL
-        )
-    """)
-    conn.commit()
-    conn.close()
-
-def icp_align(path_A: str, path_B: str, init_transform_path: str, store_db_path: str, threshold: float, viewer: bool):
+    h = hashlib.sha1()
+    for path in (path_A, path_B):
+        h.update(os.path.basename(os.path.dirname(path)).encode() + b"\0")
+    for path in (path_A, path_B, init_transform_path):
+        h.update(file_digest(path).encode())
+    params = [ICP_CACHE_VERSION, float(threshold), icp_engine.resolve_engine(engine), int(levels), float(voxel_size)]
+    h.update(json.dumps(params).encode())
+    return h.hexdigest()
+
+def icp_align(path_A: str, path_B: str, init_transform_path: str, store_db_path: str, threshold: float, viewer: bool,
+              engine: str = "auto", levels: int = 1, voxel_size: float = 0.05, aabb_padding: float = 0.5,
+              use_cache: bool = True):
     """
     Main function to align two NeRF blocks using ICP.
     It loads the camera centers from the transforms.json files, applies ICP to align them,
     and saves the aligned transforms.json for the target block.
     Stores the transformation matrix and AABB in a SQLite database.
+    levels > 1 runs coarse-to-fine ICP over a voxel pyramid ending at voxel_size.
+    With use_cache, a stored result for identical inputs and parameters is
+    reused instead of running ICP again.
     """
-    if store_db_path:
-        ensure_block_table_exists(store_db_path)
-
-    pcd_A = o3d.io.read_point_cloud(path_A)
-    pcd_B = o3d.io.read_point_cloud(path_B)
+    metadata_db.connect(store_db_path, write=True)  # creates or migrates the database
+    cloud_A = cloud_store.load_cloud(path_A, build_tree=True)
+    points_A = cloud_A.points
+    points_B = cloud_store.load_cloud(path_B).points
 
     block_name_A = os.path.basename(os.path.dirname(path_A))
     block_name_B = os.path.basename(os.path.dirname(path_B))
 
     print("Initial alignment (red = A, green = B)")
     if viewer:
+        o3d = icp_engine.load_open3d()
+        pcd_A = o3d.geometry.PointCloud(o3d.utility.Vector3dVector(points_A))
+        pcd_B = o3d.geometry.PointCloud(o3d.utility.Vector3dVector(points_B))
         o3d.visualization.draw_geometries([pcd_A, pcd_B])
 
-    print(f"pcd_A has {len(pcd_A.points)} points")
-    print(f"pcd_B has {len(pcd_B.points)} points")
+    print(f"pcd_A has {len(points_A)} points")
+    print(f"pcd_B has {len(points_B)} points")
 
     # load transform from SQLite. If not found, that's the anchor block
     # need to compute global transform starting from the anchor block and propagate outwards
     try:
-        transform_A = load_transform_from_sqlite(store_db_path, block_name_A)
+        transform_A = metadata_db.load_transform(store_db_path, block_name_A)
     except ValueError:
         transform_A = np.eye(4)
-        store_transform_sqlite(store_db_path, block_name_A, transform_A)
+        print("Storing transform in SQLite database:", store_db_path)
+        metadata_db.store_transform(store_db_path, block_name_A, transform_A)
 
     if init_transform_path is None:
         init_transform_path = os.path.join(os.path.dirname(path_B), "initial_transform.npy")
@@ -140,41 +108,274 @@ def icp_align(path_A: str, path_B: str, init_transform_path: str, store_db_path:
     print(f"Using initial transform from: {init_transform_path}")
     init_transform = np.load(init_transform_path)
 
-    print(f"Running ICP with threshold {threshold}")
-    result = o3d.pipelines.registration.registration_icp(
-        pcd_B, pcd_A, threshold,
-        init_transform,
-        o3d.pipelines.registration.TransformationEstimationPointToPoint()
-    )
+    engine = icp_engine.resolve_engine(engine)
+    key = icp_input_key(path_A, path_B, init_transform_path, threshold, engine, levels, voxel_size)
+    cached = metadata_db.load_icp_results(store_db_path, [key]).get(key) if use_cache else None
+    if cached is not None:
+        print(f"Reusing stored ICP result for unchanged inputs (computed in {cached['seconds']:.2f} s)")
+        result = icp_engine.ICPResult(cached["transformation"], cached["fitness"], cached["inlier_rmse"])
+    else:
+        print(f"Running ICP with threshold {threshold} ({engine} engine, {levels} level(s))")
+        start = time.perf_counter()
+        result = icp_engine.register(points_B, points_A, init_transform, threshold, engine, levels, voxel_size,
+                                     level_clouds=cloud_store.pair_levels(path_B, path_A, engine == "numpy"))
+        # Stored with the result so align_batch can reuse it as a pose graph edge
+        information = icp_engine.information_matrix(points_B, points_A, threshold, result.transformation,
+                                                    tree=cloud_A.tree)
+        metadata_db.store_icp_results(store_db_path, {key: {
+            "block_A": block_name_A,
+            "block_B": block_name_B,
+            "transformation": result.transformation,
+            "information": information,
+            "fitness": result.fitness,
+            "inlier_rmse": result.inlier_rmse,
+            "seconds": time.perf_counter() - start,
+        }})
     print("Transformation matrix B → A:")
     print(result.transformation)
 
     # Additional insights
+    print(f"Fitness: {result.fitness:.6f}")
     print(f"Inlier RMSE: {result.inlier_rmse:.6f}")
     delta = np.linalg.norm(result.transformation - init_transform)
     print(f"Δ from init transform (Frobenius norm): {delta:.6f}")
 
-    transform_B_to_global = transform_A @ result.transformation
+    transform_B_to_global = se3.compose(transform_A, result.transformation)
 
     if store_db_path:
-        store_transform_sqlite(store_db_path, block_name_B, transform_B_to_global)
+        print("Storing transform in SQLite database:", store_db_path)
+        metadata_db.store_transform(store_db_path, block_name_B, transform_B_to_global)
+        store_block_aabbs(
+            store_db_path,
+            {block_name_A: transform_A, block_name_B: transform_B_to_global},
+            {block_name_A: path_A, block_name_B: path_B},
+            aabb_padding,
+            {block_name_A: points_A, block_name_B: points_B},
+        )
 
     if viewer:
         path_A_transforms = os.path.join(os.path.dirname(path_A), "transforms.json")
         path_B_transforms = os.path.join(os.path.dirname(path_B), "transforms.json")
         visualize_global_camera_centers(path_A_transforms, path_B_transforms, transform_A, transform_B_to_global)
 
+def block_bounds_points(ply_path: str, points=None):
+    """
+    Block-local points that bound a block: its point cloud plus the camera
+    centers of the transforms.json next to the .ply, if there is one.
+    """
+    if points is None:
+        points = cloud_store.load_cloud(ply_path).points
+    transforms_path = os.path.join(os.path.dirname(ply_path), "transforms.json")
+    if os.path.exists(transforms_path):
+        points = np.vstack([points, load_camera_centers(transforms_path)])
+    return points
+
+def store_block_aabbs(store_db_path: str, transforms: dict, ply_paths: dict, padding: float = 0.5, points=None):
+    """
+    Computes the world-space AABB of every block in transforms from its cloud
+    and camera centers and stores them in one transaction.
+    points optionally maps block names to already loaded clouds.
+    """
+    points = points or {}
+    aabbs = {
+        name: world_aabb(T, block_bounds_points(ply_paths[name], points.get(name)), padding)
+        for name, T in transforms.items() if name in ply_paths
+    }
+    metadata_db.store_aabbs(store_db_path, aabbs)
+    return aabbs
+
+def load_block_pairs(pairs_path: str):
+    """
+    Reads a CSV of block pairs to align, one pair per row:
+        ref_ply, target_ply[, init_transform_npy]
+    A missing init transform defaults to initial_transform.npy next to the target .ply.
+    """
+    pairs = []
+    with open(pairs_path, newline='') as csvfile:
+        for row in csv.reader(csvfile):
+            row = [field.strip() for field in row]
+            if not row or row[0].startswith("#"):
+                continue
+            path_A, path_B = row[0], row[1]
+            init_path = row[2] if len(row) > 2 and row[2] else os.path.join(os.path.dirname(path_B), "initial_transform.npy")
+            pairs.append((path_A, path_B, init_path))
+    return pairs
+
+def pairwise_icp(path_A: str, path_B: str, init_transform_path: str, threshold: float,
+                 engine: str = "auto", levels: int = 1, voxel_size: float = 0.05) -> dict:
+    """
+    Runs ICP of block B onto block A. Runs in a worker process, so everything
+    returned is plain numpy / Python data.
+    """
+    start = time.perf_counter()
+    engine = icp_engine.resolve_engine(engine)
+    cloud_A = cloud_store.load_cloud(path_A, build_tree=True)
+    points_B = cloud_store.load_cloud(path_B).points
+    init_transform = np.load(init_transform_path)
+
+    result = icp_engine.register(points_B, cloud_A.points, init_transform, threshold, engine, levels, voxel_size,
+                                 level_clouds=cloud_store.pair_levels(path_B, path_A, engine == "numpy"))
+    information = icp_engine.information_matrix(points_B, cloud_A.points, threshold, result.transformation,
+                                                tree=cloud_A.tree)
+    return {
+        "block_A": os.path.basename(os.path.dirname(path_A)),
+        "block_B": os.path.basename(os.path.dirname(path_B)),
+        "transformation": np.asarray(result.transformation),
+        "information": np.asarray(information),
+        "fitness": result.fitness,
+        "inlier_rmse": result.inlier_rmse,
+        "seconds": time.perf_counter() - start,
+    }
+
+def optimize_pose_graph(results, anchor: str, anchor_transform: np.ndarray, threshold: float) -> dict:
+    """
+    Solves the global pose graph over all pairwise ICP constraints.
+    Each result constrains T_A · T_B→A = T_B. Initial poses are chained along a
+    breadth-first spanning tree from the anchor; every other edge is a loop
+    closure. The anchor block keeps anchor_transform.
+    Returns {block_name: world-from-local transform}.
+    """
+    reg = icp_engine.load_open3d().pipelines.registration
+
+    adjacency = {}
+    for k, r in enumerate(results):
+        adjacency.setdefault(r["block_A"], []).append((k, r["block_B"], r["transformation"]))
+        adjacency.setdefault(r["block_B"], []).append((k, r["block_A"], se3.inverse(r["transformation"])))
+    if anchor not in adjacency:
+        raise ValueError(f"Anchor block '{anchor}' is not part of any pair")
+
+    # Chain initial poses outwards from the anchor
+    poses = {anchor: se3.as_transforms(anchor_transform)}
+    tree_edges = set()
+    queue = deque([anchor])
+    while queue:
+        block = queue.popleft()
+        for k, other, T_other_to_block in adjacency[block]:
+            if other not in poses:
+                poses[other] = se3.compose(poses[block], T_other_to_block)
+                tree_edges.add(k)
+                queue.append(other)
+
+    unreachable = sorted(set(adjacency) - set(poses))
+    if unreachable:
+        raise ValueError(f"Blocks not connected to anchor '{anchor}': {', '.join(unreachable)}")
+
+    blocks = list(poses)
+    node_of = {name: i for i, name in enumerate(blocks)}
+    pose_graph = reg.PoseGraph()
+    for name in blocks:
+        pose_graph.nodes.append(reg.PoseGraphNode(poses[name]))
+    for k, r in enumerate(results):
+        pose_graph.edges.append(reg.PoseGraphEdge(
+            node_of[r["block_B"]], node_of[r["block_A"]],
+            r["transformation"], r["information"],
+            uncertain=k not in tree_edges
+        ))
+
+    option = reg.GlobalOptimizationOption(
+        max_correspondence_distance=threshold,
+        edge_prune_threshold=0.25,
+        reference_node=node_of[anchor]
+    )
+    reg.global_optimization(
+        pose_graph,
+        reg.GlobalOptimizationLevenbergMarquardt(),
+        reg.GlobalOptimizationConvergenceCriteria(),
+        option
+    )
+    return {name: np.asarray(pose_graph.nodes[node_of[name]].pose) for name in blocks}
+
+def align_batch(pairs_path: str, store_db_path: str, threshold: float, workers: int = None, anchor: str = None,
+                engine: str = "auto", levels: int = 1, voxel_size: float = 0.05, aabb_padding: float = 0.5,
+                use_cache: bool = True):
+    """
+    Aligns every block pair listed in pairs_path in parallel, then distributes
+    the error over the whole site with a global pose graph optimization and
+    writes every block's global transform in one transaction.
+    The anchor defaults to the reference block of the first pair; its stored
+    transform is kept if it has one, otherwise it becomes the identity.
+    Pairwise results are stored keyed by icp_input_key; with use_cache only
+    pairs whose inputs changed are realigned, and if none did and every block
+    already has a transform, nothing is recomputed.
+    """
+    pairs = load_block_pairs(pairs_path)
+    if not pairs:
+        raise ValueError(f"No block pairs found in {pairs_path}")
+    metadata_db.connect(store_db_path, write=True)  # creates or migrates the database
+    engine = icp_engine.resolve_engine(engine)
+    keys = [icp_input_key(path_A, path_B, init_path, threshold, engine, levels, voxel_size)
+            for path_A, path_B, init_path in pairs]
+    cached = metadata_db.load_icp_results(store_db_path, keys) if use_cache else {}
+    # Rows without an information matrix cannot be pose graph edges; realign them
+    cached = {key: r for key, r in cached.items() if r["information"] is not None}
+    todo = [(key, pair) for key, pair in zip(keys, pairs) if key not in cached]
+
+    print(f"Running ICP on {len(todo)} of {len(pairs)} block pairs with threshold {threshold} "
+          f"({len(pairs) - len(todo)} unchanged)")
+    fresh = {}
+    if todo:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            futures = {key: pool.submit(pairwise_icp, path_A, path_B, init_path, threshold, engine, levels, voxel_size)
+                       for key, (path_A, path_B, init_path) in todo}
+            fresh = {key: future.result() for key, future in futures.items()}
+        metadata_db.store_icp_results(store_db_path, fresh)
+    results = [fresh[key] if key in fresh else cached[key] for key in keys]
+
+    for key, r in zip(keys, results):
+        status = "aligned" if key in fresh else "cached"
+        print(f"{r['block_B']} → {r['block_A']}: fitness {r['fitness']:.4f}, inlier RMSE {r['inlier_rmse']:.6f} ({status})")
+
+    stored = metadata_db.load_transforms(store_db_path)
+    blocks = {r["block_A"] for r in results} | {r["block_B"] for r in results}
+    if not fresh and blocks <= set(stored):
+        print("No pair changed; keeping the stored global transforms")
+        return {name: stored[name] for name in blocks}
+
+    if anchor is None:
+        anchor = results[0]["block_A"]
+    try:
+        anchor_transform = metadata_db.load_transform(store_db_path, anchor)
+    except ValueError:
+        anchor_transform = np.eye(4)
+
+    print(f"Optimizing pose graph anchored at {anchor}")
+    transforms = optimize_pose_graph(results, anchor, anchor_transform, threshold)
+    print(f"Storing {len(transforms)} transforms in SQLite database:", store_db_path)
+    metadata_db.store_transforms(store_db_path, transforms)
+
+    ply_paths = {}
+    for path_A, path_B, _ in pairs:
+        for path in (path_A, path_B):
+            ply_paths[os.path.basename(os.path.dirname(path))] = path
+    store_block_aabbs(store_db_path, transforms, ply_paths, aabb_padding)
+    return transforms
+
 def main():
     parser = argparse.ArgumentParser(description="Align NeRF blocks via ICP and store transforms.")
-    parser.add_argument("ref_block", help="Path to reference block's .ply file")
-    parser.add_argument("target_block", help="Path to target block's .ply file (to be aligned)")
+    parser.add_argument("ref_block", nargs="?", help="Path to reference block's .ply file")
+    parser.add_argument("target_block", nargs="?", help="Path to target block's .ply file (to be aligned)")
+    parser.add_argument("--pairs", default=None, help="CSV of block pairs (ref_ply, target_ply[, init_npy]) to align in batch with global pose graph optimization")
+    parser.add_argument("--workers", type=int, default=None, help="Number of ICP worker processes in batch mode")
+    parser.add_argument("--anchor", default=None, help="Anchor block name in batch mode (default: reference block of the first pair)")
     parser.add_argument("--init_transform", default=None, help="Path to initial transform (npy) file to use as ICP starting guess.")
     parser.add_argument("--db", default="metadata.sqlite", help="Path to SQLite DB to store global transforms and AABB")
     parser.add_argument("--threshold", type=float, default=0.2, help="ICP distance threshold")
     parser.add_argument("--viewer", action="store_true", help="Open viewer to visualize the alignment")
+    parser.add_argument("--engine", choices=["auto", "open3d", "numpy"], default="auto", help="ICP engine (auto: Open3D if installed, else NumPy/SciPy)")
+    parser.add_argument("--levels", type=int, default=1, help="Coarse-to-fine pyramid levels (1 = single full-resolution ICP)")
+    parser.add_argument("--voxel_size", type=float, default=0.05, help="Voxel size of the finest pyramid level; coarser levels double it")
+    parser.add_argument("--aabb_padding", type=float, default=0.5, help="Meters added on every side of the stored block AABBs")
+    parser.add_argument("--no_cache", action="store_true", help="Rerun ICP even for pairs whose inputs are unchanged")
     args = parser.parse_args()
 
-    icp_align(args.ref_block, args.target_block, args.init_transform, args.db, args.threshold, args.viewer)
+    if args.pairs:
+        align_batch(args.pairs, args.db, args.threshold, args.workers, args.anchor,
+                    args.engine, args.levels, args.voxel_size, args.aabb_padding, not args.no_cache)
+        return
+    if not (args.ref_block and args.target_block):
+        parser.error("ref_block and target_block are required unless --pairs is given")
+    icp_align(args.ref_block, args.target_block, args.init_transform, args.db, args.threshold, args.viewer,
+              args.engine, args.levels, args.voxel_size, args.aabb_padding, not args.no_cache)
 
 if __name__ == "__main__":
     main()
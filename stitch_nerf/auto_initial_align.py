@@ -0,0 +1,113 @@
+import argparse
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+import icp_engine
+from align_blocks import load_block_pairs
+import cloud_store
+
+
+def preprocess_point_cloud(points: np.ndarray, voxel_size: float):
+    """
+    Downsamples a cloud and computes its FPFH features.
+    """
+    o3d = icp_engine.load_open3d()
+    pcd = o3d.geometry.PointCloud(o3d.utility.Vector3dVector(points))
+    pcd_down = pcd.voxel_down_sample(voxel_size)
+    pcd_down.estimate_normals(
+        o3d.geometry.KDTreeSearchParamHybrid(radius=voxel_size * 2, max_nn=30)
+    )
+    fpfh = o3d.pipelines.registration.compute_fpfh_feature(
+        pcd_down, o3d.geometry.KDTreeSearchParamHybrid(radius=voxel_size * 5, max_nn=100)
+    )
+    return pcd_down, fpfh
+
+
+def global_registration(points_A: np.ndarray, points_B: np.ndarray, voxel_size: float,
+                        max_iteration: int = 100000, confidence: float = 0.999):
+    """
+    Estimates the transform B → A from scratch with FPFH feature matching and RANSAC.
+    Returns Open3D's RegistrationResult.
+    """
+    o3d = icp_engine.load_open3d()
+    down_A, fpfh_A = preprocess_point_cloud(points_A, voxel_size)
+    down_B, fpfh_B = preprocess_point_cloud(points_B, voxel_size)
+
+    distance_threshold = voxel_size * 1.5
+    return o3d.pipelines.registration.registration_ransac_based_on_feature_matching(
+        down_B, down_A, fpfh_B, fpfh_A, True,
+        distance_threshold,
+        o3d.pipelines.registration.TransformationEstimationPointToPoint(False),
+        3,
+        [
+            o3d.pipelines.registration.CorrespondenceCheckerBasedOnEdgeLength(0.9),
+            o3d.pipelines.registration.CorrespondenceCheckerBasedOnDistance(distance_threshold),
+        ],
+        o3d.pipelines.registration.RANSACConvergenceCriteria(max_iteration, confidence)
+    )
+
+
+def auto_align(ref_path: str, target_path: str, save_path: str = None, voxel_size: float = 0.05,
+               refine_levels: int = 0) -> np.ndarray:
+    """
+    Headless replacement for manual_initial_align.manual_align: computes the
+    initial transform of the target block's .ply onto the reference block's
+    .ply and saves it to the same initial_transform.npy location.
+    refine_levels > 0 polishes the RANSAC estimate with multi-scale ICP.
+    """
+    if save_path is None:
+        save_path = os.path.join(os.path.dirname(target_path), "initial_transform.npy")
+
+    points_A = np.asarray(cloud_store.load_cloud(ref_path).points)
+    points_B = np.asarray(cloud_store.load_cloud(target_path).points)
+
+    result = global_registration(points_A, points_B, voxel_size)
+    T = np.asarray(result.transformation)
+    fitness, rmse = result.fitness, result.inlier_rmse
+
+    if refine_levels > 0:
+        refined = icp_engine.register(points_B, points_A, T, voxel_size * 1.5, "auto", refine_levels, voxel_size)
+        T, fitness, rmse = refined.transformation, refined.fitness, refined.inlier_rmse
+
+    np.save(save_path, T)
+    print(f"{target_path} → {ref_path}: fitness {fitness:.4f}, inlier RMSE {rmse:.6f}")
+    print(f"Saved transform to {save_path}")
+    return T
+
+
+def auto_align_batch(pairs_path: str, voxel_size: float, refine_levels: int = 0, workers: int = None):
+    """
+    Runs auto_align for every pair of a block pairs CSV (ref_ply, target_ply[, out_npy])
+    in a process pool. The third column is the init transform path align_blocks --pairs
+    reads, so the same CSV drives both steps.
+    """
+    pairs = load_block_pairs(pairs_path)
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        futures = [pool.submit(auto_align, ref_path, target_path, save_path, voxel_size, refine_levels)
+                   for ref_path, target_path, save_path in pairs]
+        return [future.result() for future in futures]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Automatic initial alignment of NeRF blocks (FPFH + RANSAC on .ply clouds).")
+    parser.add_argument("ref_block", nargs="?", help="Path to reference block's .ply file")
+    parser.add_argument("target_block", nargs="?", help="Path to target block's .ply file")
+    parser.add_argument("--out", default=None, help="Path to save the initial transform (npy file)")
+    parser.add_argument("--pairs", default=None, help="CSV of block pairs (ref_ply, target_ply[, out_npy]) to align in parallel")
+    parser.add_argument("--workers", type=int, default=None, help="Number of worker processes with --pairs")
+    parser.add_argument("--voxel_size", type=float, default=0.05, help="Voxel size for feature computation")
+    parser.add_argument("--refine_levels", type=int, default=0, help="Refine with multi-scale ICP over this many levels (0 = off)")
+    args = parser.parse_args()
+
+    if args.pairs:
+        auto_align_batch(args.pairs, args.voxel_size, args.refine_levels, args.workers)
+        return
+    if not (args.ref_block and args.target_block):
+        parser.error("ref_block and target_block are required unless --pairs is given")
+    auto_align(args.ref_block, args.target_block, args.out, args.voxel_size, args.refine_levels)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,159 @@
+import argparse
+import contextlib
+import io
+import json
+import os
+import tempfile
+import time
+import tracemalloc
+from types import SimpleNamespace
+
+import numpy as np
+
+import metadata_db
+from block_manager import BlockManager, SiteMetadata, load_block_transforms, load_portals
+from define_portals import add_portals_from_csv, clear_portals
+from portal_table import compile_table
+from synthetic_world import generate_world
+
+
+def measure(fn, repeats: int = 3):
+    """
+    Runs fn repeats times with its stdout silenced, then once more under
+    tracemalloc (which slows Python down, so it is kept out of the timings).
+    Returns (median seconds, peak traced memory in bytes, last return value).
+    """
+    times, result = [], None
+    with contextlib.redirect_stdout(io.StringIO()):
+        for _ in range(repeats):
+            start = time.perf_counter()
+            result = fn()
+            times.append(time.perf_counter() - start)
+
+        tracemalloc.start()
+        fn()
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+    return float(np.median(times)), peak, result
+
+
+def stage_record(stage, items, seconds, peak, **extra):
+    return {
+        "stage": stage,
+        "items": items,
+        "seconds": seconds,
+        "items_per_second": items / seconds if seconds > 0 else None,
+        "peak_memory_bytes": peak,
+        **extra,
+    }
+
+
+def camera_walk(n_steps: int, start, rng, step: float = 0.05) -> np.ndarray:
+    """
+    Random walk of camera positions in the x/z plane.
+    """
+    steps = rng.normal(scale=step, size=(n_steps, 2))
+    return np.asarray(start) + np.cumsum(steps, axis=0)
+
+
+def bench_world(root, n_blocks, n_portals, n_points, n_checks, repeats, engine, seed):
+    rng = np.random.default_rng(seed)
+    world = generate_world(root, n_blocks, n_portals, n_points, seed=seed)
+    db = world.db_path
+    records = []
+
+    seconds, peak, _ = measure(lambda: load_block_transforms(db), repeats)
+    records.append(stage_record("load_block_transforms", n_blocks, seconds, peak))
+
+    seconds, peak, _ = measure(lambda: load_portals(db, world.transforms), repeats)
+    records.append(stage_record("load_portals", 2 * n_portals, seconds, peak))
+
+    def rebuild_portals():
+        clear_portals(db)
+        return add_portals_from_csv(db, world.csv_path)
+    seconds, peak, _ = measure(rebuild_portals, repeats)
+    records.append(stage_record("add_portals_from_csv", n_portals, seconds, peak))
+
+    # Compiled after the last portal write, so the table stays current below
+    table_path = os.path.join(root, "portals.npy")
+    seconds, peak, _ = measure(lambda: compile_table(db, table_path), repeats)
+    records.append(stage_record("compile_portal_table", 2 * n_portals, seconds, peak))
+
+    # What BlockManager pays at startup: transforms, staleness check, mapped table and AABBs
+    seconds, peak, _ = measure(lambda: SiteMetadata.load(db, table_path), repeats)
+    records.append(stage_record("open_portal_table", 2 * n_portals, seconds, peak))
+
+    with contextlib.redirect_stdout(io.StringIO()):
+        manager = BlockManager(world.snapshots, db, portal_table=table_path)
+    testbed = SimpleNamespace(camera_matrix=np.eye(4)[:3])
+    walk = camera_walk(n_checks, (0.0, 0.0), rng)
+
+    def run_checks():
+        switches = 0
+        for x, z in walk:
+            testbed.camera_matrix[0, 3], testbed.camera_matrix[2, 3] = x, z
+            if manager.check_switch(x, 0.0, z, testbed):
+                switches += 1
+        return switches
+    seconds, peak, switches = measure(run_checks, repeats)
+    records.append(stage_record("check_switch", n_checks, seconds, peak, switches=switches))
+    manager.cache.close()
+
+    if n_points > 0 and n_blocks > 1:
+        # Imported here so the metadata-only stages run without Open3D installed
+        from align_blocks import icp_align
+        path_A, path_B = world.ply_paths[world.blocks[0]], world.ply_paths[world.blocks[1]]
+        init_path = os.path.join(os.path.dirname(path_B), "initial_transform.npy")
+        seconds, peak, _ = measure(
+            lambda: icp_align(path_A, path_B, init_path, db, 0.2, False, engine, use_cache=False), repeats
+        )
+        records.append(stage_record("icp_align", n_points, seconds, peak, engine=engine))
+
+    metadata_db.close_all()
+    return {
+        "blocks": n_blocks,
+        "portals": n_portals,
+        "points_per_block": n_points,
+        "stages": records,
+    }
+
+
+def parse_sizes(text):
+    return [int(v) for v in text.split(",") if v]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the stitching pipeline on synthetic worlds and report JSON")
+    parser.add_argument("--blocks", default="10,100,1000", help="Comma-separated block counts")
+    parser.add_argument("--portals", default="100,1000,10000", help="Comma-separated portal counts (paired with --blocks)")
+    parser.add_argument("--points", default="20000", help="Comma-separated points per block cloud (0 skips ICP)")
+    parser.add_argument("--checks", type=int, default=10000, help="check_switch calls per size")
+    parser.add_argument("--repeats", type=int, default=3, help="Timed repeats per stage")
+    parser.add_argument("--engine", default="auto", help="ICP engine for icp_align")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--out", default=None, help="Write the JSON report here instead of stdout")
+    args = parser.parse_args()
+
+    blocks, portals = parse_sizes(args.blocks), parse_sizes(args.portals)
+    points = parse_sizes(args.points)
+    if len(points) == 1:
+        points *= len(blocks)
+    if not (len(blocks) == len(portals) == len(points)):
+        parser.error("--blocks, --portals and --points need the same number of sizes")
+
+    results = []
+    for n_blocks, n_portals, n_points in zip(blocks, portals, points):
+        with tempfile.TemporaryDirectory() as root:
+            results.append(bench_world(root, n_blocks, n_portals, n_points, args.checks,
+                                       args.repeats, args.engine, args.seed))
+
+    report = json.dumps({"benchmark": "stitch_pipeline", "results": results}, indent=2)
+    if args.out:
+        with open(args.out, "w") as f:
+            f.write(report)
+    else:
+        print(report)
+
+
+if __name__ == "__main__":
+    main()
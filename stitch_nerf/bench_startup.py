@@ -0,0 +1,125 @@
+"""
+Startup-time benchmark of the stitch_nerf CLI.
+
+Every command is run in a fresh interpreter with -X importtime, so the report
+has its wall time and the heavy modules it imported. Metadata-only commands
+must stay under the time budget and must not import any heavy module; the
+exit status is 1 if one of them does not.
+"""
+import argparse
+import json
+import os
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+HEAVY_MODULES = ("open3d", "scipy", "cv2", "matplotlib", "torch")
+CLI = os.path.join(os.path.dirname(os.path.abspath(__file__)), "stitch_nerf.py")
+
+
+def run_command(args, repeats: int = 5):
+    """
+    Runs the CLI with args repeats times. Returns (median seconds, heavy
+    top-level modules imported, exit code of the last run).
+    """
+    times, heavy, returncode = [], set(), 0
+    for _ in range(repeats):
+        start = time.perf_counter()
+        proc = subprocess.run([sys.executable, "-X", "importtime", CLI] + args,
+                              stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, text=True)
+        times.append(time.perf_counter() - start)
+        returncode = proc.returncode
+        for line in proc.stderr.splitlines():
+            if line.startswith("import time:"):
+                name = line.rsplit("|", 1)[-1].strip()
+                if name.split(".")[0] in HEAVY_MODULES:
+                    heavy.add(name.split(".")[0])
+    return float(np.median(times)), sorted(heavy), returncode
+
+
+def baseline(repeats: int = 5) -> float:
+    """
+    Median seconds to start an interpreter and import NumPy, which every command pays.
+    """
+    times = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        subprocess.run([sys.executable, "-c", "import numpy"], check=True)
+        times.append(time.perf_counter() - start)
+    return float(np.median(times))
+
+
+def bench(db_path: str, csv_path: str, out_dir: str, budget: float, repeats: int):
+    # (command args, metadata-only)
+    commands = [(["inspect", db_path], True), (["migrate", db_path], True)]
+    if csv_path:
+        commands.append((["portals", "--db", db_path, "--csv", csv_path, "--table", os.path.join(out_dir, "portals.npy")], True))
+    commands += [
+        (["inspect", "-h"], True),
+        (["portals", "-h"], True),
+        (["align", "-h"], False),
+        (["manual-align", "-h"], False),
+        (["convert", "-h"], False),
+    ]
+    records = []
+    for args, metadata_only in commands:
+        seconds, heavy, returncode = run_command(args, repeats)
+        ok = returncode == 0 and (not metadata_only or (seconds <= budget and not heavy))
+        records.append({
+            "command": " ".join(args),
+            "metadata_only": metadata_only,
+            "seconds": seconds,
+            "heavy_modules": heavy,
+            "returncode": returncode,
+            "ok": ok,
+        })
+    return records
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure stitch_nerf CLI startup and enforce the budget of metadata-only commands")
+    parser.add_argument("--db", default=None, help="Metadata database to run against, on a copy (default: a synthetic world)")
+    parser.add_argument("--csv", default=None, help="Portal CSV for the portals command (default: the synthetic world's; skipped for --db without --csv)")
+    parser.add_argument("--budget", type=float, default=0.5, help="Seconds a metadata-only command may take, including interpreter start")
+    parser.add_argument("--repeats", type=int, default=5)
+    parser.add_argument("--out", default=None, help="Write the JSON report here instead of stdout")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as root:
+        csv_path = args.csv
+        if args.db is None:
+            from synthetic_world import generate_world
+            world = generate_world(root, 64, 256, snapshot_bytes=0)
+            db_path, csv_path = world.db_path, world.csv_path
+        else:
+            # The portals command writes to the database, so it runs on a copy
+            if not os.path.exists(args.db):
+                raise RuntimeError(f"No database found at {args.db}.")
+            db_path = os.path.join(root, "metadata.sqlite")
+            with sqlite3.connect(args.db) as src, sqlite3.connect(db_path) as dst:
+                src.backup(dst)
+        records = bench(db_path, csv_path, root, args.budget, args.repeats)
+
+    report = json.dumps({
+        "benchmark": "cli_startup",
+        "budget_seconds": args.budget,
+        "interpreter_with_numpy_seconds": baseline(args.repeats),
+        "commands": records,
+    }, indent=2)
+    if args.out:
+        with open(args.out, "w") as f:
+            f.write(report)
+    else:
+        print(report)
+    failed = [r["command"] for r in records if not r["ok"]]
+    if failed:
+        print("Over budget or importing heavy modules: " + ", ".join(failed), file=sys.stderr)
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,133 @@
+import math
+
+import numpy as np
+
+import se3
+
+
+def world_aabb(T, local_points, padding: float = 0.0):
+    """
+    World-space (mins, maxs) of points given in a block's local frame,
+    grown by padding on every side.
+    """
+    world = se3.transform_points(T, np.asarray(local_points, dtype=np.float64).reshape(-1, 3))
+    return world.min(axis=0) - padding, world.max(axis=0) + padding
+
+
+class BlockIndex:
+    """
+    Spatial index over world-space block AABBs.
+
+    Boxes are registered in every cell of a uniform x/z grid they overlap and
+    the grid is kept as a dict of tuples, so a point query is one dict lookup
+    and a few float comparisons in plain Python (no NumPy call overhead).
+    """
+    def __init__(self, names, mins, maxs, cell_size=None):
+        self.names = list(names)
+        self.mins = np.asarray(mins, dtype=np.float64).reshape(-1, 3)
+        self.maxs = np.asarray(maxs, dtype=np.float64).reshape(-1, 3)
+        self.centers = (self.mins + self.maxs) / 2
+        self._slot = {name: i for i, name in enumerate(self.names)}
+
+        if cell_size is None:
+            extent = np.maximum(self.maxs[:, 0] - self.mins[:, 0], self.maxs[:, 2] - self.mins[:, 2])
+            cell_size = float(np.median(extent)) if len(extent) else 1.0
+        self.cell_size = max(cell_size, 1e-6)
+        self._boxes = [tuple(lo) + tuple(hi) for lo, hi in zip(self.mins.tolist(), self.maxs.tolist())]
+        self._build_grid()
+
+    @classmethod
+    def from_aabbs(cls, aabbs: dict, cell_size=None):
+        """
+        Builds the index from {block: (mins, maxs)}.
+        """
+        names = list(aabbs)
+        mins = [aabbs[n][0] for n in names]
+        maxs = [aabbs[n][1] for n in names]
+        return cls(names, mins, maxs, cell_size)
+
+    def __len__(self):
+        return len(self.names)
+
+    def __contains__(self, block):
+        return block in self._slot
+
+    def _cell(self, x, z):
+        cs = self.cell_size
+        return math.floor(x / cs), math.floor(z / cs)
+
+    def _build_grid(self):
+        grid = {}
+        for i, (x0, _, z0, x1, _, z1) in enumerate(self._boxes):
+            (ix0, iz0), (ix1, iz1) = self._cell(x0, z0), self._cell(x1, z1)
+            for ix in range(ix0, ix1 + 1):
+                for iz in range(iz0, iz1 + 1):
+                    grid.setdefault((ix, iz), []).append(i)
+        self._grid = {cell: tuple(entries) for cell, entries in grid.items()}
+
+    def aabb(self, block):
+        i = self._slot[block]
+        return self.mins[i], self.maxs[i]
+
+    def containing(self, x, y, z):
+        """
+        Names of every block whose AABB contains the world point (x, y, z).
+        """
+        out = []
+        for i in self._grid.get(self._cell(x, z), ()):
+            x0, y0, z0, x1, y1, z1 = self._boxes[i]
+            if x0 <= x <= x1 and y0 <= y <= y1 and z0 <= z <= z1:
+                out.append(self.names[i])
+        return out
+
+    def locate(self, x, y, z, current=None):
+        """
+        The block containing the world point, or None. The current block wins
+        while it still contains the point; otherwise the block with the
+        nearest AABB center does.
+        """
+        best, best_d = None, math.inf
+        for i in self._grid.get(self._cell(x, z), ()):
+            x0, y0, z0, x1, y1, z1 = self._boxes[i]
+            if not (x0 <= x <= x1 and y0 <= y <= y1 and z0 <= z <= z1):
+                continue
+            name = self.names[i]
+            if name == current:
+                return name
+            d = (x - (x0 + x1) / 2) ** 2 + (y - (y0 + y1) / 2) ** 2 + (z - (z0 + z1) / 2) ** 2
+            if d < best_d:
+                best, best_d = name, d
+        return best
+
+    def contains_points(self, block, points) -> np.ndarray:
+        """
+        Boolean mask of the (N, 3) world points inside block's AABB.
+        """
+        i = self._slot[block]
+        points = np.asarray(points, dtype=np.float64)
+        return np.all((points >= self.mins[i]) & (points <= self.maxs[i]), axis=-1)
+
+    def exit_distance(self, block, x, z):
+        """
+        Distance in the x/z plane from a point inside block's AABB to its
+        boundary (0 when the point is outside).
+        """
+        x0, _, z0, x1, _, z1 = self._boxes[self._slot[block]]
+        return max(min(x - x0, x1 - x, z - z0, z1 - z), 0.0)
+
+    def overlapping(self, mins, maxs):
+        """
+        Names of every block whose AABB overlaps the box (mins, maxs).
+        """
+        (ix0, iz0), (ix1, iz1) = self._cell(mins[0], mins[2]), self._cell(maxs[0], maxs[2])
+        if (ix1 - ix0 + 1) * (iz1 - iz0 + 1) > len(self._boxes):
+            candidates = range(len(self._boxes))
+        else:
+            candidates = {i for ix in range(ix0, ix1 + 1) for iz in range(iz0, iz1 + 1)
+                          for i in self._grid.get((ix, iz), ())}
+        out = []
+        for i in sorted(candidates):
+            box = self._boxes[i]
+            if all(box[k] <= maxs[k] and mins[k] <= box[k + 3] for k in range(3)):
+                out.append(self.names[i])
+        return out
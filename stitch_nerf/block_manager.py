@@ -1,34 +1,23 @@
-import os
-import glob
-import sqlite3
+import time
 import numpy as np
-from dataclasses import dataclass
+from dataclasses import dataclass, field
 from collections import defaultdict
 from typing import List, Dict
 
+import se3
+import metadata_db
+from portal_table import PortalTable, open_table
+from block_index import BlockIndex
+from snapshot_cache import SnapshotCache
+
 def load_block_transforms(db_path: str):
     """
-    Returns {block: T} and {block: T‑inv} where T is a 4×4 world‑from‑local matrix.
+    Returns {block: T} and {block: T‑inv} where T is a 4×4 float64 world‑from‑local matrix.
     """
-    f32 = np.float32
-    to_mat = lambda row: np.array(row, dtype=f32).reshape(4, 4)
-    transforms, inv_transforms = {}, {}
-
-    with sqlite3.connect(db_path) as conn:
-        cur = conn.execute("""
-            SELECT block_name,
-                   t00, t01, t02, t03,
-                   t10, t11, t12, t13,
-                   t20, t21, t22, t23,
-                   t30, t31, t32, t33
-            FROM block_transforms
-        """)
-        for row in cur.fetchall():
-            name, *vals = row
-            T = to_mat(vals)
-            transforms[name] = T
-            inv_transforms[name] = np.linalg.inv(T)
-
+    transforms = metadata_db.load_transforms(db_path)
+    names = list(transforms)
+    T_inv = se3.inverse([transforms[n] for n in names])
+    inv_transforms = dict(zip(names, T_inv))
     return transforms, inv_transforms
 
 
@@ -43,13 +32,16 @@ class Portal:
     dest_x: float
     dest_z: float
     radius_sq: float
+    # 4×4 float64 source‑local → destination‑local matrix, T_dest⁻¹ · T_src
+    transfer: np.ndarray = field(default=None, compare=False, repr=False)
 
 
-def load_portals(db_path: str):
+def load_portals(db_path: str, transforms=None):
     """
     Reads the portals table and returns:
         {Source_BLOCK: [Portal, Portal, ...], ...}
     Both directions are stored
+    If transforms ({block: T}) is given, every Portal carries its precomputed transfer matrix.
     """
 
     """
@@ -63,33 +55,99 @@ def load_portals(db_path: str):
     """
     portals: Dict[str, List[Portal]] = defaultdict(list)
     
-    # Run query to collect data
-    with sqlite3.connect(db_path) as conn:
-        cur = conn.execute("""
-             SELECT block_a, local_x_a, local_z_a,
-                   block_b, local_x_b, local_z_b,
-                   radius
-              FROM portals
-        """)
-        # Iterate over each portal and add it bidirectionally to portals
-        for (block_a, xa, za, block_b, xb, zb, r) in cur.fetchall():
-            r_sq = r * r
-            portals[block_a].append(Portal(xa, za, block_b, xb, zb, r_sq))
-
-    for block_name in portals:
-        print(" -", block_name)
+    # Run query to collect data, dropping the portal_id column
+    rows = [row[1:] for row in metadata_db.load_portals(db_path)]
+
+    transfers = [None] * len(rows)
+    if transforms is not None and rows:
+        for block in {row[0] for row in rows} | {row[3] for row in rows}:
+            if block not in transforms:
+                raise ValueError(f"Transform for block '{block}' not found.")
+        T_src = np.stack([transforms[row[0]] for row in rows])
+        T_dest = np.stack([transforms[row[3]] for row in rows])
+        transfers = se3.relative(T_src, T_dest)
+
+    # Iterate over each portal and add it bidirectionally to portals
+    for (block_a, xa, za, block_b, xb, zb, r), transfer in zip(rows, transfers):
+        r_sq = r * r
+        portals[block_a].append(Portal(xa, za, block_b, xb, zb, r_sq, transfer))
+
     return portals
 
+@dataclass
+class SiteMetadata:
+    """
+    Block transforms, portals and AABBs of a site. Loaded once and shared by
+    every BlockManager built from it (e.g. one per session in portal_service).
+    """
+    T: Dict[str, np.ndarray]
+    T_inv: Dict[str, np.ndarray]
+    portals: PortalTable
+    block_index: BlockIndex = None
+
+    @classmethod
+    def load(cls, db_path: str, portal_table=None):
+        """
+        portal_table: compiled PortalTable, or the path of one to memory-map
+            (compiled in memory, with a warning, if it is stale); by default the portals are
+            compiled from the database in memory. See portal_table.open_table.
+        """
+        T, T_inv = load_block_transforms(db_path)
+        if not isinstance(portal_table, PortalTable):
+            portal_table = open_table(db_path, portal_table, T)
+        aabbs = metadata_db.load_aabbs(db_path)
+        return cls(T, T_inv, portal_table, BlockIndex.from_aabbs(aabbs) if aabbs else None)
+
+
 class BlockManager:
-    def __init__(self, snapshots, db_path):
+    def __init__(self, snapshots, db_path, cache=None, prefetch_depth=1,
+                 max_check_interval=0.25, min_speed=0.5, safety=0.5, clock=time.perf_counter,
+                 proximity_switch=False, prefetch_radius=0.0, portal_table=None, site=None):
         """
         snapshots: List of (block_id, path_to_msgpack)
+        portal_table: see SiteMetadata.load
+        site: already loaded SiteMetadata to share; db_path and portal_table are then unused
+        cache: SnapshotCache used to serve block switches from memory (created
+            on first use if not given, so managers that never load snapshots
+            do not start one)
+        prefetch_depth: number of portal hops to prefetch around the current block
+        proximity_switch: also switch when the camera leaves the current block's AABB
+            for another block's, without a portal
+        prefetch_radius: also prefetch blocks whose AABB is within this many meters
+            of the current block's AABB
+        max_check_interval: longest time in seconds between two portal checks
+        min_speed: speed in m/s assumed for a camera that is standing still
+        safety: fraction of the time-to-contact to wait before the next check
         """
         self.snapshots = snapshots
         self.block_to_idx = {bid: i for i, (bid, _) in enumerate(snapshots)}
         self.curr_idx = 0
-        self.portals_by_block = load_portals(db_path) # load the portals
-        self.T, self.T_inv = load_block_transforms(db_path)
+        site = site if site is not None else SiteMetadata.load(db_path, portal_table)
+        self.T, self.T_inv = site.T, site.T_inv
+        self.portals = site.portals
+        self.last_pos = None # (x, z) of the previous check, in the current block's frame
+
+        # World-space block AABBs, for locating the camera without portals
+        self.block_index = site.block_index
+        self.proximity_switch = proximity_switch and self.block_index is not None
+        self.prefetch_radius = prefetch_radius
+        self._cache = cache
+        self.prefetch_depth = prefetch_depth
+
+        # Adaptive polling: next check is scheduled from speed and distance to the nearest portal
+        self.max_check_interval = max_check_interval
+        self.min_speed = min_speed
+        self.safety = safety
+        self.clock = clock
+        self.speed = 0.0
+        self.last_check_time = None
+        self.next_check_time = -np.inf
+
+    @property
+    def cache(self) -> SnapshotCache:
+        if self._cache is None:
+            self._cache = SnapshotCache()
+        return self._cache
 
     def get_current_block_id(self):
         return self.snapshots[self.curr_idx][0]
@@ -97,27 +155,167 @@ class BlockManager:
     def get_current_snapshot_path(self):
         return self.snapshots[self.curr_idx][1]
 
-    def check_switch(self, x, y, z, testbed):
+    def set_current_block(self, block_id):
         """
-        Returns (new_snapshot, new_x, new_z) if a portal is triggered,
-        or None otherwise.
+        Places the camera in block_id without a switch; the next check starts a new path.
+        """
+        self.curr_idx = self.block_to_idx[block_id]
+        self.last_pos = None
+        self.last_check_time = None
+        self.next_check_time = -np.inf
+
+    def reachable_blocks(self, block_id, depth=None):
+        """
+        Returns the blocks reachable from block_id within depth portal hops,
+        nearest first, excluding block_id itself.
+        """
+        depth = self.prefetch_depth if depth is None else depth
+        seen = {block_id}
+        frontier = [block_id]
+        reachable = []
+        for _ in range(depth):
+            next_frontier = []
+            for bid in frontier:
+                for dest in self.portals.destinations(bid):
+                    if dest not in seen and dest in self.block_to_idx:
+                        seen.add(dest)
+                        reachable.append(dest)
+                        next_frontier.append(dest)
+            frontier = next_frontier
+        return reachable
+
+    def nearby_blocks(self, block_id, radius=None):
+        """
+        Returns the blocks whose AABB is within radius of block_id's AABB,
+        excluding block_id itself.
+        """
+        radius = self.prefetch_radius if radius is None else radius
+        if self.block_index is None or block_id not in self.block_index:
+            return []
+        lo, hi = self.block_index.aabb(block_id)
+        return [bid for bid in self.block_index.overlapping(lo - radius, hi + radius)
+                if bid != block_id and bid in self.block_to_idx]
+
+    def prefetch(self):
+        """
+        Starts background reads of every snapshot reachable from the current
+        block, and of the blocks next to it when proximity switching is on or
+        prefetch_radius is set.
         """
         block_id = self.get_current_block_id()
-        for p in self.portals_by_block.get(block_id, ()):
-            dx = x - p.cx
-            dz = z - p.cz
-            # If radius is smaller, teleport
-            if dx*dx + dz*dz <= p.radius_sq:
-                
-                start_cam = np.eye(4, dtype=np.float32)
-                start_cam[:3, :4] = testbed.camera_matrix # set identity 3x4 to cam matrix
-
-                # 2. transform whole pose:   dest_local = T_dest_inv · T_src · cam
-                dest_cam = self.T_inv[p.dest_block] @ self.T[block_id] @ start_cam
-                dest_cam = dest_cam[:3, :4] # compress back to 3x4
-
-                self.curr_idx = self.block_to_idx[p.dest_block]
-                new_snapshot = self.get_current_snapshot_path()
-                print("Curr block: " + str(block_id) + " Dest block: " + str(p.dest_block))
-                return new_snapshot, dest_cam
-        return None
\ No newline at end of file
+        blocks = self.reachable_blocks(block_id)
+        if self.proximity_switch or self.prefetch_radius > 0:
+            blocks += [bid for bid in self.nearby_blocks(block_id) if bid not in blocks]
+        self.cache.prefetch([self.snapshots[self.block_to_idx[bid]][1] for bid in blocks])
+
+    def load_current(self, testbed):
+        """
+        Loads the current block's snapshot into the testbed from the cache and
+        prefetches its neighbours.
+        """
+        self.cache.load(testbed, self.get_current_snapshot_path())
+        self.prefetch()
+
+    def check_due(self, now=None):
+        """
+        True once the time scheduled by the previous check_switch has come.
+        """
+        now = self.clock() if now is None else now
+        return now >= self.next_check_time
+
+    def world_position(self, x, y, z):
+        """
+        World coordinates of a point in the current block's frame.
+        """
+        T = self.T[self.get_current_block_id()]
+        return T[:3, :3] @ (x, y, z) + T[:3, 3]
+
+    def block_at(self, x, y, z):
+        """
+        The block whose AABB contains the camera at (x, y, z) in the current
+        block's frame (the current block while it still does), or None.
+        """
+        if self.block_index is None:
+            return None
+        wx, wy, wz = self.world_position(x, y, z)
+        return self.block_index.locate(wx, wy, wz, self.get_current_block_id())
+
+    def time_to_contact(self, x, y, z, horizon=np.inf):
+        """
+        Earliest time in seconds the camera at (x, y, z) could touch a portal of
+        the current block (or, with proximity switching, leave its AABB),
+        assuming it keeps at most its current speed.
+        Portals more than horizon seconds away are not searched for (inf).
+        """
+        block_id = self.get_current_block_id()
+        index = self.portals.index(block_id)
+        speed = max(self.speed, self.min_speed)
+        distance = np.inf
+        if index is not None:
+            _, distance = index.nearest(x, z, speed * horizon)
+        if self.proximity_switch and block_id in self.block_index:
+            wx, _, wz = self.world_position(x, y, z)
+            distance = min(distance, self.block_index.exit_distance(block_id, wx, wz))
+        return distance / speed
+
+    def _schedule(self, now, x, y, z):
+        if self.safety <= 0:
+            self.next_check_time = now
+            return
+        # Portals further than the camera can travel before the next forced check don't matter
+        delay = self.safety * self.time_to_contact(x, y, z, self.max_check_interval / self.safety)
+        self.next_check_time = now + min(delay, self.max_check_interval)
+
+    def check_switch(self, x, y, z, testbed, now=None, hit=None):
+        """
+        Returns (new_snapshot, dest_cam) if the camera entered a portal since the
+        previous check (or, with proximity switching, moved into another
+        block's AABB), or None otherwise.
+        The swept segment from the previous position to (x, z) is tested, so a
+        portal is never skipped no matter how far the camera moved in between.
+        Also updates the camera speed and schedules the next check (see check_due).
+        hit: portal entered on this segment if a batched test already found it
+        (see PortalIndex.first_crossings), -1 for none; tested here when None.
+        """
+        now = self.clock() if now is None else now
+        block_id = self.get_current_block_id()
+        index = self.portals.index(block_id)
+        last_pos, self.last_pos = self.last_pos, (x, z)
+        if last_pos is not None and self.last_check_time is not None and now > self.last_check_time:
+            self.speed = np.hypot(x - last_pos[0], z - last_pos[1]) / (now - self.last_check_time)
+        self.last_check_time = now
+
+        if hit is None:
+            hit = -1
+            if index is not None:
+                if last_pos is None:
+                    hit = index.contains(x, z)
+                else:
+                    hit = index.first_crossing(last_pos[0], last_pos[1], x, z)
+        if hit >= 0:
+            row = self.portals.span(block_id)[0] + hit
+            return self._switch(block_id, self.portals.dest_block(row), self.portals.transfer(row), testbed, now)
+
+        if self.proximity_switch:
+            dest = self.block_at(x, y, z)
+            if dest is not None and dest != block_id and dest in self.block_to_idx:
+                transfer = se3.relative(self.T[block_id], self.T[dest])
+                return self._switch(block_id, dest, transfer, testbed, now)
+
+        self._schedule(now, x, y, z)
+        return None
+
+    def _switch(self, block_id, dest_block, transfer, testbed, now):
+        start_cam = np.eye(4)
+        start_cam[:3, :4] = testbed.camera_matrix # set identity 3x4 to cam matrix
+
+        # 2. transform whole pose:   dest_local = (T_dest_inv · T_src) · cam, precomputed per portal
+        dest_cam = transfer @ start_cam
+        dest_cam = dest_cam[:3, :4].astype(np.float32) # compress back to 3x4
+
+        self.curr_idx = self.block_to_idx[dest_block]
+        # The camera arrives inside the return portal; it has to leave it before re-entering
+        self.last_pos = (dest_cam[0, 3], dest_cam[2, 3])
+        self._schedule(now, dest_cam[0, 3], dest_cam[1, 3], dest_cam[2, 3])
+        new_snapshot = self.get_current_snapshot_path()
+        return new_snapshot, dest_cam
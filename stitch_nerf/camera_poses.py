@@ -0,0 +1,133 @@
+import hashlib
+import json
+import os
+import tempfile
+from dataclasses import dataclass
+
+import numpy as np
+
+CACHE_VERSION = 1
+SIDECAR_SUFFIX = ".poses.npz"
+
+
+@dataclass
+class CameraPoses:
+    """
+    All frames of one transforms.json as arrays.
+    poses: (N, 4, 4) float64 camera-to-world matrices
+    file_paths: (N,) image paths as written in transforms.json
+    sharpness: (N,) per-frame sharpness, NaN where missing
+    intrinsics: every top-level key of transforms.json except "frames"
+    """
+    poses: np.ndarray
+    file_paths: np.ndarray
+    sharpness: np.ndarray
+    intrinsics: dict
+
+    @property
+    def centers(self) -> np.ndarray:
+        return self.poses[:, :3, 3]
+
+    def __len__(self):
+        return len(self.poses)
+
+
+def sidecar_path(transforms_path: str) -> str:
+    return os.path.splitext(transforms_path)[0] + SIDECAR_SUFFIX
+
+
+def file_digest(path: str) -> str:
+    h = hashlib.sha1()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def parse_transforms(transforms_path: str) -> CameraPoses:
+    """
+    Parses transforms.json directly, bypassing the sidecar cache.
+    """
+    with open(transforms_path) as f:
+        data = json.load(f)
+
+    frames = data.pop("frames")
+    poses = np.array([frame["transform_matrix"] for frame in frames], dtype=np.float64).reshape(-1, 4, 4)
+    file_paths = np.array([frame.get("file_path", "") for frame in frames], dtype=str)
+    sharpness = np.array([frame.get("sharpness", np.nan) for frame in frames], dtype=np.float64)
+    return CameraPoses(poses, file_paths, sharpness, data)
+
+
+def _read_sidecar(cache_path, stat, transforms_path):
+    """
+    Returns (CameraPoses, stamp_is_current) if the sidecar matches the source file, else (None, False).
+    A changed mtime/size alone falls back to comparing content hashes.
+    """
+    with np.load(cache_path) as z:
+        if int(z["version"]) != CACHE_VERSION:
+            return None, False
+        stamp_ok = int(z["mtime_ns"]) == stat.st_mtime_ns and int(z["size"]) == stat.st_size
+        if not stamp_ok and str(z["sha1"]) != file_digest(transforms_path):
+            return None, False
+        poses = CameraPoses(z["poses"], z["file_paths"], z["sharpness"], json.loads(str(z["intrinsics"])))
+        return poses, stamp_ok
+
+
+def _write_sidecar(cache_path, stat, transforms_path, poses: CameraPoses):
+    # A uniquely named temp file, so concurrent loaders never clobber each other's output
+    tmp_path = None
+    try:
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(cache_path) or ".",
+                                        prefix=os.path.basename(cache_path) + ".", suffix=".tmp")
+        with os.fdopen(fd, "wb") as f:
+            np.savez(
+                f,
+                version=CACHE_VERSION,
+                mtime_ns=stat.st_mtime_ns,
+                size=stat.st_size,
+                sha1=file_digest(transforms_path),
+                poses=poses.poses,
+                file_paths=poses.file_paths,
+                sharpness=poses.sharpness,
+                intrinsics=json.dumps(poses.intrinsics),
+            )
+        os.replace(tmp_path, cache_path)
+    except OSError as e:
+        print(f"Could not write pose cache {cache_path}: {e}")
+        if tmp_path is not None and os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+
+def load_poses(transforms_path: str, use_cache: bool = True) -> CameraPoses:
+    """
+    Loads every camera pose of a transforms.json in one vectorized read.
+    The parsed arrays are kept in a .poses.npz sidecar next to the file and
+    reused until the source changes (mtime/size, then content hash).
+    """
+    if not use_cache:
+        return parse_transforms(transforms_path)
+
+    stat = os.stat(transforms_path)
+    cache_path = sidecar_path(transforms_path)
+    if os.path.exists(cache_path):
+        try:
+            poses, stamp_ok = _read_sidecar(cache_path, stat, transforms_path)
+        except (OSError, ValueError, KeyError) as e:
+            print(f"Ignoring unreadable pose cache {cache_path}: {e}")
+            poses, stamp_ok = None, False
+        if poses is not None:
+            if not stamp_ok:
+                # Content unchanged (e.g. touched or re-copied); refresh the stamp
+                _write_sidecar(cache_path, stat, transforms_path, poses)
+            return poses
+
+    poses = parse_transforms(transforms_path)
+    _write_sidecar(cache_path, stat, transforms_path, poses)
+    return poses
+
+
+def load_camera_centers(transforms_path: str) -> np.ndarray:
+    """
+    Returns the (N, 3) camera centers of a transforms.json.
+    """
+    return load_poses(transforms_path).centers
@@ -0,0 +1,232 @@
+"""
+Per-block cache of preprocessed point clouds.
+
+Every .ply gets a sidecar directory (<name>.cloud/) holding, per voxel size,
+the downsampled points and normals as .npy files that are opened memory-mapped,
+and optionally a pickled SciPy cKDTree over the points (tagged with the SciPy
+version that wrote it; other versions rebuild it). The cache is reused
+until the .ply changes (mtime/size, then content hash), so alignment and
+visualization tools open a block's cloud and search tree in near-zero time
+instead of parsing the PLY and rebuilding the tree on every run.
+"""
+import argparse
+import json
+import os
+import pickle
+import shutil
+import tempfile
+from dataclasses import dataclass
+from typing import Optional
+
+import numpy as np
+import scipy
+from scipy.spatial import cKDTree
+
+from camera_poses import file_digest
+from icp_engine import voxel_downsample
+from ply_io import read_ply
+
+CACHE_VERSION = 2
+CACHE_SUFFIX = ".cloud"
+SOURCE_FILE = "source.json"
+
+# Clouds opened by this process: (abspath, voxel_size) -> (stamp, BlockCloud)
+_open_clouds = {}
+
+
+def cache_dir(ply_path: str) -> str:
+    return os.path.splitext(ply_path)[0] + CACHE_SUFFIX
+
+
+def _level_name(voxel_size: float) -> str:
+    return f"v{voxel_size:g}"
+
+
+def _tree_name(voxel_size: float) -> str:
+    # Pickled cKDTrees are only read back by the SciPy version that wrote them
+    return f"{_level_name(voxel_size)}.tree-scipy{scipy.__version__}.pkl"
+
+
+def _atomic_write(path, write):
+    """
+    Writes path through a uniquely named temp file, so concurrent writers
+    (ICP worker processes sharing a block) never clobber each other's output.
+    """
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path) or ".", prefix=os.path.basename(path) + ".", suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            write(f)
+        os.replace(tmp_path, path)
+    except BaseException:
+        try:
+            os.remove(tmp_path)
+        except OSError:
+            pass
+        raise
+
+
+@dataclass
+class BlockCloud:
+    """
+    One cached level of a block's cloud. points and normals are read-only
+    memory maps; tree loads (or builds and saves) the KD-tree on first use.
+    """
+    ply_path: str
+    voxel_size: float
+    points: np.ndarray
+    normals: Optional[np.ndarray]
+    tree_path: str
+    _tree: cKDTree = None
+
+    def __len__(self):
+        return len(self.points)
+
+    @property
+    def tree(self) -> cKDTree:
+        if self._tree is None:
+            if os.path.exists(self.tree_path):
+                try:
+                    with open(self.tree_path, "rb") as f:
+                        tree = pickle.load(f)
+                    if isinstance(tree, cKDTree) and tree.n == len(self.points):
+                        self._tree = tree
+                except Exception as e:
+                    print(f"Ignoring unreadable KD-tree cache {self.tree_path}: {e}")
+            if self._tree is None:
+                self._tree = cKDTree(self.points)
+                try:
+                    _atomic_write(self.tree_path, lambda f: pickle.dump(self._tree, f, protocol=pickle.HIGHEST_PROTOCOL))
+                except OSError as e:
+                    print(f"Could not write KD-tree cache {self.tree_path}: {e}")
+        return self._tree
+
+
+def _validate_source(directory: str, ply_path: str, stat) -> bool:
+    """
+    True if the cache in directory was built from the current .ply. A changed
+    mtime/size alone falls back to comparing content hashes (and refreshes the stamp).
+    """
+    source_path = os.path.join(directory, SOURCE_FILE)
+    if not os.path.exists(source_path):
+        return False
+    try:
+        with open(source_path) as f:
+            source = json.load(f)
+    except (OSError, ValueError):
+        return False
+    if source.get("version") != CACHE_VERSION:
+        return False
+    if source["mtime_ns"] == stat.st_mtime_ns and source["size"] == stat.st_size:
+        return True
+    if source["sha1"] != file_digest(ply_path):
+        return False
+    _write_source(directory, ply_path, stat, source["sha1"])
+    return True
+
+
+def _write_source(directory, ply_path, stat, sha1=None):
+    source = {
+        "version": CACHE_VERSION,
+        "mtime_ns": stat.st_mtime_ns,
+        "size": stat.st_size,
+        "sha1": sha1 or file_digest(ply_path),
+    }
+    _atomic_write(os.path.join(directory, SOURCE_FILE), lambda f: f.write(json.dumps(source).encode()))
+
+
+def _build_level(directory, ply_path, voxel_size):
+    points, normals = read_ply(ply_path)
+    if voxel_size > 0:
+        if normals is not None:
+            merged = voxel_downsample(np.hstack([points, normals]), voxel_size)
+            points, normals = merged[:, :3], merged[:, 3:]
+            norm = np.linalg.norm(normals, axis=1, keepdims=True)
+            normals = normals / np.where(norm > 0, norm, 1.0)
+        else:
+            points = voxel_downsample(points, voxel_size)
+
+    level = _level_name(voxel_size)
+    _atomic_write(os.path.join(directory, level + ".points.npy"), lambda f: np.save(f, points))
+    if normals is not None:
+        _atomic_write(os.path.join(directory, level + ".normals.npy"), lambda f: np.save(f, normals))
+
+
+def _replace_cache(directory, ply_path, stat):
+    """
+    Installs an empty cache for the current .ply at directory. It is built in a
+    unique sibling and renamed into place, so processes that find the same
+    stale cache at once never delete or write into a directory another one
+    is populating.
+    """
+    parent = os.path.dirname(directory) or "."
+    stem = os.path.basename(directory)[:-len(CACHE_SUFFIX)]
+    fresh = tempfile.mkdtemp(dir=parent, prefix=stem + ".tmp-", suffix=CACHE_SUFFIX)
+    try:
+        _write_source(fresh, ply_path, stat)
+        if os.path.isdir(directory) and not _validate_source(directory, ply_path, stat):
+            stale = tempfile.mkdtemp(dir=parent, prefix=stem + ".stale-", suffix=CACHE_SUFFIX)
+            try:
+                os.replace(directory, stale)
+            except OSError:
+                pass  # another process moved it first
+            shutil.rmtree(stale, ignore_errors=True)
+        try:
+            os.rename(fresh, directory)
+        except OSError:
+            pass  # another process installed a fresh cache first; use theirs
+    finally:
+        shutil.rmtree(fresh, ignore_errors=True)
+
+
+def load_cloud(ply_path: str, voxel_size: float = 0.0, build_tree: bool = False) -> BlockCloud:
+    """
+    Opens the cached cloud of ply_path at voxel_size (0 = full resolution),
+    building the cache first if it is missing or stale. build_tree also
+    loads (or builds) the KD-tree right away.
+    """
+    key = (os.path.abspath(ply_path), float(voxel_size))
+    stat = os.stat(ply_path)
+    stamp = (stat.st_mtime_ns, stat.st_size)
+    opened = _open_clouds.get(key)
+    if opened is not None and opened[0] == stamp:
+        cloud = opened[1]
+    else:
+        directory = cache_dir(ply_path)
+        if not _validate_source(directory, ply_path, stat):
+            _replace_cache(directory, ply_path, stat)
+
+        level = os.path.join(directory, _level_name(voxel_size))
+        if not os.path.exists(level + ".points.npy"):
+            _build_level(directory, ply_path, voxel_size)
+        normals = np.load(level + ".normals.npy", mmap_mode="r") if os.path.exists(level + ".normals.npy") else None
+        cloud = BlockCloud(ply_path, float(voxel_size), np.load(level + ".points.npy", mmap_mode="r"),
+                           normals, os.path.join(directory, _tree_name(voxel_size)))
+        _open_clouds[key] = (stamp, cloud)
+
+    if build_tree:
+        cloud.tree  # loads or builds it now rather than on first query
+    return cloud
+
+
+def pair_levels(source_path: str, target_path: str, build_tree: bool = True):
+    """
+    Level loader for icp_engine.register / multiscale_icp that serves both
+    clouds of a pair, and the target's KD-tree, from the cache.
+    """
+    def load(voxel_size):
+        target = load_cloud(target_path, voxel_size, build_tree)
+        return load_cloud(source_path, voxel_size).points, target.points, target.tree if build_tree else None
+    return load
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Prebuild the cached clouds and KD-trees of block .ply files")
+    parser.add_argument("ply", nargs="+", help="Block .ply files")
+    parser.add_argument("--voxel_sizes", type=float, nargs="+", default=[0.0], help="Voxel sizes to cache (0 = full resolution)")
+    parser.add_argument("--no_tree", action="store_true", help="Skip building KD-trees")
+    args = parser.parse_args()
+
+    for path in args.ply:
+        for voxel_size in args.voxel_sizes:
+            cloud = load_cloud(path, voxel_size, build_tree=not args.no_tree)
+            print(f"{path} @ {voxel_size:g}: {len(cloud)} points cached in {cache_dir(path)}")
@@ -1,100 +1,124 @@
-import sqlite3
+import argparse
 import numpy as np
 import csv
 
-def load_transform_matrix(conn, block_name):
-    c = conn.cursor()
-    c.execute("""
-        SELECT t00, t01, t02, t03,
-               t10, t11, t12, t13,
-               t20, t21, t22, t23,
-               t30, t31, t32, t33
-        FROM block_transforms
-        WHERE block_name = ?
-    """, (block_name,))
-    row = c.fetchone()
-    if row is None:
-        raise ValueError(f"Transform for block '{block_name}' not found.")
-    return np.array(row).reshape(4, 4)
+import se3
+import metadata_db
+from portal_table import compile_table
 
-def ensure_portals_table_exists(conn):
-    c = conn.cursor()
-    c.execute("DROP TABLE IF EXISTS portals")
-    c.execute("""
-        CREATE TABLE portals (
-            portal_id TEXT PRIMARY KEY,
-            block_a TEXT,
-            local_x_a REAL,
-            local_z_a REAL,
-            block_b TEXT,
-            local_x_b REAL,
-            local_z_b REAL,
-            radius REAL
-        )
-    """)
-    conn.commit()
+def clear_portals(db_path):
+    """
+    Removes every portal; the table itself is created by metadata_db.
+    """
+    conn = metadata_db.connect(db_path, write=True)
+    with conn:
+        conn.execute("DELETE FROM portals")
 
-def add_portals_from_csv(conn, csv_path, radius=0.5):
-    c = conn.cursor()
+def default_portal_id(block_a, x_a, z_a, block_b):
+    # + 0.0 turns a rounded -0.0 into 0.0
+    return f"{block_a}_to_{block_b}_{round(x_a, 3) + 0.0:.3f}_{round(z_a, 3) + 0.0:.3f}"
+
+def reverse_portal_id(portal_id):
+    """
+    Id of the B -> A portal created for the A -> B portal portal_id. It is
+    never derived from the block names, so the reverse of `A,1,2,B` cannot
+    collide with the forward id of `B,1,2,A`.
+    """
+    return f"{portal_id}_rev"
+
+def load_portals_csv(csv_path):
+    """
+    Reads portal definitions, one per row:
+        block_a, x_a, z_a, block_b[, portal_id]
+    Without an explicit id the portal is named after its content,
+    {block_a}_to_{block_b}_{x_a}_{z_a} with the point rounded to millimetres,
+    so inserting or reordering rows does not rename the other portals.
+    Returns (ids, block_a list, (N, 2) x/z array, block_b list).
+    """
+    ids, blocks_a, points, blocks_b = [], [], [], []
+    seen = set()
     with open(csv_path, newline='') as csvfile:
-        reader = csv.reader(csvfile)
-        for idx, row in enumerate(reader):
-            block_a, x_a, z_a, block_b = row
-            x_a, z_a = float(x_a), float(z_a)
+        for row in csv.reader(csvfile):
+            row = [field.strip() for field in row]
+            if not row:
+                continue
+            block_a, x_a, z_a, block_b = row[:4]
+            portal_id = row[4] if len(row) > 4 and row[4] else default_portal_id(block_a, float(x_a), float(z_a), block_b)
+            base, n = portal_id, 1
+            while portal_id in seen:  # duplicate rows
+                n += 1
+                portal_id = f"{base}_{n}"
+            seen.add(portal_id)
+            ids.append(portal_id)
+            blocks_a.append(block_a)
+            points.append((float(x_a), float(z_a)))
+            blocks_b.append(block_b)
+    return ids, blocks_a, np.array(points, dtype=np.float64).reshape(-1, 2), blocks_b
 
-            T_a = load_transform_matrix(conn, block_a)
-            T_b = load_transform_matrix(conn, block_b)
+def compile_portal_rows(transforms, ids, blocks_a, points_a, blocks_b, radius=0.5):
+    """
+    Maps every portal point from block A into block B in one batched
+    transform and returns portal rows for both directions.
+    """
+    for block in set(blocks_a) | set(blocks_b):
+        if block not in transforms:
+            raise ValueError(f"Transform for block '{block}' not found.")
+    if not ids:
+        return []
 
-            # Local A → Global
-            local_a = np.array([x_a, 0.0, z_a, 1.0])
-            global_pos = T_a @ local_a
+    # Local A → Global → Local B for all portals at once
+    T_a = np.stack([transforms[b] for b in blocks_a])
+    T_b = np.stack([transforms[b] for b in blocks_b])
+    local_a = np.column_stack([points_a[:, 0], np.zeros(len(points_a)), points_a[:, 1]])
+    local_b = se3.transform_points(se3.relative(T_a, T_b), local_a)
 
-            # Global → Local B
-            T_b_inv = np.linalg.inv(T_b)
-            local_b = T_b_inv @ global_pos
-            x_b, z_b = local_b[0], local_b[2]
+    rows = []
+    for portal_id, block_a, (x_a, z_a), block_b, (x_b, _, z_b) in zip(ids, blocks_a, points_a.tolist(), blocks_b, local_b.tolist()):
+        rows.append((portal_id, block_a, x_a, z_a, block_b, x_b, z_b, radius))
+        rows.append((reverse_portal_id(portal_id), block_b, x_b, z_b, block_a, x_a, z_a, radius))
 
-            portal_id = f"{block_a}_to_{block_b}_{idx}"
+    # A reverse id can still clash with an explicit id from the CSV
+    seen = set()
+    for row in rows:
+        if row[0] in seen:
+            raise ValueError(f"Portal id '{row[0]}' is used twice; rename it in the CSV")
+        seen.add(row[0])
+    return rows
 
-            # Insert A → B
-            c.execute("""
-                INSERT INTO portals (
-                    portal_id,
-                    block_a, local_x_a, local_z_a,
-                    block_b, local_x_b, local_z_b,
-                    radius
-                ) VALUES (?, ?, ?, ?, ?, ?, ?, ?)
-            """, (
-                portal_id,
-                block_a, x_a, z_a,
-                block_b, x_b, z_b,
-                radius
-            ))
+def add_portals_from_csv(db_path, csv_path, radius=0.5, prune=True):
+    """
+    Syncs the portals table with the CSV. Only rows that are new or changed are
+    upserted; with prune, portals no longer in the CSV are deleted.
+    Returns (upserted, deleted) row counts.
+    """
+    metadata_db.connect(db_path, write=True)  # migrates an older database
+    transforms = metadata_db.load_transforms(db_path)
+    rows = compile_portal_rows(transforms, *load_portals_csv(csv_path), radius=radius)
 
-            # Insert B → A
-            reverse_id = f"{block_b}_to_{block_a}_{idx}"
-            c.execute("""
-                INSERT INTO portals (
-                    portal_id,
-                    block_a, local_x_a, local_z_a,
-                    block_b, local_x_b, local_z_b,
-                    radius
-                ) VALUES (?, ?, ?, ?, ?, ?, ?, ?)
-            """, (
-                reverse_id,
-                block_b, x_b, z_b,
-                block_a, x_a, z_a,
-                radius
-            ))
+    existing = {row[0]: row for row in metadata_db.load_portals(db_path)}
+    changed = [row for row in rows if existing.get(row[0]) != row]
+    stale = set(existing) - {row[0] for row in rows} if prune else set()
 
-    conn.commit()
+    metadata_db.upsert_portals(db_path, changed)
+    metadata_db.delete_portals(db_path, sorted(stale))
+    return len(changed), len(stale)
 
-if __name__ == "__main__":
-    metadata_db_path = "metadata.sqlite"
-    csv_path = "portals.csv"
+def main():
+    parser = argparse.ArgumentParser(description="Populate the portals table from a CSV of portal definitions.")
+    parser.add_argument("--db", default="metadata.sqlite", help="Path to metadata.sqlite")
+    parser.add_argument("--csv", default="portals.csv", help="CSV rows: block_a, x_a, z_a, block_b[, portal_id]")
+    parser.add_argument("--radius", type=float, default=0.5, help="Portal radius")
+    parser.add_argument("--rebuild", action="store_true", help="Clear the portals table before populating it")
+    parser.add_argument("--keep_stale", action="store_true", help="Keep portals that are no longer in the CSV")
+    parser.add_argument("--table", default=None, help="Also compile the portal table for BlockManager to this .npy")
+    args = parser.parse_args()
 
-    conn = sqlite3.connect(metadata_db_path)
-    ensure_portals_table_exists(conn)
-    add_portals_from_csv(conn, csv_path)
-    conn.close()
-    print("Portals successfully populated.")
+    if args.rebuild:
+        clear_portals(args.db)
+    upserted, deleted = add_portals_from_csv(args.db, args.csv, args.radius, prune=not args.keep_stale)
+    print(f"Portals successfully populated ({upserted} upserted, {deleted} removed).")
+    if args.table:
+        compile_table(args.db, args.table)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,37 @@
+import numpy as np
+import pytest
+
+import metadata_db
+from define_portals import add_portals_from_csv, compile_portal_rows, load_portals_csv
+
+TRANSFORMS = {"A": np.eye(4), "B": np.eye(4)}
+
+
+def write_csv(tmp_path, text):
+    path = tmp_path / "portals.csv"
+    path.write_text(text)
+    return str(path)
+
+
+def test_opposite_portals_at_the_same_point_get_distinct_ids(tmp_path):
+    csv_path = write_csv(tmp_path, "A,1,2,B\nB,1,2,A\n")
+    rows = compile_portal_rows(TRANSFORMS, *load_portals_csv(csv_path))
+    assert len(rows) == 4
+    assert len({row[0] for row in rows}) == 4
+
+    db_path = str(tmp_path / "metadata.sqlite")
+    metadata_db.store_transforms(db_path, TRANSFORMS)
+    assert add_portals_from_csv(db_path, csv_path) == (4, 0)
+    assert len(metadata_db.load_portals(db_path)) == 4
+    metadata_db.close_all()
+
+
+def test_duplicate_rows_are_numbered(tmp_path):
+    ids = load_portals_csv(write_csv(tmp_path, "A,1,2,B\nA,1,2,B\n"))[0]
+    assert ids == ["A_to_B_1.000_2.000", "A_to_B_1.000_2.000_2"]
+
+
+def test_explicit_id_clashing_with_a_reverse_id_raises(tmp_path):
+    csv_path = write_csv(tmp_path, "A,1,2,B,door\nB,5,5,A,door_rev\n")
+    with pytest.raises(ValueError, match="door_rev"):
+        compile_portal_rows(TRANSFORMS, *load_portals_csv(csv_path))
@@ -0,0 +1,223 @@
+import importlib.util
+from dataclasses import dataclass
+
+import numpy as np
+from scipy.spatial import cKDTree
+
+_o3d = None
+
+
+def open3d_available() -> bool:
+    """
+    True if Open3D is installed, without paying for importing it.
+    """
+    return _o3d is not None or importlib.util.find_spec("open3d") is not None
+
+
+def load_open3d():
+    """
+    Imports Open3D on first use. It takes seconds to import, so only code
+    paths that actually call into it load it.
+    """
+    global _o3d
+    if _o3d is None:
+        import open3d
+        _o3d = open3d
+    return _o3d
+
+
+@dataclass
+class ICPResult:
+    """
+    Same fields as Open3D's RegistrationResult that the pipeline reads.
+    """
+    transformation: np.ndarray
+    fitness: float
+    inlier_rmse: float
+
+
+def available_engines():
+    return ["numpy", "open3d"] if open3d_available() else ["numpy"]
+
+
+def resolve_engine(engine: str) -> str:
+    """
+    "auto" picks Open3D when it is importable and the NumPy/SciPy engine otherwise.
+    """
+    if engine == "auto":
+        return "open3d" if open3d_available() else "numpy"
+    if engine == "open3d" and not open3d_available():
+        raise RuntimeError("Open3D engine requested but open3d is not installed")
+    if engine not in ("numpy", "open3d"):
+        raise ValueError(f"Unknown ICP engine '{engine}'")
+    return engine
+
+
+def voxel_downsample(points: np.ndarray, voxel_size: float) -> np.ndarray:
+    """
+    Replaces the points in every occupied voxel by their centroid, like
+    Open3D's voxel_down_sample. voxel_size <= 0 returns the points unchanged.
+    Columns after x, y, z (e.g. normals) are averaged per voxel as well.
+    """
+    if not voxel_size or voxel_size <= 0:
+        return points
+    keys = np.floor(points[:, :3] / voxel_size).astype(np.int64)
+    _, inverse, counts = np.unique(keys, axis=0, return_inverse=True, return_counts=True)
+    inverse = inverse.ravel()
+    sums = np.zeros((len(counts), points.shape[1]))
+    np.add.at(sums, inverse, points)
+    return sums / counts[:, None]
+
+
+def best_fit_transform(source: np.ndarray, target: np.ndarray) -> np.ndarray:
+    """
+    Least-squares rigid transform mapping source points onto target points (Kabsch).
+    """
+    mu_s = source.mean(axis=0)
+    mu_t = target.mean(axis=0)
+    H = (source - mu_s).T @ (target - mu_t)
+    U, _, Vt = np.linalg.svd(H)
+    D = np.eye(3)
+    D[2, 2] = np.sign(np.linalg.det(Vt.T @ U.T))
+    R = Vt.T @ D @ U.T
+
+    T = np.eye(4)
+    T[:3, :3] = R
+    T[:3, 3] = mu_t - R @ mu_s
+    return T
+
+
+def _transform(points, T):
+    return points @ T[:3, :3].T + T[:3, 3]
+
+
+def _evaluate(source, tree, threshold):
+    """
+    Returns (fitness, inlier_rmse, source_idx, target_idx) for the current correspondences.
+    """
+    dist, idx = tree.query(source, distance_upper_bound=threshold, workers=-1)
+    inliers = np.isfinite(dist)
+    n = int(inliers.sum())
+    if n == 0:
+        return 0.0, 0.0, np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64)
+    fitness = n / len(source)
+    rmse = float(np.sqrt(np.mean(dist[inliers] ** 2)))
+    return fitness, rmse, np.flatnonzero(inliers), idx[inliers]
+
+
+def icp_numpy(source: np.ndarray, target: np.ndarray, threshold: float, init: np.ndarray,
+              max_iteration: int = 30, relative_fitness: float = 1e-6, relative_rmse: float = 1e-6,
+              tree: cKDTree = None) -> ICPResult:
+    """
+    Point-to-point ICP of source onto target on a SciPy cKDTree, following
+    Open3D's registration_icp loop and convergence test. Pass a prebuilt tree
+    over target to reuse it across calls.
+    """
+    if tree is None:
+        tree = cKDTree(target)
+    transformation = np.array(init, dtype=np.float64)
+    moved = _transform(source, transformation)
+    fitness, rmse, src_idx, tgt_idx = _evaluate(moved, tree, threshold)
+
+    for _ in range(max_iteration):
+        if len(src_idx) < 3:
+            break
+        update = best_fit_transform(moved[src_idx], target[tgt_idx])
+        transformation = update @ transformation
+        moved = _transform(moved, update)
+
+        prev_fitness, prev_rmse = fitness, rmse
+        fitness, rmse, src_idx, tgt_idx = _evaluate(moved, tree, threshold)
+        if abs(prev_fitness - fitness) < relative_fitness and abs(prev_rmse - rmse) < relative_rmse:
+            break
+
+    return ICPResult(transformation, fitness, rmse)
+
+
+def icp_open3d(source: np.ndarray, target: np.ndarray, threshold: float, init: np.ndarray,
+               max_iteration: int = 30) -> ICPResult:
+    """
+    Point-to-point ICP through Open3D's registration_icp.
+    """
+    o3d = load_open3d()
+    pcd_source = o3d.geometry.PointCloud(o3d.utility.Vector3dVector(source))
+    pcd_target = o3d.geometry.PointCloud(o3d.utility.Vector3dVector(target))
+    result = o3d.pipelines.registration.registration_icp(
+        pcd_source, pcd_target, threshold,
+        init,
+        o3d.pipelines.registration.TransformationEstimationPointToPoint(),
+        o3d.pipelines.registration.ICPConvergenceCriteria(max_iteration=max_iteration)
+    )
+    return ICPResult(np.asarray(result.transformation), result.fitness, result.inlier_rmse)
+
+
+def default_pyramid(threshold: float, voxel_size: float, levels: int = 3):
+    """
+    Voxel sizes and thresholds that halve at every level and end at
+    (voxel_size, threshold) on the finest one.
+    """
+    scales = [2 ** (levels - 1 - i) for i in range(levels)]
+    return [voxel_size * s for s in scales], [threshold * s for s in scales]
+
+
+def multiscale_icp(source: np.ndarray, target: np.ndarray, init: np.ndarray,
+                   voxel_sizes, thresholds, max_iterations=30, engine: str = "auto",
+                   level_clouds=None) -> ICPResult:
+    """
+    Coarse-to-fine ICP over a voxel-downsampled pyramid. Each level starts from
+    the previous level's transformation; the search structure over the target is
+    built once per level. fitness and inlier_rmse are those of the finest level.
+    level_clouds(voxel_size) -> (source, target, target_tree or None) supplies
+    prebuilt levels (e.g. from cloud_store) instead of downsampling here.
+    """
+    engine = resolve_engine(engine)
+    if np.isscalar(max_iterations):
+        max_iterations = [max_iterations] * len(voxel_sizes)
+
+    transformation = np.array(init, dtype=np.float64)
+    result = None
+    for voxel_size, threshold, max_iteration in zip(voxel_sizes, thresholds, max_iterations):
+        if level_clouds is not None:
+            source_l, target_l, tree = level_clouds(voxel_size)
+        else:
+            source_l, target_l, tree = voxel_downsample(source, voxel_size), voxel_downsample(target, voxel_size), None
+        if engine == "numpy":
+            result = icp_numpy(source_l, target_l, threshold, transformation, max_iteration, tree=tree)
+        else:
+            result = icp_open3d(source_l, target_l, threshold, transformation, max_iteration)
+        transformation = result.transformation
+    return result
+
+
+def register(source: np.ndarray, target: np.ndarray, init: np.ndarray, threshold: float,
+             engine: str = "auto", levels: int = 1, voxel_size: float = 0.0, max_iteration: int = 30,
+             level_clouds=None) -> ICPResult:
+    """
+    Registers source onto target. levels == 1 is a single full-resolution ICP,
+    equivalent to registration_icp; levels > 1 runs the coarse-to-fine pyramid
+    ending at voxel_size and threshold. See multiscale_icp for level_clouds.
+    """
+    if levels <= 1:
+        return multiscale_icp(source, target, init, [0.0], [threshold], max_iteration, engine, level_clouds)
+    voxel_sizes, thresholds = default_pyramid(threshold, voxel_size, levels)
+    return multiscale_icp(source, target, init, voxel_sizes, thresholds, max_iteration, engine, level_clouds)
+
+
+def information_matrix(source: np.ndarray, target: np.ndarray, threshold: float, transformation: np.ndarray,
+                       tree: cKDTree = None) -> np.ndarray:
+    """
+    6×6 information matrix of a registration, matching Open3D's
+    get_information_matrix_from_point_clouds.
+    """
+    if tree is None:
+        tree = cKDTree(target)
+    moved = _transform(source, transformation)
+    _, _, _, tgt_idx = _evaluate(moved, tree, threshold)
+    x, y, z = target[tgt_idx].T
+    zeros, ones = np.zeros_like(x), np.ones_like(x)
+    G = np.stack([
+        np.stack([zeros, z, -y, ones, zeros, zeros], axis=1),
+        np.stack([-z, zeros, x, zeros, ones, zeros], axis=1),
+        np.stack([y, -x, zeros, zeros, zeros, ones], axis=1),
+    ], axis=1)  # (n, 3, 6)
+    return np.einsum("nki,nkj->ij", G, G)
@@ -1,41 +1,35 @@
-import sqlite3
-import numpy as np
+import os
 import argparse
 
-def load_metadata(db_path: str):
-    conn = sqlite3.connect(db_path)
-    c = conn.cursor()
-
-    # Check if table exists
-    c.execute("""
-        SELECT name FROM sqlite_master
-        WHERE type='table' AND name='block_transforms'
-    """)
-    if not c.fetchone():
-        raise RuntimeError("No 'block_transforms' table found in this database.")
+import metadata_db
 
-    # Load all rows
-    c.execute("SELECT * FROM block_transforms")
-    rows = c.fetchall()
-    column_names = [desc[0] for desc in c.description]
-
-    conn.close()
-    return column_names, rows
+def load_metadata(db_path: str):
+    """
+    Returns {block_name: 4×4 transform} for every block in the database.
+    """
+    if not os.path.exists(db_path):
+        raise RuntimeError(f"No database found at {db_path}.")
+    return metadata_db.load_transforms(db_path)
 
 def print_metadata(db_path: str):
-    _, rows = load_metadata(db_path)
-    for row in rows:
-        block_name = row[0]
-        transform = np.array(row[1:17]).reshape((4, 4))
-
+    transforms = load_metadata(db_path)
+    aabbs = metadata_db.load_aabbs(db_path)
+    print(f"Schema version: {metadata_db.schema_version(metadata_db.connect(db_path))}")
+    for block_name, transform in transforms.items():
         print("="*50)
         print(f"Block: {block_name}")
         print("Transform (T_block_to_global):")
         print(transform)
+        if block_name in aabbs:
+            lo, hi = aabbs[block_name]
+            print(f"AABB (world): min {lo} max {hi}")
 
-if __name__ == "__main__":
+def main():
     parser = argparse.ArgumentParser(description="Print all stored transforms and AABBs in metadata.sqlite")
     parser.add_argument("db", help="Path to metadata.sqlite")
     args = parser.parse_args()
 
     print_metadata(args.db)
+
+if __name__ == "__main__":
+    main()
@@ -1,26 +1,15 @@
-import open3d as o3d
 import numpy as np
-import json
 import argparse
 import copy
 import os
 
-# ====== Utility to load camera centers from transforms.json ======
-
-def load_camera_centers(transforms_path: str) -> np.ndarray:
-    with open(transforms_path) as f:
-        data = json.load(f)
-
-    points = []
-    for frame in data["frames"]:
-        T = np.array(frame["transform_matrix"])
-        camera_center = T[:3, 3]
-        points.append(camera_center)
-    return np.array(points)
+import icp_engine
+from camera_poses import load_camera_centers
 
 # ====== Manual Alignment Script ======
 
 def manual_align(ref_path, target_path, save_path=None):
+    o3d = icp_engine.load_open3d()
 
     if save_path is None:
         block_dir = os.path.dirname(target_path)
@@ -0,0 +1,418 @@
+"""
+Shared access layer for metadata.sqlite.
+
+Every tool goes through connect(), which hands out one reusable connection
+per database and thread. Reading never changes a database: readers need the
+current schema and raise otherwise. Write paths create a missing database
+and migrate an older one (switching it to WAL), as does the explicit
+`stitch_nerf.py migrate` command.
+Transforms are stored as packed little-endian float64 blobs (16 values,
+row-major), so loading thousands of blocks is one query and one frombuffer.
+"""
+import argparse
+import os
+import pathlib
+import sqlite3
+import threading
+import time
+
+import numpy as np
+
+_TRANSFORM_DTYPE = np.dtype("<f8")
+_LEGACY_COLUMNS = [f"t{i}{j}" for i in range(4) for j in range(4)]
+
+# Per thread: {abspath: connection}, and the pid that opened them
+_local = threading.local()
+
+
+def pack_transform(T) -> bytes:
+    return np.asarray(T, dtype=_TRANSFORM_DTYPE).reshape(16).tobytes()
+
+
+def unpack_transforms(blobs) -> np.ndarray:
+    """
+    Unpacks a sequence of transform blobs into a (N, 4, 4) float64 array.
+    """
+    return np.frombuffer(b"".join(blobs), dtype=_TRANSFORM_DTYPE).reshape(-1, 4, 4).copy()
+
+
+# ====== Schema ======
+
+def _table_columns(conn, table):
+    return [row[1] for row in conn.execute(f"PRAGMA table_info({table})")]
+
+
+def _migrate_v1(conn):
+    """
+    Blob transforms, portals table with a block_a index.
+    Converts a legacy t00..t33 block_transforms table in place.
+    """
+    legacy = _table_columns(conn, "block_transforms")
+    conn.execute("""
+        CREATE TABLE block_transforms_v1 (
+            block_name TEXT PRIMARY KEY,
+            transform BLOB NOT NULL
+        )
+    """)
+    if legacy:
+        rows = conn.execute(
+            "SELECT block_name, " + ", ".join(_LEGACY_COLUMNS) + " FROM block_transforms"
+        ).fetchall()
+        conn.executemany(
+            "INSERT INTO block_transforms_v1 (block_name, transform) VALUES (?, ?)",
+            [(row[0], pack_transform(row[1:])) for row in rows]
+        )
+        conn.execute("DROP TABLE block_transforms")
+    conn.execute("ALTER TABLE block_transforms_v1 RENAME TO block_transforms")
+
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS portals (
+            portal_id TEXT PRIMARY KEY,
+            block_a TEXT,
+            local_x_a REAL,
+            local_z_a REAL,
+            block_b TEXT,
+            local_x_b REAL,
+            local_z_b REAL,
+            radius REAL
+        )
+    """)
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_portals_block_a ON portals (block_a)")
+
+
+def _migrate_v2(conn):
+    """
+    World-space axis-aligned bounding box per block.
+    """
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS block_aabbs (
+            block_name TEXT PRIMARY KEY,
+            min_x REAL NOT NULL, min_y REAL NOT NULL, min_z REAL NOT NULL,
+            max_x REAL NOT NULL, max_y REAL NOT NULL, max_z REAL NOT NULL
+        )
+    """)
+
+
+def _migrate_v3(conn):
+    """
+    Pairwise ICP results keyed by a hash of their inputs and parameters.
+    """
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS icp_results (
+            input_key TEXT PRIMARY KEY,
+            block_a TEXT NOT NULL,
+            block_b TEXT NOT NULL,
+            transformation BLOB NOT NULL,
+            information BLOB,
+            fitness REAL,
+            inlier_rmse REAL,
+            seconds REAL,
+            created_at REAL
+        )
+    """)
+
+
+def _migrate_v4(conn):
+    """
+    Revision counter bumped by triggers on every change to block_transforms or
+    portals, so a compiled portal table can tell if it is stale in one query.
+    """
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS portal_revision (
+            id INTEGER PRIMARY KEY CHECK (id = 0),
+            revision INTEGER NOT NULL
+        )
+    """)
+    conn.execute("INSERT OR IGNORE INTO portal_revision (id, revision) VALUES (0, 0)")
+    for table in ("block_transforms", "portals"):
+        for event in ("INSERT", "UPDATE", "DELETE"):
+            conn.execute(f"""
+                CREATE TRIGGER IF NOT EXISTS {table}_{event.lower()}_revision AFTER {event} ON {table}
+                BEGIN
+                    UPDATE portal_revision SET revision = revision + 1 WHERE id = 0;
+                END
+            """)
+
+
+# MIGRATIONS[i] upgrades a database from schema version i to i + 1
+MIGRATIONS = [_migrate_v1, _migrate_v2, _migrate_v3, _migrate_v4]
+SCHEMA_VERSION = len(MIGRATIONS)
+
+
+def schema_version(conn) -> int:
+    return conn.execute("PRAGMA user_version").fetchone()[0]
+
+
+def migrate(conn):
+    """
+    Applies every pending migration, each in its own transaction, and
+    switches the database to WAL mode.
+    """
+    version = schema_version(conn)
+    if version > SCHEMA_VERSION:
+        raise RuntimeError(f"Database schema version {version} is newer than supported ({SCHEMA_VERSION})")
+    if version < SCHEMA_VERSION:
+        conn.execute("PRAGMA journal_mode=WAL")
+    for v in range(version, SCHEMA_VERSION):
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            MIGRATIONS[v](conn)
+            conn.execute(f"PRAGMA user_version = {v + 1}")
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+
+
+# ====== Connections ======
+
+def _thread_connections() -> dict:
+    connections = getattr(_local, "connections", None)
+    if connections is None or _local.pid != os.getpid():
+        # A forked child must neither use nor close its parent's connections
+        connections = _local.connections = {}
+        _local.pid = os.getpid()
+    return connections
+
+
+def connect(db_path: str, write: bool = False) -> sqlite3.Connection:
+    """
+    Returns the cached connection for db_path on the calling thread.
+    Without write a missing database raises and the schema is left alone;
+    with write a missing database is created and an older one migrated.
+    Connections are thread-local, so they are dropped with their thread,
+    and a forked process opens its own.
+    """
+    connections = _thread_connections()
+    key = os.path.abspath(db_path)
+    conn = connections.get(key)
+    if conn is None:
+        if not write and not os.path.exists(key):
+            raise RuntimeError(f"No database found at {db_path}.")
+        # mode=rw never creates a file, so a mistyped path is an error
+        uri = pathlib.Path(key).as_uri() + ("?mode=rwc" if write else "?mode=rw")
+        conn = sqlite3.connect(uri, uri=True)
+        conn.execute("PRAGMA synchronous=NORMAL")
+        connections[key] = conn
+    if write and schema_version(conn) != SCHEMA_VERSION:
+        migrate(conn)
+    return conn
+
+
+def _reader(db_path: str) -> sqlite3.Connection:
+    conn = connect(db_path)
+    version = schema_version(conn)
+    if version != SCHEMA_VERSION:
+        if version > SCHEMA_VERSION:
+            raise RuntimeError(f"Database schema version {version} is newer than supported ({SCHEMA_VERSION})")
+        raise RuntimeError(f"{db_path} has schema v{version} (current: v{SCHEMA_VERSION}); "
+                           f"run 'python stitch_nerf.py migrate {db_path}' first")
+    return conn
+
+
+def migrate_db(db_path: str):
+    """
+    Brings an existing database up to the current schema. Returns (old, new) version.
+    """
+    conn = connect(db_path)
+    version = schema_version(conn)
+    migrate(conn)
+    return version, schema_version(conn)
+
+
+def close_all():
+    """
+    Closes the calling thread's cached connections.
+    """
+    connections = _thread_connections()
+    conns = list(connections.values())
+    connections.clear()
+    for conn in conns:
+        conn.close()
+
+
+# ====== Block transforms ======
+
+def load_transforms(db_path: str) -> dict:
+    """
+    Returns {block_name: 4×4 float64 world-from-local transform} for every block.
+    """
+    rows = _reader(db_path).execute("SELECT block_name, transform FROM block_transforms").fetchall()
+    if not rows:
+        return {}
+    names, blobs = zip(*rows)
+    return dict(zip(names, unpack_transforms(blobs)))
+
+
+def load_transform(db_path: str, block_name: str) -> np.ndarray:
+    row = _reader(db_path).execute(
+        "SELECT transform FROM block_transforms WHERE block_name = ?", (block_name,)
+    ).fetchone()
+    if row is None:
+        raise ValueError(f"No transform found for block '{block_name}'")
+    return unpack_transforms([row[0]])[0]
+
+
+def store_transforms(db_path: str, transforms: dict):
+    """
+    Upserts {block_name: 4×4 transform} in a single transaction.
+    """
+    conn = connect(db_path, write=True)
+    with conn:
+        conn.executemany("""
+            INSERT INTO block_transforms (block_name, transform) VALUES (?, ?)
+            ON CONFLICT (block_name) DO UPDATE SET transform = excluded.transform
+            """, [(name, pack_transform(T)) for name, T in transforms.items()]
+        )
+
+
+def store_transform(db_path: str, block_name: str, transform):
+    store_transforms(db_path, {block_name: transform})
+
+
+# ====== Block AABBs ======
+
+def load_aabbs(db_path: str) -> dict:
+    """
+    Returns {block_name: (mins, maxs)} world-space AABBs as float64 (3,) arrays.
+    """
+    rows = _reader(db_path).execute(
+        "SELECT block_name, min_x, min_y, min_z, max_x, max_y, max_z FROM block_aabbs"
+    ).fetchall()
+    if not rows:
+        return {}
+    bounds = np.array([row[1:] for row in rows], dtype=np.float64)
+    return {row[0]: (b[:3], b[3:]) for row, b in zip(rows, bounds)}
+
+
+def store_aabbs(db_path: str, aabbs: dict):
+    """
+    Upserts {block_name: (mins, maxs)} in a single transaction.
+    """
+    conn = connect(db_path, write=True)
+    with conn:
+        conn.executemany("""
+            INSERT INTO block_aabbs (block_name, min_x, min_y, min_z, max_x, max_y, max_z)
+            VALUES (?, ?, ?, ?, ?, ?, ?)
+            ON CONFLICT (block_name) DO UPDATE SET
+                min_x = excluded.min_x, min_y = excluded.min_y, min_z = excluded.min_z,
+                max_x = excluded.max_x, max_y = excluded.max_y, max_z = excluded.max_z
+            """, [(name, *map(float, lo), *map(float, hi)) for name, (lo, hi) in aabbs.items()]
+        )
+
+
+def store_aabb(db_path: str, block_name: str, mins, maxs):
+    store_aabbs(db_path, {block_name: (mins, maxs)})
+
+
+# ====== ICP results ======
+
+ICP_RESULT_COLUMNS = ["block_a", "block_b", "transformation", "information",
+                      "fitness", "inlier_rmse", "seconds"]
+
+
+def load_icp_results(db_path: str, input_keys) -> dict:
+    """
+    Returns {input_key: result dict} for the keys that have a stored result.
+    Result dicts use the pairwise_icp field names.
+    """
+    keys = list(dict.fromkeys(input_keys))
+    if not keys:
+        return {}
+    rows = _reader(db_path).execute(
+        "SELECT input_key, " + ", ".join(ICP_RESULT_COLUMNS) + " FROM icp_results"
+        " WHERE input_key IN (" + ", ".join("?" * len(keys)) + ")", keys
+    ).fetchall()
+    results = {}
+    for key, block_a, block_b, transformation, information, fitness, inlier_rmse, seconds in rows:
+        results[key] = {
+            "block_A": block_a,
+            "block_B": block_b,
+            "transformation": unpack_transforms([transformation])[0],
+            "information": None if information is None
+                           else np.frombuffer(information, dtype=_TRANSFORM_DTYPE).reshape(6, 6).copy(),
+            "fitness": fitness,
+            "inlier_rmse": inlier_rmse,
+            "seconds": seconds,
+        }
+    return results
+
+
+def store_icp_results(db_path: str, results: dict):
+    """
+    Upserts {input_key: result dict} in a single transaction.
+    """
+    def row(key, r):
+        information = r.get("information")
+        if information is not None:
+            information = np.asarray(information, dtype=_TRANSFORM_DTYPE).reshape(36).tobytes()
+        return (key, r["block_A"], r["block_B"], pack_transform(r["transformation"]), information,
+                r.get("fitness"), r.get("inlier_rmse"), r.get("seconds"), time.time())
+
+    columns = ["input_key"] + ICP_RESULT_COLUMNS + ["created_at"]
+    updates = ", ".join(f"{c} = excluded.{c}" for c in columns[1:])
+    conn = connect(db_path, write=True)
+    with conn:
+        conn.executemany(f"""
+            INSERT INTO icp_results ({", ".join(columns)}) VALUES ({", ".join(["?"] * len(columns))})
+            ON CONFLICT (input_key) DO UPDATE SET {updates}
+            """, [row(key, r) for key, r in results.items()]
+        )
+
+
+# ====== Portals ======
+
+PORTAL_COLUMNS = ["portal_id", "block_a", "local_x_a", "local_z_a",
+                  "block_b", "local_x_b", "local_z_b", "radius"]
+
+
+def load_portal_revision(db_path: str) -> int:
+    """
+    Counter that changes whenever a block transform or portal is written.
+    """
+    return _reader(db_path).execute("SELECT revision FROM portal_revision WHERE id = 0").fetchone()[0]
+
+
+def load_portals(db_path: str, block_name: str = None):
+    """
+    Returns portal rows as tuples in PORTAL_COLUMNS order, optionally only
+    the portals leaving block_name.
+    """
+    query = "SELECT " + ", ".join(PORTAL_COLUMNS) + " FROM portals"
+    if block_name is None:
+        return _reader(db_path).execute(query).fetchall()
+    return _reader(db_path).execute(query + " WHERE block_a = ?", (block_name,)).fetchall()
+
+
+def upsert_portals(db_path: str, rows):
+    """
+    Inserts or replaces portal rows (tuples in PORTAL_COLUMNS order) keyed by portal_id.
+    """
+    conn = connect(db_path, write=True)
+    placeholders = ", ".join(["?"] * len(PORTAL_COLUMNS))
+    updates = ", ".join(f"{c} = excluded.{c}" for c in PORTAL_COLUMNS[1:])
+    with conn:
+        conn.executemany(f"""
+            INSERT INTO portals ({", ".join(PORTAL_COLUMNS)}) VALUES ({placeholders})
+            ON CONFLICT (portal_id) DO UPDATE SET {updates}
+            """, rows
+        )
+
+
+def delete_portals(db_path: str, portal_ids):
+    conn = connect(db_path, write=True)
+    with conn:
+        conn.executemany("DELETE FROM portals WHERE portal_id = ?", [(pid,) for pid in portal_ids])
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Upgrade metadata.sqlite to the current schema")
+    parser.add_argument("db", help="Path to metadata.sqlite")
+    args = parser.parse_args()
+
+    old, new = migrate_db(args.db)
+    print(f"{args.db}: schema v{old}" + (f" -> v{new}" if new != old else " is up to date"))
+
+
+if __name__ == "__main__":
+    main()
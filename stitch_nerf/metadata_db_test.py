@@ -0,0 +1,53 @@
+import os
+import shutil
+
+import numpy as np
+import pytest
+
+import metadata_db
+
+SHIPPED_DB = os.path.join(os.path.dirname(os.path.abspath(__file__)), "metadata.sqlite")
+
+
+def copy_shipped_db(tmp_path):
+    path = str(tmp_path / "metadata.sqlite")
+    shutil.copy(SHIPPED_DB, path)
+    return path
+
+
+def test_reading_an_old_database_raises_and_leaves_it_unchanged(tmp_path):
+    path = copy_shipped_db(tmp_path)
+    with open(path, "rb") as f:
+        before = f.read()
+    with pytest.raises(RuntimeError, match="schema v0.*migrate"):
+        metadata_db.load_transforms(path)
+    metadata_db.close_all()
+    with open(path, "rb") as f:
+        assert f.read() == before
+    assert not os.path.exists(path + "-wal")
+
+
+def test_missing_database_is_not_created_by_readers(tmp_path):
+    path = str(tmp_path / "typo.sqlite")
+    with pytest.raises(RuntimeError, match="No database found"):
+        metadata_db.load_transforms(path)
+    assert not os.path.exists(path)
+
+
+def test_migrate_keeps_the_legacy_transforms(tmp_path):
+    path = copy_shipped_db(tmp_path)
+    assert metadata_db.migrate_db(path) == (0, metadata_db.SCHEMA_VERSION)
+    transforms = metadata_db.load_transforms(path)
+    assert transforms
+    for T in transforms.values():
+        assert T.shape == (4, 4) and np.allclose(T[3], [0, 0, 0, 1])
+    assert metadata_db.migrate_db(path) == (metadata_db.SCHEMA_VERSION, metadata_db.SCHEMA_VERSION)
+    metadata_db.close_all()
+
+
+def test_writers_create_and_migrate(tmp_path):
+    path = str(tmp_path / "new.sqlite")
+    metadata_db.store_transform(path, "a", np.eye(4))
+    assert list(metadata_db.load_transforms(path)) == ["a"]
+    assert metadata_db.schema_version(metadata_db.connect(path)) == metadata_db.SCHEMA_VERSION
+    metadata_db.close_all()
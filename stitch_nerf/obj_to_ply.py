@@ -1,21 +1,199 @@
-import open3d as o3d
 import argparse
+import os
+from concurrent.futures import ProcessPoolExecutor
 
-def main(input_path: str):
+import numpy as np
 
-    # Load and sample
-    mesh = o3d.io.read_triangle_mesh(input_path)
+from icp_engine import voxel_downsample, open3d_available, load_open3d
+from ply_io import write_ply
+
+
+def _normalize(v):
+    norm = np.linalg.norm(v, axis=1, keepdims=True)
+    return v / np.where(norm > 0, norm, 1.0)
+
+
+def _parse_face(tokens):
+    """
+    Vertex indices of one OBJ face line (0-based, still possibly negative),
+    fan-triangulated.
+    """
+    idx = [int(t.split("/", 1)[0]) for t in tokens]
+    idx = [i - 1 if i > 0 else i for i in idx]
+    return [(idx[0], idx[k], idx[k + 1]) for k in range(1, len(idx) - 1)]
+
+
+def _iter_face_chunks(input_path, chunk_faces):
+    """
+    Yields (F, 3) int arrays of triangles, chunk_faces at a time. Negative
+    (relative) indices are resolved against the vertices read so far.
+    """
+    faces = []
+    n_vertices = 0
+    with open(input_path) as f:
+        for line in f:
+            if line.startswith("v "):
+                n_vertices += 1
+            elif line.startswith("f "):
+                for tri in _parse_face(line.split()[1:]):
+                    faces.append([i if i >= 0 else n_vertices + i for i in tri])
+                if len(faces) >= chunk_faces:
+                    yield np.array(faces, dtype=np.int64)
+                    faces = []
+    if faces:
+        yield np.array(faces, dtype=np.int64)
+
+
+def _read_vertices(input_path, chunk_bytes=64 << 20):
+    """
+    (V, 3) float64 vertex positions. The file is read chunk_bytes at a time
+    and each chunk's vertex lines are parsed by np.loadtxt straight into a
+    growing array, so no Python object is kept per vertex.
+    """
+    vertices = np.empty((1 << 16, 3), dtype=np.float64)
+    n = 0
+    with open(input_path) as f:
+        while True:
+            lines = f.readlines(chunk_bytes)
+            if not lines:
+                break
+            lines = [line for line in lines if line.startswith("v ")]
+            if not lines:
+                continue
+            chunk = np.loadtxt(lines, usecols=(1, 2, 3), ndmin=2, dtype=np.float64)
+            if n + len(chunk) > len(vertices):
+                vertices = np.resize(vertices, (max(2 * len(vertices), n + len(chunk)), 3))
+            vertices[n:n + len(chunk)] = chunk
+            n += len(chunk)
+    return vertices[:n].copy()
+
+
+def _triangle_areas(vertices, faces):
+    a, b, c = vertices[faces[:, 0]], vertices[faces[:, 1]], vertices[faces[:, 2]]
+    cross = np.cross(b - a, c - a)
+    return 0.5 * np.linalg.norm(cross, axis=1), cross
+
+
+def sample_mesh_streaming(input_path, n_points=None, density=None, chunk_faces=1000000, seed=0):
+    """
+    Uniformly samples points and face normals from an .obj without loading its
+    faces all at once: a first pass sums the surface area per chunk of faces,
+    a second pass samples each chunk in proportion to its area.
+    Peak memory is the vertices, one chunk of faces and the sampled points.
+    """
+    rng = np.random.default_rng(seed)
+    vertices = _read_vertices(input_path)
+
+    chunk_areas = [_triangle_areas(vertices, faces)[0].sum() for faces in _iter_face_chunks(input_path, chunk_faces)]
+    total_area = float(np.sum(chunk_areas))
+    if density is not None:
+        n_points = int(round(total_area * density))
+    if total_area <= 0 or n_points <= 0:
+        return np.empty((0, 3)), np.empty((0, 3))
+    counts = rng.multinomial(n_points, np.asarray(chunk_areas) / total_area)
+
+    points, normals = [], []
+    for faces, count in zip(_iter_face_chunks(input_path, chunk_faces), counts):
+        if count == 0:
+            continue
+        areas, cross = _triangle_areas(vertices, faces)
+        picked = rng.choice(len(faces), size=count, p=areas / areas.sum())
+        tri = faces[picked]
+
+        # Uniform barycentric sampling
+        r1 = np.sqrt(rng.random(count))[:, None]
+        r2 = rng.random(count)[:, None]
+        a, b, c = vertices[tri[:, 0]], vertices[tri[:, 1]], vertices[tri[:, 2]]
+        points.append((1 - r1) * a + r1 * (1 - r2) * b + r1 * r2 * c)
+        normals.append(_normalize(cross[picked]))
+    return np.concatenate(points), np.concatenate(normals)
+
+
+def sample_mesh_open3d(input_path, n_points=None, density=None):
+    """
+    Loads the whole mesh with Open3D and samples it uniformly.
+    """
+    mesh = load_open3d().io.read_triangle_mesh(input_path)
     mesh.compute_vertex_normals()
-    pcd = mesh.sample_points_uniformly(number_of_points=100000)
-    print("Loaded and sampled mesh")
+    if density is not None:
+        n_points = int(round(mesh.get_surface_area() * density))
+    pcd = mesh.sample_points_uniformly(number_of_points=n_points)
+    return np.asarray(pcd.points), np.asarray(pcd.normals)
+
+
+def convert(input_path: str, output_path: str = None, n_points: int = 100000, density: float = None,
+            voxel_size: float = 0.0, stream: bool = None, max_in_memory_mb: float = 1024,
+            chunk_faces: int = 1000000) -> str:
+    """
+    Converts one .obj mesh into a binary .ply point cloud with normals.
+    density (points per square meter) overrides n_points; voxel_size > 0
+    voxel-downsamples the result. stream=None streams when the file is larger
+    than max_in_memory_mb or Open3D is unavailable.
+    """
+    if output_path is None:
+        output_path = os.path.splitext(input_path)[0] + ".ply"
+    if stream is None:
+        stream = not open3d_available() or os.path.getsize(input_path) > max_in_memory_mb * (1 << 20)
+
+    if stream:
+        points, normals = sample_mesh_streaming(input_path, n_points, density, chunk_faces)
+    else:
+        points, normals = sample_mesh_open3d(input_path, n_points, density)
+    print(f"Loaded and sampled {input_path} ({len(points)} points, {'streamed' if stream else 'in memory'})")
 
-    output_path = input_path.replace(".obj", ".ply")
-    # Save as .ply
-    o3d.io.write_point_cloud(output_path, pcd)
+    if voxel_size > 0:
+        merged = voxel_downsample(np.hstack([points, normals]), voxel_size)
+        points, normals = merged[:, :3], _normalize(merged[:, 3:])
+
+    write_ply(output_path, points, normals)
     print(f"Saved {output_path}")
+    return output_path
 
-if __name__ == "__main__":
-    parser = argparse.ArgumentParser(description="Convert .obj to .ply")
-    parser.add_argument("input", help="Path to input .obj file")
+
+def find_meshes(input_path: str):
+    if os.path.isfile(input_path):
+        return [input_path]
+    meshes = []
+    for root, _, files in os.walk(input_path):
+        meshes += [os.path.join(root, f) for f in files if f.lower().endswith(".obj")]
+    return sorted(meshes)
+
+
+def convert_all(input_path: str, out_dir: str = None, workers: int = None, **options):
+    meshes = find_meshes(input_path)
+    if not meshes:
+        raise ValueError(f"No .obj files found under {input_path}")
+
+    outputs = [
+        os.path.join(out_dir, os.path.splitext(os.path.basename(m))[0] + ".ply") if out_dir else None
+        for m in meshes
+    ]
+    if out_dir:
+        os.makedirs(out_dir, exist_ok=True)
+    if len(meshes) == 1:
+        return [convert(meshes[0], outputs[0], **options)]
+
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        futures = [pool.submit(convert, m, o, **options) for m, o in zip(meshes, outputs)]
+        return [future.result() for future in futures]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Convert .obj meshes to binary .ply point clouds")
+    parser.add_argument("input", help="Path to an input .obj file or a directory of them")
+    parser.add_argument("--out_dir", default=None, help="Output directory (default: next to each .obj)")
+    parser.add_argument("--points", type=int, default=100000, help="Points to sample per mesh")
+    parser.add_argument("--density", type=float, default=None, help="Points per square meter of surface (overrides --points)")
+    parser.add_argument("--voxel_size", type=float, default=0.0, help="Voxel-downsample the sampled cloud (0 = off)")
+    parser.add_argument("--workers", type=int, default=None, help="Number of worker processes (default: all cores)")
+    parser.add_argument("--stream", action="store_true", default=None, help="Always sample in bounded-memory chunks")
+    parser.add_argument("--max_in_memory_mb", type=float, default=1024, help="Stream meshes whose .obj is larger than this")
+    parser.add_argument("--chunk_faces", type=int, default=1000000, help="Faces per chunk when streaming")
     args = parser.parse_args()
-    main(args.input)
+    convert_all(args.input, args.out_dir, args.workers, n_points=args.points, density=args.density,
+                voxel_size=args.voxel_size, stream=args.stream, max_in_memory_mb=args.max_in_memory_mb,
+                chunk_faces=args.chunk_faces)
+
+
+if __name__ == "__main__":
+    main()
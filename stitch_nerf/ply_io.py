@@ -0,0 +1,106 @@
+import numpy as np
+
+_PLY_TYPES = {
+    "char": "i1", "int8": "i1", "uchar": "u1", "uint8": "u1",
+    "short": "i2", "int16": "i2", "ushort": "u2", "uint16": "u2",
+    "int": "i4", "int32": "i4", "uint": "u4", "uint32": "u4",
+    "float": "f4", "float32": "f4", "double": "f8", "float64": "f8",
+}
+
+
+def _read_header(f):
+    """
+    Parses a PLY header. Returns (format, [(element_name, count, [(prop, type) or (prop, None)])]).
+    List properties are recorded with a None type.
+    """
+    if f.readline().strip() != b"ply":
+        raise ValueError("Not a PLY file")
+    fmt = None
+    elements = []
+    while True:
+        line = f.readline()
+        if not line:
+            raise ValueError("Unexpected end of PLY header")
+        tokens = line.decode("ascii").split()
+        if not tokens or tokens[0] in ("comment", "obj_info"):
+            continue
+        if tokens[0] == "end_header":
+            return fmt, elements
+        if tokens[0] == "format":
+            fmt = tokens[1]
+        elif tokens[0] == "element":
+            elements.append((tokens[1], int(tokens[2]), []))
+        elif tokens[0] == "property":
+            if tokens[1] == "list":
+                elements[-1][2].append((tokens[-1], None))
+            else:
+                elements[-1][2].append((tokens[2], _PLY_TYPES[tokens[1]]))
+
+
+def read_ply(path: str):
+    """
+    Reads the vertex element of a PLY file without Open3D.
+    Returns (points, normals) as float64 arrays; normals is None if the file has none.
+    """
+    with open(path, "rb") as f:
+        fmt, elements = _read_header(f)
+        vertex = None
+        for name, count, props in elements:
+            if name == "vertex":
+                vertex = (count, props)
+                break
+            if fmt != "ascii" and any(t is None for _, t in props):
+                raise ValueError(f"Cannot skip list element '{name}' before vertices in {path}")
+            if fmt == "ascii":
+                for _ in range(count):
+                    f.readline()
+            else:
+                f.seek(count * np.dtype([(p, t) for p, t in props]).itemsize, 1)
+        if vertex is None:
+            raise ValueError(f"No vertex element in {path}")
+
+        count, props = vertex
+        if any(t is None for _, t in props):
+            raise ValueError(f"List properties on vertices are not supported in {path}")
+        if fmt == "ascii":
+            data = np.loadtxt(f, max_rows=count, ndmin=2)
+            columns = {p: data[:, i] for i, (p, _) in enumerate(props)}
+        else:
+            endian = "<" if fmt == "binary_little_endian" else ">"
+            dtype = np.dtype([(p, endian + t) for p, t in props])
+            data = np.frombuffer(f.read(count * dtype.itemsize), dtype=dtype, count=count)
+            columns = {p: data[p] for p, _ in props}
+
+    points = np.stack([columns["x"], columns["y"], columns["z"]], axis=1).astype(np.float64)
+    normals = None
+    if all(k in columns for k in ("nx", "ny", "nz")):
+        normals = np.stack([columns["nx"], columns["ny"], columns["nz"]], axis=1).astype(np.float64)
+    return points, normals
+
+
+def write_ply(path: str, points, normals=None, colors=None):
+    """
+    Writes a binary little-endian PLY with double-precision points,
+    optional normals and optional uint8 colors.
+    """
+    points = np.asarray(points, dtype=np.float64)
+    fields = [("x", "<f8"), ("y", "<f8"), ("z", "<f8")]
+    if normals is not None:
+        fields += [("nx", "<f8"), ("ny", "<f8"), ("nz", "<f8")]
+    if colors is not None:
+        fields += [("red", "u1"), ("green", "u1"), ("blue", "u1")]
+
+    data = np.empty(len(points), dtype=fields)
+    data["x"], data["y"], data["z"] = points.T
+    if normals is not None:
+        data["nx"], data["ny"], data["nz"] = np.asarray(normals, dtype=np.float64).T
+    if colors is not None:
+        data["red"], data["green"], data["blue"] = np.asarray(colors, dtype=np.uint8).T
+
+    type_names = {"<f8": "double", "u1": "uchar"}
+    header = ["ply", "format binary_little_endian 1.0", f"element vertex {len(points)}"]
+    header += [f"property {type_names[t]} {name}" for name, t in fields]
+    header.append("end_header")
+    with open(path, "wb") as f:
+        f.write(("\n".join(header) + "\n").encode("ascii"))
+        f.write(data.tobytes())
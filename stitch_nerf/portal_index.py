@@ -0,0 +1,255 @@
+import numpy as np
+
+_KEY_OFFSET = 1 << 31
+
+
+def _cell_keys(ix, iz):
+    """
+    Packs integer grid cell coordinates into one sortable int64 key.
+    """
+    return (np.asarray(ix, dtype=np.int64) << 32) + (np.asarray(iz, dtype=np.int64) + _KEY_OFFSET)
+
+
+class PortalIndex:
+    """
+    Uniform grid over the portal discs of one block, in that block's local x/z plane.
+
+    Every portal is registered in each grid cell its disc overlaps. The grid is
+    stored as sorted cell keys plus a CSR list of portal indices, so a query only
+    touches the cells under the camera's swept segment.
+    """
+    def __init__(self, cx, cz, radius, cell_size=None):
+        self.cx = np.asarray(cx, dtype=np.float64)
+        self.cz = np.asarray(cz, dtype=np.float64)
+        self.radius = np.asarray(radius, dtype=np.float64)
+        self.radius_sq = self.radius * self.radius
+
+        if cell_size is None:
+            cell_size = 2.0 * float(self.radius.max()) if len(self.radius) else 1.0
+        self.cell_size = max(cell_size, 1e-6)
+        self._build_grid()
+
+    @classmethod
+    def from_portals(cls, portals, cell_size=None):
+        """
+        Builds the index from a list of Portal entries.
+        """
+        cx = [p.cx for p in portals]
+        cz = [p.cz for p in portals]
+        radius = [np.sqrt(p.radius_sq) for p in portals]
+        return cls(cx, cz, radius, cell_size)
+
+    def __len__(self):
+        return len(self.cx)
+
+    def _build_grid(self):
+        cs = self.cell_size
+        x0 = np.floor((self.cx - self.radius) / cs).astype(np.int64)
+        x1 = np.floor((self.cx + self.radius) / cs).astype(np.int64)
+        z0 = np.floor((self.cz - self.radius) / cs).astype(np.int64)
+        z1 = np.floor((self.cz + self.radius) / cs).astype(np.int64)
+
+        # Expand every disc into the cells covered by its bounding box
+        nx = x1 - x0 + 1
+        nz = z1 - z0 + 1
+        counts = nx * nz
+        owner = np.repeat(np.arange(len(self.cx)), counts)
+        local = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+        ix = x0[owner] + local // nz[owner]
+        iz = z0[owner] + local % nz[owner]
+
+        keys = _cell_keys(ix, iz)
+        order = np.argsort(keys, kind="stable")
+        keys = keys[order]
+        self._entries = owner[order]
+        self._keys, self._starts = np.unique(keys, return_index=True)
+        self._ends = np.append(self._starts[1:], len(keys))
+
+    def _candidates(self, xmin, zmin, xmax, zmax):
+        if len(self.cx) == 0:
+            return np.empty(0, dtype=np.int64)
+
+        cs = self.cell_size
+        ix = np.arange(np.floor(xmin / cs), np.floor(xmax / cs) + 1, dtype=np.int64)
+        iz = np.arange(np.floor(zmin / cs), np.floor(zmax / cs) + 1, dtype=np.int64)
+
+        # A long jump covers more cells than there are portals; test them all
+        if len(ix) * len(iz) > len(self.cx):
+            return np.arange(len(self.cx))
+
+        return self._lookup(np.repeat(ix, len(iz)), np.tile(iz, len(ix)))
+
+    def _lookup(self, ix, iz):
+        """
+        Portals registered in any of the given cells.
+        """
+        keys = _cell_keys(ix, iz)
+        pos = np.minimum(np.searchsorted(self._keys, keys), len(self._keys) - 1)
+        pos = pos[self._keys[pos] == keys]
+        if len(pos) == 0:
+            return pos
+        if len(pos) == 1:
+            return self._entries[self._starts[pos[0]]:self._ends[pos[0]]]
+        return np.unique(np.concatenate([self._entries[s:e] for s, e in zip(self._starts[pos], self._ends[pos])]))
+
+    def contains(self, x, z):
+        """
+        Returns the index of a portal whose disc contains (x, z), or -1.
+        """
+        cand = self._candidates(x, z, x, z)
+        if len(cand) == 0:
+            return -1
+        d_sq = (x - self.cx[cand]) ** 2 + (z - self.cz[cand]) ** 2
+        inside = np.flatnonzero(d_sq <= self.radius_sq[cand])
+        if len(inside) == 0:
+            return -1
+        return int(cand[inside[np.argmin(d_sq[inside])]])
+
+    def first_crossing(self, x0, z0, x1, z1):
+        """
+        Returns the index of the first portal disc entered by the segment
+        (x0, z0) -> (x1, z1), or -1. Discs that already contain the start point
+        are not entered and are ignored.
+        """
+        cand = self._candidates(min(x0, x1), min(z0, z1), max(x0, x1), max(z0, z1))
+        if len(cand) == 0:
+            return -1
+
+        dx, dz = x1 - x0, z1 - z0
+        fx = x0 - self.cx[cand]
+        fz = z0 - self.cz[cand]
+        r_sq = self.radius_sq[cand]
+
+        # Solve |f + t d|^2 = r^2 for the entry parameter t in [0, 1]
+        a = dx * dx + dz * dz
+        b = 2.0 * (fx * dx + fz * dz)
+        c = fx * fx + fz * fz - r_sq
+        outside = c > 0.0
+        if a == 0.0:
+            return -1
+        disc = b * b - 4.0 * a * c
+        t = (-b - np.sqrt(np.maximum(disc, 0.0))) / (2.0 * a)
+        hit = outside & (disc >= 0.0) & (t >= 0.0) & (t <= 1.0)
+
+        hits = np.flatnonzero(hit)
+        if len(hits) == 0:
+            return -1
+        return int(cand[hits[np.argmin(t[hits])]])
+
+    def first_crossings(self, x0, z0, x1, z1, max_pairs=1 << 20):
+        """
+        first_crossing for many independent segments at once (e.g. one per
+        viewer session): returns, per segment, the index of the first portal
+        disc it enters, or -1. Segments are tested against every portal,
+        in chunks of at most max_pairs segment/portal pairs.
+        """
+        x0, z0, x1, z1 = (np.asarray(v, dtype=np.float64) for v in (x0, z0, x1, z1))
+        out = np.full(len(x0), -1, dtype=np.int64)
+        if len(self.cx) == 0 or len(x0) == 0:
+            return out
+
+        chunk = max(1, max_pairs // len(self.cx))
+        for start in range(0, len(x0), chunk):
+            sl = slice(start, start + chunk)
+            dx, dz = (x1[sl] - x0[sl])[:, None], (z1[sl] - z0[sl])[:, None]
+            fx = x0[sl, None] - self.cx
+            fz = z0[sl, None] - self.cz
+
+            a = dx * dx + dz * dz
+            b = 2.0 * (fx * dx + fz * dz)
+            c = fx * fx + fz * fz - self.radius_sq
+            disc = b * b - 4.0 * a * c
+            moving = a > 0.0
+            t = (-b - np.sqrt(np.maximum(disc, 0.0))) / np.where(moving, 2.0 * a, 1.0)
+            hit = moving & (c > 0.0) & (disc >= 0.0) & (t >= 0.0) & (t <= 1.0)
+
+            first = np.argmin(np.where(hit, t, np.inf), axis=1)
+            out[sl] = np.where(hit.any(axis=1), first, -1)
+        return out
+
+    def first_crossing_path(self, xs, zs, chunk=4096):
+        """
+        Returns (k, portal) for the first segment k, (xs[k], zs[k]) -> (xs[k+1], zs[k+1]),
+        of a polyline that enters a portal disc, or (-1, -1). Each segment
+        follows the first_crossing rule; segments are tested chunk at a time
+        against every portal at once.
+        """
+        xs = np.asarray(xs, dtype=np.float64)
+        zs = np.asarray(zs, dtype=np.float64)
+        if len(self.cx) == 0 or len(xs) < 2:
+            return -1, -1
+
+        for start in range(0, len(xs) - 1, chunk):
+            x0 = xs[start:start + chunk + 1]
+            z0 = zs[start:start + chunk + 1]
+            dx, dz = np.diff(x0)[:, None], np.diff(z0)[:, None]
+            fx = x0[:-1, None] - self.cx
+            fz = z0[:-1, None] - self.cz
+
+            a = dx * dx + dz * dz
+            b = 2.0 * (fx * dx + fz * dz)
+            c = fx * fx + fz * fz - self.radius_sq
+            disc = b * b - 4.0 * a * c
+            moving = a > 0.0
+            t = (-b - np.sqrt(np.maximum(disc, 0.0))) / np.where(moving, 2.0 * a, 1.0)
+            hit = moving & (c > 0.0) & (disc >= 0.0) & (t >= 0.0) & (t <= 1.0)
+
+            rows = np.flatnonzero(hit.any(axis=1))
+            if len(rows):
+                k = rows[0]
+                cols = np.flatnonzero(hit[k])
+                return start + int(k), int(cols[np.argmin(t[k, cols])])
+        return -1, -1
+
+    def _ring_cells(self, ix, iz, ring):
+        """
+        Cell coordinates at Chebyshev distance ring from cell (ix, iz).
+        """
+        if ring == 0:
+            return np.array([ix]), np.array([iz])
+        side = np.arange(-ring, ring + 1, dtype=np.int64)
+        inner = side[1:-1]
+        rx = np.concatenate([side, side, np.full(len(inner), -ring), np.full(len(inner), ring)])
+        rz = np.concatenate([np.full(len(side), -ring), np.full(len(side), ring), inner, inner])
+        return ix + rx, iz + rz
+
+    def nearest(self, x, z, max_distance=np.inf):
+        """
+        Returns (index, distance) of the portal disc nearest to (x, z), where
+        distance is measured to the disc's edge (0 inside it), or (-1, inf) if
+        no disc is within max_distance.
+        Grid rings around the query cell are searched outwards until no
+        unvisited cell can hold a closer disc.
+        """
+        n = len(self.cx)
+        if n == 0:
+            return -1, np.inf
+
+        cs = self.cell_size
+        ix, iz = int(np.floor(x / cs)), int(np.floor(z / cs))
+        best, best_d = -1, np.inf
+        visited = 0
+        ring = 0
+        while True:
+            # Every disc in a cell of ring k or beyond is at least (k - 1) cells away
+            if best_d <= (ring - 1) * cs or (ring - 1) * cs > max_distance:
+                break
+            rx, rz = self._ring_cells(ix, iz, ring)
+            visited += len(rx)
+            if visited > n:
+                cand = np.arange(n)
+            else:
+                cand = self._lookup(rx, rz)
+            if len(cand):
+                d = np.sqrt((x - self.cx[cand]) ** 2 + (z - self.cz[cand]) ** 2) - self.radius[cand]
+                i = int(np.argmin(d))
+                if d[i] < best_d:
+                    best, best_d = int(cand[i]), float(d[i])
+            if visited > n:
+                break
+            ring += 1
+
+        best_d = max(best_d, 0.0)
+        if best_d > max_distance:
+            return -1, np.inf
+        return best, best_d
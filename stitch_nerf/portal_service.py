@@ -0,0 +1,413 @@
+"""
+Asyncio service that answers block-switch checks for many viewer sessions.
+
+Transforms, the portal table and the block AABBs are loaded once
+(SiteMetadata) and shared by a light BlockManager per session, which only
+holds that session's current block, last position and polling schedule.
+Check requests from all sessions are collected and answered once per tick:
+sessions that are not due yet are answered right away, the rest are
+grouped by current block and each group's swept segments are tested
+against that block's portals in one vectorized call.
+
+Sessions can be driven in-process (open_session / check), over TCP with one
+JSON object per line, or by local simulated clients (--simulate).
+"""
+import argparse
+import asyncio
+import itertools
+import json
+import os
+import tempfile
+import time
+from collections import defaultdict
+from dataclasses import dataclass
+
+import numpy as np
+
+import se3
+from block_manager import BlockManager, SiteMetadata
+from render_loop import LatencyHistogram, random_walk_steps
+
+
+@dataclass
+class SwitchResult:
+    """
+    Answer to a check that switched blocks: the new block and the camera
+    matrix (3x4) in its frame, plus the source-local -> destination-local transfer.
+    """
+    block: str
+    camera_matrix: np.ndarray
+    transfer: np.ndarray
+
+    def to_dict(self) -> dict:
+        return {
+            "switch": True,
+            "block": self.block,
+            "camera_matrix": np.asarray(self.camera_matrix, dtype=np.float64).tolist(),
+            "transfer": np.asarray(self.transfer, dtype=np.float64).tolist(),
+        }
+
+
+def camera_3x4(camera_matrix) -> np.ndarray:
+    """
+    Validated float64 3x4 camera matrix from a 3x4 or 4x4 nested sequence.
+    """
+    try:
+        camera = np.asarray(camera_matrix, dtype=np.float64)
+    except (TypeError, ValueError):
+        raise ValueError("camera_matrix must be a 3x4 or 4x4 matrix of numbers") from None
+    if camera.shape not in ((3, 4), (4, 4)) or not np.isfinite(camera).all():
+        raise ValueError(f"camera_matrix must be a finite 3x4 or 4x4 matrix, got shape {camera.shape}")
+    return camera[:3, :4]
+
+
+class Session:
+    """
+    One viewer. Also stands in for the testbed BlockManager reads the camera from.
+    """
+    def __init__(self, session_id, manager: BlockManager):
+        self.id = session_id
+        self.manager = manager
+        self.camera_matrix = None
+        self.checks = 0
+        self.skipped_checks = 0
+        self.switches = []  # (check number, from block, to block)
+
+    @property
+    def block(self):
+        return self.manager.get_current_block_id()
+
+
+class PortalService:
+    def __init__(self, db_path: str, portal_table=None, tick: float = 0.0, clock=time.perf_counter,
+                 **manager_args):
+        """
+        tick: seconds to wait for more requests before answering a batch (0 = next loop iteration)
+        manager_args: BlockManager polling / proximity options applied to every session
+        """
+        self.site = SiteMetadata.load(db_path, portal_table)
+        # The service answers with block names; viewers load their own snapshots
+        self.blocks = [(name, name) for name in sorted(self.site.T)]
+        self.tick = tick
+        self.clock = clock
+        self.manager_args = manager_args
+        self.sessions = {}
+        self.batches = 0
+        self.batched_checks = 0
+        self.max_batch = 0
+        self._ids = itertools.count()
+        self._pending = []
+        self._wakeup = asyncio.Event()
+        self._task = None
+
+    def open_session(self, session_id=None, block: str = None) -> Session:
+        """
+        Starts a session in block (default: the first block).
+        """
+        session_id = next(self._ids) if session_id is None else session_id
+        if not isinstance(session_id, (str, int)) or isinstance(session_id, bool):
+            raise ValueError(f"Session ids are strings or integers, not {session_id!r}")
+        if session_id in self.sessions:
+            raise ValueError(f"Session {session_id!r} already exists")
+        manager = BlockManager(self.blocks, None, clock=self.clock, site=self.site, **self.manager_args)
+        if block is not None:
+            if block not in manager.block_to_idx:
+                raise ValueError(f"Unknown block '{block}'")
+            manager.set_current_block(block)
+        session = self.sessions[session_id] = Session(session_id, manager)
+        return session
+
+    def session(self, session_id) -> Session:
+        session = self.sessions.get(session_id) if isinstance(session_id, (str, int)) else None
+        if session is None:
+            raise ValueError(f"Unknown session {session_id!r}")
+        return session
+
+    def close_session(self, session_id):
+        if isinstance(session_id, (str, int)):
+            self.sessions.pop(session_id, None)
+
+    def transfer(self, block_a: str, block_b: str) -> np.ndarray:
+        """
+        4x4 matrix mapping block_a-local coordinates into block_b's frame.
+        """
+        for block in (block_a, block_b):
+            if block not in self.site.T:
+                raise ValueError(f"Transform for block '{block}' not found.")
+        return se3.relative(self.site.T[block_a], self.site.T[block_b])
+
+    async def check(self, session_id, camera_matrix):
+        """
+        Queues a check of the session's camera (3x4 or 4x4, in its current
+        block) for the next batch. Returns a SwitchResult or None.
+        """
+        session = self.session(session_id)
+        camera = camera_3x4(camera_matrix)
+        future = asyncio.get_running_loop().create_future()
+        self._pending.append((session, camera, future))
+        self._wakeup.set()
+        return await future
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _run(self):
+        while True:
+            await self._wakeup.wait()
+            # Let the other sessions' requests of this frame join the batch
+            await asyncio.sleep(self.tick)
+            self._wakeup.clear()
+            batch, self._pending = self._pending, []
+            try:
+                self.process(batch)
+            except Exception as e:
+                for _, _, future in batch:
+                    if not future.done():
+                        future.set_exception(e)
+            if self._pending:
+                self._wakeup.set()
+
+    def process(self, batch):
+        """
+        Answers one batch of (session, camera_matrix, future) requests. A
+        session with several requests in the batch keeps all but its first
+        for the next batch, since each check starts where the previous ended.
+        A request that fails only fails its own future.
+        """
+        now = self.clock()
+        due = defaultdict(list)
+        seen = set()
+        for request in batch:
+            session, camera, future = request
+            if session.id in seen:
+                self._pending.append(request)
+                continue
+            seen.add(session.id)
+            session.checks += 1
+            if session.manager.check_due(now):
+                due[session.block].append(request)
+            else:
+                session.skipped_checks += 1
+                future.set_result(None)
+
+        n_due = sum(len(requests) for requests in due.values())
+        self.batches += 1
+        self.batched_checks += n_due
+        self.max_batch = max(self.max_batch, n_due)
+
+        for block, requests in due.items():
+            try:
+                hits = self._portal_hits(block, requests)
+            except Exception as e:
+                # Nothing has changed yet, so the whole group can fail
+                for _, _, future in requests:
+                    future.set_exception(e)
+                continue
+            for (session, camera, future), hit in zip(requests, hits):
+                try:
+                    session.camera_matrix = camera
+                    x, y, z = camera[:, 3]
+                    result = session.manager.check_switch(x, y, z, session, now, hit=hit)
+                    if result is None:
+                        future.set_result(None)
+                        continue
+                    dest = session.block
+                    session.switches.append((session.checks, block, dest))
+                    future.set_result(SwitchResult(dest, result[1], self.transfer(block, dest)))
+                except Exception as e:
+                    if not future.done():
+                        future.set_exception(e)
+
+    def _portal_hits(self, block, requests):
+        """
+        First portal of block crossed by each request's swept segment (None if
+        none), tested for all requests in one vectorized call.
+        """
+        hits = [None] * len(requests)
+        index = self.site.portals.index(block)
+        if index is not None:
+            swept = [i for i, (s, _, _) in enumerate(requests) if s.manager.last_pos is not None]
+            if swept:
+                start = np.array([requests[i][0].manager.last_pos for i in swept])
+                end = np.array([requests[i][1][[0, 2], 3] for i in swept])
+                for i, hit in zip(swept, index.first_crossings(start[:, 0], start[:, 1], end[:, 0], end[:, 1])):
+                    hits[i] = int(hit)
+        return hits
+
+    def stats(self) -> dict:
+        return {
+            "sessions": len(self.sessions),
+            "batches": self.batches,
+            "batched_checks": self.batched_checks,
+            "mean_batch": self.batched_checks / self.batches if self.batches else 0.0,
+            "max_batch": self.max_batch,
+        }
+
+    async def handle_client(self, reader, writer):
+        """
+        Line-delimited JSON protocol, one request and one reply per line:
+            {"op": "open", "session": id?, "block": name?} -> {"session": id, "block": name}
+            {"op": "check", "session": id, "camera_matrix": 3x4} -> {"switch": false} or SwitchResult
+            {"op": "transfer", "from": a, "to": b}          -> {"transfer": 4x4}
+            {"op": "close", "session": id}                  -> {"closed": id}
+        Sessions opened on a connection are closed when it drops.
+        """
+        opened = []
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                try:
+                    reply = await self._reply(json.loads(line), opened)
+                except (ValueError, KeyError) as e:
+                    reply = {"error": str(e)}
+                except Exception as e:
+                    # A bad request must not drop the connection and its sessions
+                    reply = {"error": f"{type(e).__name__}: {e}"}
+                writer.write((json.dumps(reply) + "\n").encode())
+                await writer.drain()
+        finally:
+            for session_id in opened:
+                self.close_session(session_id)
+            writer.close()
+
+    async def _reply(self, request, opened):
+        if not isinstance(request, dict):
+            raise ValueError("Requests are JSON objects")
+        op = request.get("op")
+        if op == "open":
+            session = self.open_session(request.get("session"), request.get("block"))
+            opened.append(session.id)
+            return {"session": session.id, "block": session.block}
+        if op == "check":
+            result = await self.check(request["session"], request["camera_matrix"])
+            return result.to_dict() if result is not None else {"switch": False}
+        if op == "transfer":
+            block_a, block_b = request["from"], request["to"]
+            if not isinstance(block_a, str) or not isinstance(block_b, str):
+                raise ValueError("'from' and 'to' are block names")
+            return {"transfer": self.transfer(block_a, block_b).tolist()}
+        if op == "close":
+            self.close_session(request["session"])
+            return {"closed": request["session"]}
+        raise ValueError(f"Unknown op {op!r}")
+
+
+async def simulated_client(service: PortalService, steps, block: str = None, fps: float = 0.0,
+                           latency: LatencyHistogram = None):
+    """
+    Walks a camera through camera-local steps (see render_loop.random_walk_steps)
+    as one session, following every switch, and records check latencies.
+    """
+    session = service.open_session(block=block)
+    latency = latency if latency is not None else LatencyHistogram()
+    cam = np.eye(4)
+    for step in steps:
+        cam = cam @ step
+        start = time.perf_counter()
+        result = await service.check(session.id, cam)
+        latency.record(time.perf_counter() - start)
+        if result is not None:
+            cam[:3, :4] = result.camera_matrix
+        await asyncio.sleep(1.0 / fps if fps > 0 else 0)
+    return session
+
+
+async def simulate(db_path: str, clients: int, frames: int, speed: float = 0.05, radius: float = 2.0,
+                   fps: float = 0.0, tick: float = 0.0, seed: int = 0, portal_table=None, **manager_args) -> dict:
+    """
+    Runs clients simulated viewers against one service and reports throughput,
+    batch sizes and check latency.
+    """
+    service = PortalService(db_path, portal_table, tick, **manager_args)
+    service.start()
+    rng = np.random.default_rng(seed)
+    blocks = [name for name, _ in service.blocks]
+    latency = LatencyHistogram()
+    start = time.perf_counter()
+    sessions = await asyncio.gather(*[
+        simulated_client(service, random_walk_steps(frames, speed, radius, rng=rng), blocks[i % len(blocks)],
+                         fps, latency)
+        for i in range(clients)
+    ])
+    seconds = time.perf_counter() - start
+    await service.stop()
+
+    checks = sum(session.checks for session in sessions)
+    return {
+        "benchmark": "portal_service",
+        "clients": clients,
+        "frames": frames,
+        "seconds": seconds,
+        "checks_per_second": checks / seconds if seconds > 0 else None,
+        "skipped_checks": sum(session.skipped_checks for session in sessions),
+        "switches": sum(len(session.switches) for session in sessions),
+        **service.stats(),
+        "check_latency": latency.to_dict(),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Serve block-switch checks to many viewer sessions, or simulate clients against the service")
+    parser.add_argument("--db", default=None, help="Metadata database (default with --simulate: generate a synthetic world)")
+    parser.add_argument("--portal_table", default=None, help="Compiled portal table to memory-map (see portal_table.py)")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--tick", type=float, default=0.0, help="Seconds to collect requests into one batch")
+    parser.add_argument("--safety", type=float, default=0.5, help="Fraction of the time-to-contact sessions wait between checks (0 = check every request)")
+    parser.add_argument("--proximity_switch", action="store_true", help="Also switch blocks by AABB, without portals")
+    parser.add_argument("--simulate", type=int, default=0, help="Run this many local simulated clients and report JSON instead of serving")
+    parser.add_argument("--frames", type=int, default=1000, help="Frames per simulated client")
+    parser.add_argument("--speed", type=float, default=0.05, help="Simulated camera speed in meters per frame")
+    parser.add_argument("--radius", type=float, default=2.0, help="Radius of the circle simulated cameras wander on")
+    parser.add_argument("--fps", type=float, default=0.0, help="Simulated client frame rate (0 = as fast as possible)")
+    parser.add_argument("--blocks", type=int, default=16, help="Blocks in the synthetic world")
+    parser.add_argument("--portals", type=int, default=64, help="Portals in the synthetic world")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--out", default=None, help="Write the simulation report here instead of stdout")
+    args = parser.parse_args()
+    manager_args = {"safety": args.safety, "proximity_switch": args.proximity_switch}
+
+    if not args.simulate:
+        if args.db is None or not os.path.exists(args.db):
+            raise RuntimeError(f"No database found at {args.db}.")
+
+        async def serve():
+            service = PortalService(args.db, args.portal_table, args.tick, **manager_args)
+            service.start()
+            server = await asyncio.start_server(service.handle_client, args.host, args.port)
+            print(f"Serving {len(service.blocks)} blocks on {args.host}:{args.port}")
+            async with server:
+                await server.serve_forever()
+        asyncio.run(serve())
+        return
+
+    with tempfile.TemporaryDirectory() as root:
+        db_path = args.db
+        if db_path is None:
+            from synthetic_world import generate_world
+            db_path = generate_world(root, args.blocks, args.portals, snapshot_bytes=0, seed=args.seed).db_path
+        report = asyncio.run(simulate(db_path, args.simulate, args.frames, args.speed, args.radius, args.fps,
+                                      args.tick, args.seed, args.portal_table, **manager_args))
+
+    report = json.dumps(report, indent=2)
+    if args.out:
+        with open(args.out, "w") as f:
+            f.write(report)
+    else:
+        print(report)
+
+
+if __name__ == "__main__":
+    main()
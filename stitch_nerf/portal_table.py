@@ -0,0 +1,273 @@
+"""
+Compiled portal graph.
+
+All directional portals are kept in one NumPy structured array sorted by
+source block, with CSR offsets giving each block's row range. The array is
+saved as .npy (opened memory-mapped) next to a small JSON file holding the
+block names, offsets and the database's portal revision it was compiled
+from, so telling whether it is stale is a single query. Queries return row numbers and array views, so BlockManager
+never creates a Python object per portal, and its per-block grids are only
+built for the blocks it actually visits.
+"""
+import argparse
+import json
+import os
+import tempfile
+
+import numpy as np
+
+import se3
+import metadata_db
+from portal_index import PortalIndex
+
+TABLE_VERSION = 2
+# Portal points are stored in x/z only, so a tilted block transform moves a
+# mapped point slightly off the stored one; matrices have to match exactly.
+POINT_TOL = 0.01
+MATRIX_TOL = 1e-6
+PORTAL_DTYPE = np.dtype([
+    ("src", "<i4"),
+    ("dest", "<i4"),
+    ("cx", "<f8"),
+    ("cz", "<f8"),
+    ("radius", "<f8"),
+    ("dest_x", "<f8"),
+    ("dest_z", "<f8"),
+    # source-local -> destination-local, T_dest⁻¹ · T_src
+    ("transfer", "<f8", (4, 4)),
+])
+
+
+def table_paths(path: str):
+    """
+    (.npy, .json) paths of a compiled table; path may name either or neither.
+    """
+    base = os.path.splitext(path)[0] if path.endswith((".npy", ".json")) else path
+    return base + ".npy", base + ".json"
+
+
+class PortalTable:
+    """
+    Portal graph of a site: rows[offsets[b]:offsets[b + 1]] are the portals
+    leaving blocks[b], in PORTAL_DTYPE.
+    """
+    def __init__(self, blocks, offsets, rows, revision=None):
+        self.blocks = list(blocks)
+        self.offsets = np.asarray(offsets, dtype=np.int64)
+        self.rows = rows
+        self.revision = revision
+        self._slot = {name: i for i, name in enumerate(self.blocks)}
+        self._indexes = {}
+
+    @classmethod
+    def from_rows(cls, transforms: dict, portal_rows, revision: int = None):
+        """
+        Compiles portal rows (tuples in metadata_db.PORTAL_COLUMNS order).
+        revision: metadata_db.load_portal_revision of the database they came from
+        """
+        portal_rows = [tuple(row) for row in portal_rows]
+        blocks = sorted({row[1] for row in portal_rows} | {row[4] for row in portal_rows})
+        for block in blocks:
+            if block not in transforms:
+                raise ValueError(f"Transform for block '{block}' not found.")
+        slot = {name: i for i, name in enumerate(blocks)}
+
+        rows = np.zeros(len(portal_rows), dtype=PORTAL_DTYPE)
+        if portal_rows:
+            _, block_a, xa, za, block_b, xb, zb, radius = zip(*portal_rows)
+            rows["src"] = [slot[b] for b in block_a]
+            rows["dest"] = [slot[b] for b in block_b]
+            rows["cx"], rows["cz"], rows["radius"] = xa, za, radius
+            rows["dest_x"], rows["dest_z"] = xb, zb
+            T = np.stack([transforms[b] for b in blocks])
+            rows["transfer"] = se3.relative(T[rows["src"]], T[rows["dest"]])
+        # Stable, so each block keeps the database order of its portals
+        rows = rows[np.argsort(rows["src"], kind="stable")]
+        offsets = np.searchsorted(rows["src"], np.arange(len(blocks) + 1))
+        return cls(blocks, offsets, rows, revision)
+
+    @classmethod
+    def from_db(cls, db_path: str, transforms: dict = None):
+        # Read first: a write in between leaves the table looking stale, never current
+        revision = metadata_db.load_portal_revision(db_path)
+        transforms = metadata_db.load_transforms(db_path) if transforms is None else transforms
+        return cls.from_rows(transforms, metadata_db.load_portals(db_path), revision)
+
+    @classmethod
+    def load(cls, path: str, mmap: bool = True):
+        """
+        Opens a compiled table; with mmap the rows stay memory-mapped.
+        """
+        npy_path, json_path = table_paths(path)
+        with open(json_path) as f:
+            info = json.load(f)
+        if info.get("version") != TABLE_VERSION:
+            raise RuntimeError(f"Unsupported portal table version {info.get('version')} in {json_path}")
+        rows = np.load(npy_path, mmap_mode="r" if mmap else None)
+        if rows.dtype != PORTAL_DTYPE or len(rows) != info["offsets"][-1]:
+            raise RuntimeError(f"{npy_path} does not match {json_path}")
+        return cls(info["blocks"], info["offsets"], rows, info["revision"])
+
+    def save(self, path: str):
+        npy_path, json_path = table_paths(path)
+        for out, write in ((npy_path, lambda f: np.save(f, np.ascontiguousarray(self.rows))),
+                           (json_path, lambda f: f.write(json.dumps(self.info()).encode()))):
+            fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(out)), suffix=".tmp")
+            try:
+                with os.fdopen(fd, "wb") as f:
+                    write(f)
+                os.replace(tmp_path, out)
+            except BaseException:
+                os.unlink(tmp_path)
+                raise
+        return npy_path, json_path
+
+    def info(self) -> dict:
+        return {
+            "version": TABLE_VERSION,
+            "blocks": self.blocks,
+            "offsets": self.offsets.tolist(),
+            "revision": self.revision,
+        }
+
+    def __len__(self):
+        return len(self.rows)
+
+    def __contains__(self, block):
+        return block in self._slot
+
+    def span(self, block):
+        """
+        (start, end) row range of the portals leaving block; (0, 0) if none.
+        """
+        b = self._slot.get(block)
+        if b is None:
+            return 0, 0
+        return int(self.offsets[b]), int(self.offsets[b + 1])
+
+    def index(self, block):
+        """
+        PortalIndex over block's portals (built on first use), or None if it has none.
+        Its portal numbers are relative to span(block)[0].
+        """
+        if block not in self._indexes:
+            start, end = self.span(block)
+            rows = self.rows[start:end]
+            self._indexes[block] = PortalIndex(rows["cx"], rows["cz"], rows["radius"]) if end > start else None
+        return self._indexes[block]
+
+    def dest_block(self, row: int) -> str:
+        return self.blocks[self.rows["dest"][row]]
+
+    def transfer(self, row: int) -> np.ndarray:
+        return self.rows["transfer"][row]
+
+    def destinations(self, block):
+        """
+        Blocks reachable from block through one portal.
+        """
+        start, end = self.span(block)
+        return [self.blocks[d] for d in np.unique(self.rows["dest"][start:end])]
+
+    def validate(self, tol: float = POINT_TOL):
+        """
+        Checks the round trip of every portal: its transfer maps its center
+        to within tol meters of its destination point, a reverse portal sits
+        at that point, and the reverse transfer maps back to the start.
+        Returns a list of problems (empty if the table is consistent).
+        """
+        rows = self.rows
+        problems = []
+        if len(rows) == 0:
+            return problems
+        centers = np.column_stack([rows["cx"], np.zeros(len(rows)), rows["cz"]])
+        mapped = se3.transform_points(rows["transfer"], centers)
+        off = np.hypot(mapped[:, 0] - rows["dest_x"], mapped[:, 2] - rows["dest_z"])
+        for i in np.flatnonzero(off > tol):
+            problems.append(f"row {i} ({self.blocks[rows['src'][i]]} -> {self.dest_block(i)}): "
+                            f"transfer misses the destination point by {off[i]:.3g}")
+
+        for i in range(len(rows)):
+            start, end = self.span(self.dest_block(i))
+            back = rows[start:end]
+            d = np.hypot(back["cx"] - rows["dest_x"][i], back["cz"] - rows["dest_z"][i])
+            d[back["dest"] != rows["src"][i]] = np.inf
+            j = int(np.argmin(d)) if len(d) else -1
+            if j < 0 or d[j] > tol:
+                problems.append(f"row {i} ({self.blocks[rows['src'][i]]} -> {self.dest_block(i)}): no reverse portal")
+                continue
+            round_trip = back["transfer"][j] @ rows["transfer"][i]
+            if np.abs(round_trip - np.eye(4)).max() > MATRIX_TOL:
+                problems.append(f"row {i} ({self.blocks[rows['src'][i]]} -> {self.dest_block(i)}): "
+                                f"A->B->A round trip is off by {np.abs(round_trip - np.eye(4)).max():.3g}")
+        return problems
+
+
+def _check(table: PortalTable, tol: float = POINT_TOL) -> PortalTable:
+    problems = table.validate(tol)
+    if problems:
+        raise ValueError(f"{len(problems)} portal(s) failed validation:\n" + "\n".join(problems[:20]))
+    return table
+
+
+def compile_table(db_path: str, out_path: str, tol: float = POINT_TOL) -> PortalTable:
+    """
+    Compiles the portals of db_path, validates the round trips and saves the
+    table. This is the only place portals are validated; a table that fails
+    is not written.
+    """
+    table = _check(PortalTable.from_db(db_path), tol)
+    npy_path, _ = table.save(out_path)
+    print(f"Compiled {len(table)} portals of {len(table.blocks)} blocks to {npy_path}")
+    return table
+
+
+def open_table(db_path: str, path: str = None, transforms: dict = None) -> PortalTable:
+    """
+    Portal table matching the current transforms and portals of db_path.
+    path names a compiled table to memory-map. If it is missing or stale, a
+    warning is printed and the table is compiled in memory instead, without
+    validation; run compile_table to refresh the file. Without path the table
+    is always compiled in memory.
+    """
+    if path:
+        revision = metadata_db.load_portal_revision(db_path)
+        try:
+            table = PortalTable.load(path)
+        except (OSError, RuntimeError, KeyError) as e:
+            print(f"Warning: cannot open portal table {path} ({e}); compiling the portals from {db_path} in memory")
+        else:
+            if table.revision == revision:
+                return table
+            print(f"Warning: portal table {path} is stale (revision {table.revision}, database at {revision}); "
+                  f"compiling the portals from {db_path} in memory. "
+                  f"Run 'python portal_table.py --db {db_path} --out {path}' to update it.")
+    return PortalTable.from_db(db_path, transforms)
+
+
+def is_current(db_path: str, path: str) -> bool:
+    """
+    True if the compiled table at path matches the database's transforms and portals.
+    """
+    _, json_path = table_paths(path)
+    if not os.path.exists(json_path):
+        return False
+    with open(json_path) as f:
+        info = json.load(f)
+    return info.get("version") == TABLE_VERSION and info.get("revision") == metadata_db.load_portal_revision(db_path)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compile the portal graph into a memory-mappable table for BlockManager")
+    parser.add_argument("--db", default="metadata.sqlite", help="Metadata database with transforms and portals")
+    parser.add_argument("--out", default="portals.npy", help="Output table (.npy, with a .json next to it)")
+    parser.add_argument("--tol", type=float, default=POINT_TOL, help="Round-trip tolerance in meters")
+    parser.add_argument("--check", action="store_true", help="Only report whether the compiled table is up to date")
+    args = parser.parse_args()
+
+    if not os.path.exists(args.db):
+        raise RuntimeError(f"No database found at {args.db}.")
+    if args.check:
+        print(f"{args.out} is " + ("up to date" if is_current(args.db, args.out) else "stale"))
+    else:
+        compile_table(args.db, args.out, args.tol)
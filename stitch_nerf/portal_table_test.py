@@ -0,0 +1,61 @@
+import os
+import shutil
+
+import numpy as np
+import pytest
+
+import metadata_db
+from block_manager import BlockManager, SiteMetadata
+from portal_table import PortalTable, compile_table, is_current, open_table
+from synthetic_world import generate_world
+
+SHIPPED_DB = os.path.join(os.path.dirname(os.path.abspath(__file__)), "metadata.sqlite")
+
+
+def test_shipped_database_opens_without_a_compiled_table(tmp_path):
+    path = str(tmp_path / "metadata.sqlite")
+    shutil.copy(SHIPPED_DB, path)
+    metadata_db.migrate_db(path)
+    site = SiteMetadata.load(path)
+    assert len(site.portals) == len(metadata_db.load_portals(path))
+
+    manager = BlockManager([(b, f"{b}.msgpack") for b in site.T], path, site=site)
+    assert manager.get_current_block_id() in site.T
+    # Its portals do not round-trip, so compiling a table file refuses them
+    with pytest.raises(ValueError, match="failed validation"):
+        compile_table(path, str(tmp_path / "portals.npy"))
+    assert not os.path.exists(tmp_path / "portals.npy")
+    metadata_db.close_all()
+
+
+def test_compiled_table_is_mapped_until_the_database_changes(tmp_path, capsys):
+    world = generate_world(str(tmp_path), n_blocks=4, n_portals=12)
+    table_path = str(tmp_path / "portals.npy")
+    compile_table(world.db_path, table_path)
+    assert is_current(world.db_path, table_path)
+
+    table = open_table(world.db_path, table_path)
+    assert isinstance(table.rows, np.memmap)
+    capsys.readouterr()
+
+    block = world.blocks[0]
+    metadata_db.store_transform(world.db_path, block, world.transforms[block])  # any write counts
+    assert not is_current(world.db_path, table_path)
+    table = open_table(world.db_path, table_path)
+    assert "stale" in capsys.readouterr().out
+    assert not isinstance(table.rows, np.memmap)
+    assert table.revision == metadata_db.load_portal_revision(world.db_path)
+
+    compile_table(world.db_path, table_path)
+    assert is_current(world.db_path, table_path)
+    metadata_db.close_all()
+
+
+def test_portal_writes_bump_the_revision(tmp_path):
+    world = generate_world(str(tmp_path), n_blocks=3, n_portals=6)
+    revision = metadata_db.load_portal_revision(world.db_path)
+    portal_id = metadata_db.load_portals(world.db_path)[0][0]
+    metadata_db.delete_portals(world.db_path, [portal_id])
+    assert metadata_db.load_portal_revision(world.db_path) > revision
+    assert len(PortalTable.from_db(world.db_path)) == len(metadata_db.load_portals(world.db_path))
+    metadata_db.close_all()
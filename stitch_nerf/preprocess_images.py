@@ -0,0 +1,144 @@
+import argparse
+import json
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from camera_poses import file_digest
+
+CACHE_MANIFEST = ".preprocess_cache.json"
+
+# Intrinsics scaled along x / y when the images are resized
+X_KEYS = ("fl_x", "cx", "w")
+Y_KEYS = ("fl_y", "cy", "h")
+
+
+def select_frames(frames, min_sharpness=None, percentile=None):
+    """
+    Keeps frames whose sharpness is at least min_sharpness and at least the
+    given percentile of all sharpness scores. Frames without a score are kept.
+    """
+    sharpness = np.array([f.get("sharpness", np.nan) for f in frames], dtype=np.float64)
+    threshold = -np.inf
+    if min_sharpness is not None:
+        threshold = max(threshold, min_sharpness)
+    if percentile is not None and np.isfinite(sharpness).any():
+        threshold = max(threshold, np.nanpercentile(sharpness, percentile))
+    keep = np.isnan(sharpness) | (sharpness >= threshold)
+    return [f for f, k in zip(frames, keep) if k]
+
+
+def target_size(w: int, h: int, scale: float = 1.0, max_size: int = None):
+    """
+    Output (w, h) after applying scale and capping the longest edge at max_size.
+    """
+    if max_size:
+        scale = min(scale, max_size / max(w, h))
+    return max(1, int(round(w * scale))), max(1, int(round(h * scale)))
+
+
+def scale_intrinsics(meta: dict, sx: float, sy: float, size):
+    """
+    Returns a copy of the camera parameters of a transforms.json (or of one frame)
+    for images resized by (sx, sy) to size = (w, h).
+    """
+    out = dict(meta)
+    for key in X_KEYS:
+        if key in out:
+            out[key] = out[key] * sx
+    for key in Y_KEYS:
+        if key in out:
+            out[key] = out[key] * sy
+    if "w" in out:
+        out["w"], out["h"] = float(size[0]), float(size[1])
+    return out
+
+
+def process_image(src: str, dst: str, size, quality: int):
+    """
+    Resizes and re-encodes one image. Runs in a worker process.
+    """
+    from PIL import Image
+
+    os.makedirs(os.path.dirname(dst), exist_ok=True)
+    with Image.open(src) as img:
+        if img.size != tuple(size):
+            img = img.resize(tuple(size), Image.LANCZOS)
+        if os.path.splitext(dst)[1].lower() in (".jpg", ".jpeg"):
+            img.convert("RGB").save(dst, quality=quality, optimize=True)
+        else:
+            img.save(dst)
+    return dst
+
+
+def _load_manifest(out_dir):
+    path = os.path.join(out_dir, CACHE_MANIFEST)
+    if not os.path.exists(path):
+        return {}
+    with open(path) as f:
+        return json.load(f)
+
+
+def preprocess(transforms_path: str, out_dir: str, scale: float = 1.0, max_size: int = None,
+               min_sharpness: float = None, percentile: float = None, quality: int = 90, workers: int = None):
+    """
+    Drops blurry frames, writes resized copies of the remaining images to out_dir
+    and a transforms.json with matching intrinsics. Outputs whose source content
+    hash and parameters are unchanged since the last run are not regenerated.
+    """
+    with open(transforms_path) as f:
+        data = json.load(f)
+    src_dir = os.path.dirname(os.path.abspath(transforms_path))
+    os.makedirs(out_dir, exist_ok=True)
+
+    frames = select_frames(data["frames"], min_sharpness, percentile)
+    print(f"Keeping {len(frames)} of {len(data['frames'])} frames")
+
+    w, h = int(data["w"]), int(data["h"])
+    size = target_size(w, h, scale, max_size)
+    sx, sy = size[0] / w, size[1] / h
+
+    manifest = _load_manifest(out_dir)
+    params = {"size": list(size), "quality": quality}
+    jobs, new_manifest = [], {}
+    for frame in frames:
+        rel = frame["file_path"]
+        src = os.path.normpath(os.path.join(src_dir, rel))
+        dst = os.path.normpath(os.path.join(out_dir, rel))
+        entry = {"sha1": file_digest(src), "params": params}
+        new_manifest[rel] = entry
+        if manifest.get(rel) != entry or not os.path.exists(dst):
+            jobs.append((src, dst))
+
+    print(f"Processing {len(jobs)} images ({len(frames) - len(jobs)} cached) at {size[0]}x{size[1]}")
+    if jobs:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            futures = [pool.submit(process_image, src, dst, size, quality) for src, dst in jobs]
+            for future in futures:
+                future.result()
+
+    out = scale_intrinsics({k: v for k, v in data.items() if k != "frames"}, sx, sy, size)
+    out["frames"] = [scale_intrinsics(frame, sx, sy, size) for frame in frames]
+    with open(os.path.join(out_dir, "transforms.json"), "w") as f:
+        json.dump(out, f, indent=2)
+    with open(os.path.join(out_dir, CACHE_MANIFEST), "w") as f:
+        json.dump(new_manifest, f)
+    print(f"Saved {os.path.join(out_dir, 'transforms.json')}")
+    return out
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Filter blurry frames and downscale a block's images for training")
+    parser.add_argument("transforms", help="Path to the block's transforms.json")
+    parser.add_argument("out_dir", help="Output directory for images and the rewritten transforms.json")
+    parser.add_argument("--scale", type=float, default=1.0, help="Resize factor")
+    parser.add_argument("--max_size", type=int, default=None, help="Cap on the longest image edge in pixels")
+    parser.add_argument("--min_sharpness", type=float, default=None, help="Drop frames with a lower sharpness score")
+    parser.add_argument("--sharpness_percentile", type=float, default=None, help="Drop frames below this sharpness percentile (0-100)")
+    parser.add_argument("--quality", type=int, default=90, help="JPEG quality")
+    parser.add_argument("--workers", type=int, default=None, help="Number of worker processes (default: all cores)")
+    args = parser.parse_args()
+
+    preprocess(args.transforms, args.out_dir, args.scale, args.max_size,
+               args.min_sharpness, args.sharpness_percentile, args.quality, args.workers)
@@ -0,0 +1,293 @@
+"""
+Render loop driver shared by renderer.py and headless profiling runs.
+
+run() drives any testbed-like object (frame(), camera_matrix,
+set_nerf_camera_matrix(), load_snapshot()) through a BlockManager and records
+frame-time, portal-check and snapshot-load latency histograms. FakeTestbed
+replays camera motion on the CPU so switch stalls can be measured without
+pyngp or a GPU.
+"""
+import argparse
+import bisect
+import json
+import math
+import os
+import tempfile
+import time
+
+import numpy as np
+
+import se3
+from block_manager import BlockManager
+from snapshot_cache import SnapshotCache
+from snapshot_manifest import load_manifest
+
+
+class LatencyHistogram:
+    """
+    Log-spaced latency histogram with exact count, sum, min and max.
+    Percentiles are reported as the upper edge of the bucket they fall in.
+    """
+    def __init__(self, lo: float = 1e-6, hi: float = 10.0, buckets_per_decade: int = 10):
+        n = int(round(math.log10(hi / lo) * buckets_per_decade))
+        self.edges = [lo * 10 ** (i / buckets_per_decade) for i in range(n + 1)]
+        self.counts = [0] * (n + 2)  # underflow, n buckets, overflow
+        self.count = 0
+        self.total = 0.0
+        self.min = math.inf
+        self.max = 0.0
+
+    def record(self, seconds: float):
+        self.counts[bisect.bisect_right(self.edges, seconds)] += 1
+        self.count += 1
+        self.total += seconds
+        self.min = min(self.min, seconds)
+        self.max = max(self.max, seconds)
+
+    def percentile(self, q: float) -> float:
+        if self.count == 0:
+            return 0.0
+        rank = q / 100.0 * self.count
+        seen = 0
+        for i, c in enumerate(self.counts):
+            seen += c
+            if seen >= rank and c:
+                return self.max if i == len(self.edges) else min(self.edges[i], self.max)
+        return self.max
+
+    def to_dict(self) -> dict:
+        return {
+            "count": self.count,
+            "mean": self.total / self.count if self.count else 0.0,
+            "min": self.min if self.count else 0.0,
+            "max": self.max,
+            "p50": self.percentile(50),
+            "p90": self.percentile(90),
+            "p99": self.percentile(99),
+            # Non-empty buckets as [upper edge in seconds, count]; the overflow bucket has edge null
+            "buckets": [
+                [self.edges[i] if i < len(self.edges) else None, c]
+                for i, c in enumerate(self.counts) if c
+            ],
+        }
+
+
+class RateLimitedLogger:
+    """
+    Prints at most one message per interval seconds and counts the rest.
+    """
+    def __init__(self, interval: float = 1.0, clock=time.monotonic):
+        self.interval = interval
+        self.clock = clock
+        self.suppressed = 0
+        self._next = -math.inf
+
+    def log(self, message: str):
+        now = self.clock()
+        if now < self._next:
+            self.suppressed += 1
+            return
+        if self.suppressed:
+            message += f" ({self.suppressed} suppressed)"
+            self.suppressed = 0
+        print(message)
+        self._next = now + self.interval
+
+
+class FrameStats:
+    """
+    Per-frame instrumentation collected by run().
+    """
+    def __init__(self):
+        self.frame = LatencyHistogram()
+        self.portal_check = LatencyHistogram()
+        self.load_snapshot = LatencyHistogram()
+        self.switches = []  # (frame, source block, dest block, load seconds)
+        self.skipped_checks = 0
+
+    def to_dict(self) -> dict:
+        return {
+            "frames": self.frame.count,
+            "frame_time": self.frame.to_dict(),
+            "portal_check": self.portal_check.to_dict(),
+            "load_snapshot": self.load_snapshot.to_dict(),
+            "skipped_checks": self.skipped_checks,
+            "switches": [
+                {"frame": f, "from": a, "to": b, "load_seconds": s}
+                for f, a, b, s in self.switches
+            ],
+        }
+
+    def save(self, path: str):
+        with open(path, "w") as f:
+            json.dump(self.to_dict(), f, indent=2)
+
+
+def run(testbed, manager=None, stats: FrameStats = None, logger: RateLimitedLogger = None,
+        max_frames: int = None, clock=time.perf_counter) -> FrameStats:
+    """
+    Runs the render loop until testbed.frame() returns False or max_frames
+    frames have been drawn. Whenever the manager says a check is due, the
+    camera position is checked against the current block's portals; on a hit
+    the destination snapshot is loaded and the camera moved into the
+    destination block.
+    Frame time covers testbed.frame() plus the portal check and any switch.
+    """
+    stats = stats or FrameStats()
+    logger = logger or RateLimitedLogger()
+    n = 0
+    start = clock()
+    while (max_frames is None or n < max_frames) and testbed.frame():
+        if manager is not None:
+            cam = testbed.camera_matrix
+            x_pos, y_pos, z_pos = cam[0][3], cam[1][3], cam[2][3]
+            logger.log(f"Frame {n} block {manager.get_current_block_id()} X: {x_pos:.3f} Y: {y_pos:.3f} Z: {z_pos:.3f}")
+
+            t0 = clock()
+            if not manager.check_due():
+                stats.skipped_checks += 1
+                result = None
+            else:
+                source = manager.get_current_block_id()
+                result = manager.check_switch(x_pos, y_pos, z_pos, testbed)
+                t1 = clock()
+                stats.portal_check.record(t1 - t0)
+            if result:
+                _, new_cam = result
+                manager.load_current(testbed)
+                testbed.set_nerf_camera_matrix(new_cam)
+                load_seconds = clock() - t1
+                stats.load_snapshot.record(load_seconds)
+                stats.switches.append((n, source, manager.get_current_block_id(), load_seconds))
+                logger.log(f"Frame {n} switched from block {source} to {manager.get_current_block_id()}")
+
+        end = clock()
+        stats.frame.record(end - start)
+        start = end
+        n += 1
+    return stats
+
+
+class FakeTestbed:
+    """
+    CPU-only stand-in for pyngp.Testbed that replays camera motion.
+
+    steps is a sequence of 4×4 camera-local motions applied one per frame
+    (cam ← cam · step), so the replayed motion carries over unchanged after a
+    portal moves the camera into another block's frame. load_snapshot sleeps
+    for load_time seconds (or reads the file when read=True) to stand in for
+    the GPU upload. elapsed() is the replay time at fps frames per second and
+    can serve as the BlockManager clock.
+    """
+    def __init__(self, steps, start=None, load_time: float = 0.0, read: bool = False, fps: float = 60.0):
+        self.steps = np.asarray(steps, dtype=np.float64)
+        self.fps = fps
+        self._cam = np.eye(4) if start is None else se3.as_transforms(start).copy()
+        self.load_time = load_time
+        self.read = read
+        self.frame_index = -1
+        self.loaded = []
+
+    @classmethod
+    def from_trajectory(cls, poses, **kwargs):
+        """
+        Replays a recorded trajectory of camera-to-world poses (N×3×4 or N×4×4).
+        """
+        poses = se3.as_transforms(poses)
+        steps = se3.inverse(poses[:-1]) @ poses[1:]
+        return cls(steps, start=poses[0], **kwargs)
+
+    @property
+    def camera_matrix(self):
+        return self._cam[:3, :4]
+
+    def set_nerf_camera_matrix(self, matrix):
+        self._cam[:3, :4] = matrix
+
+    def load_snapshot(self, path: str):
+        if self.read:
+            with open(path, "rb") as f:
+                f.read()
+        if self.load_time > 0:
+            time.sleep(self.load_time)
+        self.loaded.append(path)
+
+    def elapsed(self) -> float:
+        return max(self.frame_index, 0) / self.fps
+
+    def frame(self) -> bool:
+        if self.frame_index >= 0:
+            self._cam = self._cam @ self.steps[self.frame_index]
+        self.frame_index += 1
+        return self.frame_index < len(self.steps)
+
+
+def random_walk_steps(n_frames: int, speed: float = 0.05, radius: float = 2.0, turn: float = 0.05,
+                      rng=None) -> np.ndarray:
+    """
+    Camera-local steps of a walk that moves speed forward per frame (along the
+    camera's z axis) on a circle of the given radius, with a random yaw of
+    scale turn radians per frame so the circle wanders.
+    """
+    rng = rng or np.random.default_rng(0)
+    yaw = speed / radius + rng.normal(scale=turn, size=n_frames)
+    c, s = np.cos(yaw), np.sin(yaw)
+    steps = np.tile(np.eye(4), (n_frames, 1, 1))
+    steps[:, 0, 0], steps[:, 0, 2], steps[:, 2, 0], steps[:, 2, 2] = c, s, -s, c
+    steps[:, 2, 3] = speed
+    return steps
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Profile the render loop headlessly with a fake testbed and report JSON")
+    parser.add_argument("--snapshots", default=None, help="Directory of .msgpack snapshots, with or without a manifest (default: generate a synthetic world)")
+    parser.add_argument("--db", default="metadata.sqlite", help="Metadata database for --snapshots")
+    parser.add_argument("--blocks", type=int, default=16, help="Blocks in the synthetic world")
+    parser.add_argument("--portals", type=int, default=64, help="Portals in the synthetic world")
+    parser.add_argument("--snapshot_mb", type=float, default=1.0, help="Size of the synthetic snapshots")
+    parser.add_argument("--frames", type=int, default=10000)
+    parser.add_argument("--speed", type=float, default=0.05, help="Camera speed in meters per frame")
+    parser.add_argument("--radius", type=float, default=2.0, help="Radius of the wandering circle the camera walks")
+    parser.add_argument("--fps", type=float, default=60.0, help="Replay frame rate, used as the portal polling clock")
+    parser.add_argument("--load_time", type=float, default=0.0, help="Simulated seconds per load_snapshot")
+    parser.add_argument("--snapshot_cache_mb", type=int, default=2048)
+    parser.add_argument("--proximity_switch", action="store_true", help="Also switch blocks by AABB, without portals")
+    parser.add_argument("--portal_table", default=None, help="Compiled portal table to memory-map (default: compile from the database)")
+    parser.add_argument("--log_interval", type=float, default=1.0, help="Seconds between camera log lines")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--out", default=None, help="Write the JSON report here instead of stdout")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as root:
+        if args.snapshots:
+            snapshots = load_manifest(args.snapshots)
+            if snapshots is None:
+                names = sorted(f for f in os.listdir(args.snapshots) if f.endswith(".msgpack"))
+                snapshots = [(os.path.splitext(f)[0], os.path.join(args.snapshots, f)) for f in names]
+            db_path = args.db
+        else:
+            from synthetic_world import generate_world
+            world = generate_world(root, args.blocks, args.portals,
+                                   snapshot_bytes=int(args.snapshot_mb * (1 << 20)), seed=args.seed)
+            snapshots, db_path = world.snapshots, world.db_path
+
+        cache = SnapshotCache(max_bytes=args.snapshot_cache_mb << 20)
+        steps = random_walk_steps(args.frames, args.speed, args.radius, rng=np.random.default_rng(args.seed))
+        testbed = FakeTestbed(steps, load_time=args.load_time, read=True, fps=args.fps)
+        manager = BlockManager(snapshots, db_path, cache=cache, clock=testbed.elapsed,
+                               proximity_switch=args.proximity_switch, portal_table=args.portal_table)
+        manager.load_current(testbed)
+
+        stats = run(testbed, manager, logger=RateLimitedLogger(args.log_interval))
+        cache.close()
+
+    report = json.dumps({"benchmark": "render_loop", **stats.to_dict()}, indent=2)
+    if args.out:
+        with open(args.out, "w") as f:
+            f.write(report)
+    else:
+        print(report)
+
+
+if __name__ == "__main__":
+    main()
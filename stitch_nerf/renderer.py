@@ -11,6 +11,9 @@
 # OUR IMPORTS
 import glob
 from block_manager import BlockManager
+from snapshot_cache import SnapshotCache
+from snapshot_manifest import load_manifest
+from render_loop import RateLimitedLogger, run
 # END OF OUR IMPORTS
 
 import argparse
@@ -35,6 +38,12 @@ def parse_args():
 	parser.add_argument("--width", "--screenshot_w", type=int, default=0, help="Resolution width of GUI and screenshots.")
 	parser.add_argument("--height", "--screenshot_h", type=int, default=0, help="Resolution height of GUI and screenshots.")
 	parser.add_argument("--gui", action="store_true", help="Run the testbed GUI interactively.")
+	parser.add_argument("--snapshot_cache_mb", type=int, default=2048, help="Page cache budget for prefetched snapshots of neighbouring blocks.")
+	parser.add_argument("--proximity_switch", action="store_true", help="Also switch blocks when the camera moves into another block's AABB.")
+	parser.add_argument("--prefetch_radius", type=float, default=0.0, help="Also prefetch blocks whose AABB is within this many meters of the current one.")
+	parser.add_argument("--portal_table", type=str, default="", help="Memory-map this compiled portal table (see portal_table.py); if the database changed since, the portals are compiled in memory with a warning.")
+	parser.add_argument("--log_interval", type=float, default=1.0, help="Minimum seconds between camera position log lines.")
+	parser.add_argument("--profile_out", type=str, default="", help="Write frame-time, portal-check and snapshot-load histograms to this JSON file on exit.")
 	return parser.parse_args()
 
 def get_scene(scene):
@@ -71,37 +80,29 @@ if __name__ == "__main__":
 	# For loading the snapshot
 	manager = None
 	if args.snapshots:
-		snapshot_files = sorted(glob.glob(os.path.join(args.snapshots, "*.msgpack")))
-		snapshots = [
-			(os.path.splitext(os.path.basename(path))[0], path)
-			for path in snapshot_files
-		]
-		manager = BlockManager(snapshots, "scripts/metadata.sqlite")
+		# With a manifest (see snapshot_manifest.py) the directory is not scanned
+		snapshots = load_manifest(args.snapshots)
+		if snapshots is None:
+			snapshot_files = sorted(glob.glob(os.path.join(args.snapshots, "*.msgpack")))
+			snapshots = [
+				(os.path.splitext(os.path.basename(path))[0], path)
+				for path in snapshot_files
+			]
+		cache = SnapshotCache(max_bytes=args.snapshot_cache_mb << 20)
+		manager = BlockManager(snapshots, "scripts/metadata.sqlite", cache=cache,
+			proximity_switch=args.proximity_switch, prefetch_radius=args.prefetch_radius,
+			portal_table=args.portal_table or None)
 		scene_info = get_scene(snapshots[0][1])
 		if scene_info is not None:
 			snapshots[0] = default_snapshot_filename(scene_info)
-		testbed.load_snapshot(snapshots[0][1])
+		manager.load_current(testbed)
 
 		print(f"Found {len(snapshots)} snapshots:")
 		for snap in snapshots:
 			print(f" - {snap}")
 
 	# Loop so window stays
-	counter = 0
-	print(snapshots)
-	while testbed.frame():
-		if(counter % 25  == 0):
-			print("Camera matrix: ")
-			print(testbed.camera_matrix)
-			x_pos = testbed.camera_matrix[0][3]
-			y_pos = testbed.camera_matrix[1][3]
-			z_pos = testbed.camera_matrix[2][3]
-			print(f"X: {x_pos:.3f} Y: {y_pos:.3f} Z: {z_pos:.3f}")
-			
-			result = manager.check_switch(x_pos, y_pos, z_pos, testbed)
-			if (result):
-				curr_snapshot, new_cam = result
-				testbed.load_snapshot(curr_snapshot)
-				testbed.set_nerf_camera_matrix(new_cam)
-
-		counter += 1
\ No newline at end of file
+	stats = run(testbed, manager, logger=RateLimitedLogger(args.log_interval))
+	if args.profile_out:
+		stats.save(args.profile_out)
+		print(f"Saved render profile to {args.profile_out}")
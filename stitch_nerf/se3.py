@@ -0,0 +1,60 @@
+import numpy as np
+
+
+def as_transforms(values) -> np.ndarray:
+    """
+    Converts one 4×4 matrix, a stack of them, 3×4 camera matrices or
+    flattened 16-value rows into a float64 array of shape (..., 4, 4).
+    An empty sequence gives an empty (0, 4, 4) stack.
+    """
+    T = np.asarray(values, dtype=np.float64)
+    if T.ndim == 1 and T.size == 0:
+        return np.empty((0, 4, 4))
+    if T.shape[-2:] == (3, 4):
+        bottom = np.broadcast_to([0.0, 0.0, 0.0, 1.0], T.shape[:-2] + (1, 4))
+        return np.concatenate([T, bottom], axis=-2)
+    if T.shape[-2:] != (4, 4):
+        T = T.reshape(T.shape[:-1] + (4, 4))
+    return T
+
+
+def compose(*transforms) -> np.ndarray:
+    """
+    Chains rigid transforms left to right: compose(A, B, C) = A · B · C.
+    Every argument may be a single 4×4 matrix or a broadcastable stack.
+    """
+    result = as_transforms(transforms[0])
+    for T in transforms[1:]:
+        result = result @ as_transforms(T)
+    return result
+
+
+def inverse(T) -> np.ndarray:
+    """
+    Closed-form inverse of rigid transforms: [R | t]⁻¹ = [Rᵀ | -Rᵀ t].
+    Works on a single 4×4 matrix or a stack of shape (..., 4, 4).
+    """
+    T = as_transforms(T)
+    R_t = np.swapaxes(T[..., :3, :3], -1, -2)
+    inv = np.zeros_like(T)
+    inv[..., :3, :3] = R_t
+    inv[..., :3, 3] = -(R_t @ T[..., :3, 3:4])[..., 0]
+    inv[..., 3, 3] = 1.0
+    return inv
+
+
+def relative(T_src, T_dest) -> np.ndarray:
+    """
+    Transfer matrices from source-local to destination-local coordinates,
+    T_dest⁻¹ · T_src, for world-from-local transforms of both blocks.
+    """
+    return inverse(T_dest) @ as_transforms(T_src)
+
+
+def transform_points(T, points) -> np.ndarray:
+    """
+    Applies transforms of shape (..., 4, 4) to points of shape (..., 3).
+    """
+    T = as_transforms(T)
+    points = np.asarray(points, dtype=np.float64)
+    return (T[..., :3, :3] @ points[..., None])[..., 0] + T[..., :3, 3]
@@ -0,0 +1,163 @@
+import argparse
+import heapq
+import json
+
+import numpy as np
+from scipy.spatial import cKDTree
+
+from camera_poses import load_poses
+
+
+def fibonacci_directions(n: int) -> np.ndarray:
+    """
+    n roughly evenly spread unit vectors on the sphere.
+    """
+    i = np.arange(n) + 0.5
+    phi = np.arccos(1 - 2 * i / n)
+    theta = np.pi * (1 + 5 ** 0.5) * i
+    return np.column_stack([np.cos(theta) * np.sin(phi), np.sin(theta) * np.sin(phi), np.cos(phi)])
+
+
+def viewing_directions(poses: np.ndarray) -> np.ndarray:
+    """
+    Unit viewing directions of camera-to-world poses (cameras look down -z).
+    """
+    d = -poses[:, :3, 2]
+    return d / np.linalg.norm(d, axis=1, keepdims=True)
+
+
+def _cell_representatives(centers, dir_bins, priority, cell_size):
+    """
+    Index of the highest-priority frame in every occupied (position cell, direction bin).
+    """
+    cells = np.floor(centers / cell_size).astype(np.int64)
+    keys = np.column_stack([cells, dir_bins])
+    # Sort by key, then by descending priority; the first row of each key wins
+    order = np.lexsort((-priority, keys[:, 3], keys[:, 2], keys[:, 1], keys[:, 0]))
+    sorted_keys = keys[order]
+    first = np.ones(len(order), dtype=bool)
+    first[1:] = np.any(sorted_keys[1:] != sorted_keys[:-1], axis=1)
+    return order[first]
+
+
+def _trim_redundant(features, priority, target):
+    """
+    Indices of `target` rows of features left after repeatedly dropping one
+    frame of the closest remaining pair (the lower-priority one). Each
+    survivor's nearest neighbour is re-queried once its old one is dropped, so
+    near-duplicate pairs lose one member, not both.
+    """
+    m = len(features)
+    tree = cKDTree(features)
+    alive = np.ones(m, dtype=bool)
+    dist, nn = tree.query(features, k=2)
+    dist, nn = dist[:, 1].copy(), nn[:, 1].copy()
+
+    def refresh(i):
+        k = 2
+        while True:
+            d, j = tree.query(features[i], k=min(k, m))
+            found = np.flatnonzero(alive[j] & (j != i))
+            if len(found):
+                dist[i], nn[i] = d[found[0]], j[found[0]]
+                return
+            k *= 2
+
+    heap = [(dist[i], i) for i in range(m)]
+    heapq.heapify(heap)
+    for _ in range(m - target):
+        while True:
+            d, i = heapq.heappop(heap)
+            if not alive[i] or d != dist[i]:
+                continue
+            if not alive[nn[i]]:
+                refresh(i)
+                heapq.heappush(heap, (dist[i], i))
+                continue
+            break
+        j = nn[i]
+        drop, survivor = (i, j) if (priority[i], -i) < (priority[j], -j) else (j, i)
+        alive[drop] = False
+        if alive.sum() > 1:
+            refresh(survivor)
+            heapq.heappush(heap, (dist[survivor], survivor))
+    return np.flatnonzero(alive)
+
+
+def select_keyframes(centers: np.ndarray, directions: np.ndarray, target: int, sharpness=None,
+                     n_dir_bins: int = 64, angle_weight: float = 1.0, iterations: int = 40) -> np.ndarray:
+    """
+    Picks `target` frames that cover both camera positions and viewing directions.
+
+    Frames are binned by viewing direction and by a position grid whose cell size
+    is bisected until about `target` (cell, direction) bins are occupied; each bin
+    keeps its sharpest frame. Any surplus is trimmed greedily: one frame (the
+    less sharp) of the closest pair in pose space (position + angle_weight ·
+    direction, via a KD-tree) is dropped at a time, so the most redundant
+    frames go first without opening gaps.
+    Returns sorted frame indices.
+    """
+    n = len(centers)
+    if target >= n:
+        return np.arange(n)
+    if target <= 0:
+        return np.empty(0, dtype=np.int64)
+
+    dir_bins = np.argmax(directions @ fibonacci_directions(n_dir_bins).T, axis=1)
+    priority = np.nan_to_num(np.asarray(sharpness, dtype=np.float64), nan=0.0) if sharpness is not None else np.zeros(n)
+
+    extent = float(np.ptp(centers, axis=0).max()) or 1.0
+    lo, hi = extent * 1e-6, extent * 2.0
+    keep = _cell_representatives(centers, dir_bins, priority, hi)
+    for _ in range(iterations):
+        mid = np.sqrt(lo * hi)
+        candidate = _cell_representatives(centers, dir_bins, priority, mid)
+        if len(candidate) >= target:
+            keep, lo = candidate, mid
+        else:
+            hi = mid
+        if len(keep) == target:
+            break
+
+    if len(keep) > target:
+        features = np.hstack([centers[keep], angle_weight * directions[keep]])
+        keep = keep[_trim_redundant(features, priority[keep], target)]
+    return np.sort(keep)
+
+
+def coverage(centers, directions, keep, angle_weight=1.0):
+    """
+    Distance in pose space from every frame to its nearest kept frame: (mean, max).
+    """
+    tree = cKDTree(np.hstack([centers[keep], angle_weight * directions[keep]]))
+    dist, _ = tree.query(np.hstack([centers, angle_weight * directions]))
+    return float(dist.mean()), float(dist.max())
+
+
+def main(transforms_path, out_path, fraction, n_dir_bins, angle_weight):
+    poses = load_poses(transforms_path)
+    centers, directions = poses.centers, viewing_directions(poses.poses)
+    target = int(round(fraction * len(poses)))
+
+    keep = select_keyframes(centers, directions, target, poses.sharpness, n_dir_bins, angle_weight)
+    mean_d, max_d = coverage(centers, directions, keep, angle_weight)
+    print(f"Kept {len(keep)} of {len(poses)} frames (coverage distance mean {mean_d:.4f}, max {max_d:.4f})")
+
+    with open(transforms_path) as f:
+        data = json.load(f)
+    data["frames"] = [data["frames"][i] for i in keep]
+    with open(out_path, "w") as f:
+        json.dump(data, f, indent=2)
+    print(f"Saved {out_path}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Subsample near-duplicate frames of a transforms.json by pose coverage")
+    parser.add_argument("transforms", help="Path to transforms.json")
+    parser.add_argument("out", help="Path to write the trimmed transforms.json")
+    parser.add_argument("--fraction", type=float, default=0.5, help="Fraction of frames to keep")
+    parser.add_argument("--dir_bins", type=int, default=64, help="Number of viewing-direction bins")
+    parser.add_argument("--angle_weight", type=float, default=1.0, help="Meters per radian when comparing poses")
+    args = parser.parse_args()
+
+    main(args.transforms, args.out, args.fraction, args.dir_bins, args.angle_weight)
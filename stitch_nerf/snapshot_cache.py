@@ -0,0 +1,133 @@
+import mmap
+import os
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+
+class SnapshotLoader:
+    """
+    Pluggable snapshot loading interface used by SnapshotCache.
+    read() runs on a worker thread and returns the snapshot data (anything
+    with a len() in bytes), apply() runs on the render thread and hands the
+    snapshot to the testbed.
+    """
+    def read(self, path: str) -> bytes:
+        raise NotImplementedError
+
+    def apply(self, testbed, path: str, data: bytes):
+        raise NotImplementedError
+
+
+class FileSnapshotLoader(SnapshotLoader):
+    """
+    Default loader for instant-ngp .msgpack snapshots.
+    pyngp only loads snapshots from a path, so there are no bytes to hand
+    over: read() maps the file and faults every page in, and the cached
+    mapping keeps it in the page cache so load_snapshot reads it from memory
+    instead of the disk. The cache budget is page cache held by mapped
+    snapshots, not a private copy of each file.
+    """
+    def read(self, path: str):
+        with open(path, "rb") as f:
+            if os.fstat(f.fileno()).st_size == 0:
+                return b""
+            data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        if hasattr(mmap, "MADV_WILLNEED"):
+            data.madvise(mmap.MADV_WILLNEED)
+        data[::mmap.PAGESIZE]  # touch every page on this worker thread
+        return data
+
+    def apply(self, testbed, path: str, data: bytes):
+        testbed.load_snapshot(path)
+
+
+class SnapshotCache:
+    """
+    LRU cache of snapshot data filled by a background thread pool.
+    Entries are evicted least-recently-used first once the cached bytes exceed
+    max_bytes. Entries that are pinned (the block currently displayed) are
+    never evicted.
+    """
+    def __init__(self, loader: SnapshotLoader = None, max_bytes: int = 2 << 30, workers: int = 2):
+        self.loader = loader or FileSnapshotLoader()
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()  # path -> snapshot data
+        self._pending = {}             # path -> Future
+        self._pinned = set()
+        self._size = 0
+        self._lock = threading.Lock()
+        self._pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="snapshot-prefetch")
+
+    def __contains__(self, path):
+        with self._lock:
+            return path in self._entries
+
+    @property
+    def size_bytes(self):
+        return self._size
+
+    def prefetch(self, paths):
+        """
+        Schedules a background read for every path that is neither cached nor in flight.
+        """
+        with self._lock:
+            for path in paths:
+                if path in self._entries:
+                    self._entries.move_to_end(path)
+                elif path not in self._pending:
+                    self._pending[path] = self._pool.submit(self._read, path)
+
+    def get(self, path: str) -> bytes:
+        """
+        Returns the data for path, waiting on an in-flight read or reading
+        synchronously on a miss.
+        """
+        with self._lock:
+            data = self._entries.get(path)
+            if data is not None:
+                self._entries.move_to_end(path)
+                return data
+            future = self._pending.get(path)
+
+        if future is not None:
+            return future.result()
+        return self._read(path)
+
+    def load(self, testbed, path: str):
+        """
+        Loads the snapshot into the testbed from the cache and pins it as the
+        displayed block.
+        """
+        data = self.get(path)
+        with self._lock:
+            self._pinned = {path}
+        self.loader.apply(testbed, path, data)
+
+    def _read(self, path):
+        try:
+            data = self.loader.read(path)
+        except Exception:
+            with self._lock:
+                self._pending.pop(path, None)
+            raise
+
+        with self._lock:
+            self._pending.pop(path, None)
+            if path not in self._entries:
+                self._entries[path] = data
+                self._size += len(data)
+            self._entries.move_to_end(path)
+            self._evict()
+        return data
+
+    def _evict(self):
+        for path in list(self._entries):
+            if self._size <= self.max_bytes:
+                break
+            if path in self._pinned:
+                continue
+            self._size -= len(self._entries.pop(path))
+
+    def close(self):
+        self._pool.shutdown(wait=False, cancel_futures=True)
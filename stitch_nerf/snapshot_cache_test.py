@@ -0,0 +1,83 @@
+import threading
+
+from render_loop import FakeTestbed
+from snapshot_cache import FileSnapshotLoader, SnapshotCache
+
+
+class CountingLoader(FileSnapshotLoader):
+    """
+    FileSnapshotLoader that counts reads and can hold them until released.
+    """
+    def __init__(self, block=False):
+        self.reads = []
+        self.release = threading.Event()
+        if not block:
+            self.release.set()
+
+    def read(self, path):
+        self.release.wait(5)
+        self.reads.append(path)
+        return super().read(path)
+
+
+def make_snapshots(tmp_path, n, size=1000):
+    paths = []
+    for i in range(n):
+        path = tmp_path / f"block_{i}.msgpack"
+        path.write_bytes(bytes([i]) * size)
+        paths.append(str(path))
+    return paths
+
+
+def test_prefetched_snapshot_is_a_hit(tmp_path):
+    paths = make_snapshots(tmp_path, 2)
+    loader = CountingLoader()
+    cache = SnapshotCache(loader)
+    cache.prefetch(paths)
+    for path in paths:
+        cache.get(path)
+    assert all(path in cache for path in paths)
+
+    testbed = FakeTestbed([])
+    cache.load(testbed, paths[1])
+    assert testbed.loaded == [paths[1]]
+    assert sorted(loader.reads) == sorted(paths)  # the load was served from the cache
+    cache.close()
+
+
+def test_prefetch_deduplicates_in_flight_reads(tmp_path):
+    path = make_snapshots(tmp_path, 1)[0]
+    loader = CountingLoader(block=True)
+    cache = SnapshotCache(loader)
+    cache.prefetch([path])
+    cache.prefetch([path])
+    assert path not in cache
+
+    loader.release.set()
+    assert len(cache.get(path)) == 1000  # waits on the pending read
+    assert loader.reads == [path]
+    cache.close()
+
+
+def test_least_recently_used_is_evicted_but_not_the_pinned_block(tmp_path):
+    paths = make_snapshots(tmp_path, 4)
+    cache = SnapshotCache(CountingLoader(), max_bytes=2500)
+    testbed = FakeTestbed([])
+    cache.load(testbed, paths[0])  # displayed, so pinned
+    cache.get(paths[1])
+    cache.get(paths[2])
+    assert paths[0] in cache and paths[1] not in cache and paths[2] in cache
+
+    cache.get(paths[3])
+    assert paths[0] in cache and paths[2] not in cache and paths[3] in cache
+    assert cache.size_bytes == 2000
+    cache.close()
+
+
+def test_file_loader_maps_the_whole_snapshot(tmp_path):
+    path = make_snapshots(tmp_path, 1, size=10000)[0]
+    data = FileSnapshotLoader().read(path)
+    assert len(data) == 10000 and data[:3] == b"\0\0\0"
+    empty = tmp_path / "empty.msgpack"
+    empty.write_bytes(b"")
+    assert FileSnapshotLoader().read(str(empty)) == b""
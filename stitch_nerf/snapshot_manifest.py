@@ -0,0 +1,115 @@
+"""
+Manifest of a directory of instant-ngp .msgpack snapshots.
+
+The manifest lists block name, snapshot path, size and content hash, so the
+renderer starts from one small JSON file instead of scanning the snapshot
+directory. pyngp only loads whole snapshots from a path, so the snapshots
+themselves are left as they are; SnapshotCache maps them into the page cache
+ahead of a block switch.
+"""
+import argparse
+import json
+import os
+
+from camera_poses import file_digest
+
+MANIFEST_NAME = "snapshot_manifest.json"
+MANIFEST_VERSION = 3
+
+
+def _read_manifest(snapshot_dir: str):
+    """
+    The manifest in snapshot_dir, or None if there is none.
+    """
+    path = os.path.join(snapshot_dir, MANIFEST_NAME)
+    if not os.path.exists(path):
+        return None
+    with open(path) as f:
+        manifest = json.load(f)
+    if manifest.get("version") != MANIFEST_VERSION:
+        raise RuntimeError(f"Unsupported snapshot manifest version {manifest.get('version')} in {path}; "
+                           f"run 'python snapshot_manifest.py {snapshot_dir}' to rewrite it")
+    return manifest
+
+
+def load_manifest(snapshot_dir: str):
+    """
+    Returns [(block, .msgpack path)] from the manifest in snapshot_dir, or
+    None if there is no manifest.
+    """
+    manifest = _read_manifest(snapshot_dir)
+    if manifest is None:
+        return None
+    return [(entry["block"], os.path.normpath(os.path.join(snapshot_dir, entry["snapshot"])))
+            for entry in manifest["blocks"]]
+
+
+def verify_manifest(snapshot_dir: str, check_hash: bool = False):
+    """
+    Returns the blocks whose snapshot is missing or differs in size (or hash)
+    from the manifest.
+    """
+    manifest = _read_manifest(snapshot_dir)
+    if manifest is None:
+        raise RuntimeError(f"No {MANIFEST_NAME} in {snapshot_dir}")
+    bad = []
+    for entry in manifest["blocks"]:
+        path = os.path.join(snapshot_dir, entry["snapshot"])
+        if (not os.path.exists(path) or os.path.getsize(path) != entry["size"]
+                or (check_hash and file_digest(path) != entry["sha1"])):
+            bad.append(entry["block"])
+    return bad
+
+
+def write_manifest(src_dir: str, out_dir: str = None):
+    """
+    Writes the manifest of every .msgpack in src_dir to out_dir (default:
+    src_dir). Snapshots whose size and mtime are unchanged since the last run
+    keep their hash instead of being read again.
+    """
+    out_dir = out_dir or src_dir
+    os.makedirs(out_dir, exist_ok=True)
+    manifest_path = os.path.join(out_dir, MANIFEST_NAME)
+    previous = {}
+    if os.path.exists(manifest_path):
+        with open(manifest_path) as f:
+            manifest = json.load(f)
+        if manifest.get("version") == MANIFEST_VERSION:
+            previous = {e["block"]: e for e in manifest["blocks"]}
+
+    entries = []
+    for name in sorted(f for f in os.listdir(src_dir) if f.endswith(".msgpack")):
+        block = os.path.splitext(name)[0]
+        src = os.path.join(src_dir, name)
+        st = os.stat(src)
+        entry = {
+            "block": block,
+            "snapshot": os.path.relpath(src, out_dir),
+            "size": st.st_size,
+            "mtime_ns": st.st_mtime_ns,
+        }
+        old = previous.get(block)
+        if old and all(old.get(k) == v for k, v in entry.items()):
+            entry["sha1"] = old["sha1"]
+        else:
+            entry["sha1"] = file_digest(src)
+        entries.append(entry)
+
+    with open(manifest_path, "w") as f:
+        json.dump({"version": MANIFEST_VERSION, "blocks": entries}, f, indent=2)
+    print(f"Saved {manifest_path} ({len(entries)} blocks)")
+    return entries
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Write a manifest of .msgpack snapshots so the renderer does not scan the directory")
+    parser.add_argument("snapshots", help="Directory containing .msgpack snapshots")
+    parser.add_argument("--out_dir", default=None, help="Where to write the manifest (default: the snapshot directory)")
+    parser.add_argument("--verify", action="store_true", help="Only check the snapshots against an existing manifest")
+    args = parser.parse_args()
+
+    if args.verify:
+        bad = verify_manifest(args.out_dir or args.snapshots, check_hash=True)
+        print(f"{len(bad)} snapshots do not match the manifest" + (": " + ", ".join(bad) if bad else ""))
+    else:
+        write_manifest(args.snapshots, args.out_dir)
@@ -0,0 +1,62 @@
+import json
+import os
+
+import numpy as np
+import pytest
+
+from snapshot_manifest import MANIFEST_NAME, load_manifest, verify_manifest, write_manifest
+from synthetic_world import synthetic_snapshot
+
+
+def make_snapshots(snapshot_dir, n):
+    rng = np.random.default_rng(0)
+    os.makedirs(snapshot_dir, exist_ok=True)
+    for i in range(n):
+        with open(os.path.join(snapshot_dir, f"block_{i}.msgpack"), "wb") as f:
+            f.write(synthetic_snapshot(5000, rng))
+
+
+def test_manifest_round_trip(tmp_path):
+    snapshot_dir = str(tmp_path / "snapshots")
+    make_snapshots(snapshot_dir, 3)
+    write_manifest(snapshot_dir)
+    assert load_manifest(snapshot_dir) == [
+        (f"block_{i}", os.path.join(snapshot_dir, f"block_{i}.msgpack")) for i in range(3)
+    ]
+    assert verify_manifest(snapshot_dir, check_hash=True) == []
+    assert load_manifest(str(tmp_path)) is None
+
+
+def test_manifest_in_another_directory_points_at_the_snapshots(tmp_path):
+    snapshot_dir = str(tmp_path / "snapshots")
+    out_dir = str(tmp_path / "out")
+    make_snapshots(snapshot_dir, 2)
+    write_manifest(snapshot_dir, out_dir)
+    assert [path for _, path in load_manifest(out_dir)] == [
+        os.path.join(snapshot_dir, f"block_{i}.msgpack") for i in range(2)
+    ]
+    assert verify_manifest(out_dir) == []
+
+
+def test_verify_reports_changed_and_missing_snapshots(tmp_path):
+    snapshot_dir = str(tmp_path)
+    make_snapshots(snapshot_dir, 3)
+    write_manifest(snapshot_dir)
+    path = os.path.join(snapshot_dir, "block_1.msgpack")
+    with open(path, "r+b") as f:
+        f.write(b"\xff")  # same size, different content
+    os.remove(os.path.join(snapshot_dir, "block_2.msgpack"))
+    assert verify_manifest(snapshot_dir) == ["block_2"]
+    assert verify_manifest(snapshot_dir, check_hash=True) == ["block_1", "block_2"]
+
+    write_manifest(snapshot_dir)
+    assert verify_manifest(snapshot_dir, check_hash=True) == []
+
+
+def test_old_manifest_version_is_rejected(tmp_path):
+    with open(tmp_path / MANIFEST_NAME, "w") as f:
+        json.dump({"version": 2, "blocks": [{"block": "a", "file": "a.ngppack", "size": 1}]}, f)
+    with pytest.raises(RuntimeError, match="version 2"):
+        load_manifest(str(tmp_path))
+    with pytest.raises(RuntimeError, match="version 2"):
+        verify_manifest(str(tmp_path))
@@ -0,0 +1,47 @@
+"""
+Single entry point for the stitching tools:
+
+    python stitch_nerf.py <command> [command arguments]
+
+Each command calls its script's main() with the remaining arguments. The
+script's module is only imported once the command is known, so
+metadata-only commands (inspect, migrate, portals) never load Open3D or SciPy.
+"""
+import argparse
+import importlib
+import sys
+
+# command -> (module, description)
+COMMANDS = {
+    "align": ("align_blocks", "Align blocks with ICP and store their global transforms"),
+    "auto-align": ("auto_initial_align", "Estimate initial transforms with FPFH + RANSAC"),
+    "manual-align": ("manual_initial_align", "Set a block's initial transform interactively"),
+    "portals": ("define_portals", "Sync the portals table from a CSV and compile the portal table"),
+    "inspect": ("inspect_sql", "Print the transforms and AABBs in metadata.sqlite"),
+    "migrate": ("metadata_db", "Upgrade metadata.sqlite to the current schema"),
+    "convert": ("obj_to_ply", "Convert .obj meshes to .ply point clouds"),
+}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        prog="stitch_nerf",
+        description="NeRF block stitching tools",
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+        epilog="commands:\n" + "\n".join(f"  {name:<14}{desc}" for name, (_, desc) in COMMANDS.items())
+              + "\n\nRun 'stitch_nerf <command> -h' for a command's options.",
+    )
+    parser.add_argument("command", choices=COMMANDS, metavar="command")
+    parser.add_argument("args", nargs=argparse.REMAINDER, help=argparse.SUPPRESS)
+    argv = sys.argv[1:] if argv is None else argv
+    if not argv:
+        parser.exit(2, parser.format_help())
+    args = parser.parse_args(argv)
+
+    module, _ = COMMANDS[args.command]
+    sys.argv = [f"stitch_nerf {args.command}"] + args.args
+    importlib.import_module(module).main()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,189 @@
+"""
+Generator for synthetic stitched worlds used by benchmarks and CPU-only
+tests: N blocks laid out on a grid, M portals between neighbouring blocks
+and K-point clouds cut out of one shared scene.
+"""
+import csv
+import os
+from dataclasses import dataclass, field
+from typing import List
+
+import msgpack
+import numpy as np
+from scipy.spatial.transform import Rotation
+
+import metadata_db
+import se3
+from define_portals import add_portals_from_csv
+from ply_io import write_ply
+
+BLOCK_SPACING = 4.0
+
+
+@dataclass
+class SyntheticWorld:
+    root: str
+    db_path: str
+    csv_path: str
+    blocks: List[str]
+    transforms: dict
+    snapshots: List[tuple] = field(default_factory=list)  # (block, .msgpack path)
+    ply_paths: dict = field(default_factory=dict)         # block -> .ply path
+
+
+def random_block_transforms(n_blocks: int, rng, spacing: float = BLOCK_SPACING) -> dict:
+    """
+    World-from-local transforms for blocks on a square grid in the x/z plane,
+    each with a random yaw and a small tilt.
+    """
+    side = int(np.ceil(np.sqrt(n_blocks)))
+    transforms = {}
+    for i in range(n_blocks):
+        T = np.eye(4)
+        yaw = Rotation.from_euler("y", rng.uniform(-np.pi, np.pi))
+        tilt = Rotation.from_rotvec(rng.normal(scale=0.01, size=3))
+        T[:3, :3] = (tilt * yaw).as_matrix()
+        T[:3, 3] = [(i % side) * spacing, rng.normal(scale=0.05), (i // side) * spacing]
+        transforms[f"block_{i:05d}"] = T
+    return transforms
+
+
+def grid_aabbs(transforms: dict, spacing: float = BLOCK_SPACING, height=(-1.0, 3.0)) -> dict:
+    """
+    World-space AABBs tiling the grid: one spacing × spacing cell per block.
+    """
+    aabbs = {}
+    for name, T in transforms.items():
+        cx, cz = T[0, 3], T[2, 3]
+        aabbs[name] = (np.array([cx - spacing / 2, height[0], cz - spacing / 2]),
+                       np.array([cx + spacing / 2, height[1], cz + spacing / 2]))
+    return aabbs
+
+
+def write_portals_csv(csv_path: str, blocks, transforms, n_portals: int, rng, spacing: float = BLOCK_SPACING):
+    """
+    Places n_portals portals, each on the boundary between a block and its
+    nearest neighbour, and writes them in define_portals CSV format. A single
+    block has no neighbour, so it gets no portals.
+    """
+    names = list(blocks)
+    if len(names) < 2:
+        n_portals = 0
+    centers = np.stack([transforms[b][:3, 3] for b in names])
+    with open(csv_path, "w", newline="") as f:
+        writer = csv.writer(f)
+        for _ in range(n_portals):
+            a = rng.integers(len(names))
+            d = np.linalg.norm(centers - centers[a], axis=1)
+            d[a] = np.inf
+            b = int(np.argmin(d))
+            # Portal halfway between the blocks, jittered, expressed in block A's frame
+            world = (centers[a] + centers[b]) / 2 + rng.normal(scale=spacing * 0.1, size=3)
+            local = se3.transform_points(se3.inverse(transforms[names[a]]), world)
+            writer.writerow([names[a], f"{local[0]:.6f}", f"{local[2]:.6f}", names[b]])
+
+
+def scene_points(n_points: int, extent, rng) -> np.ndarray:
+    """
+    Points on a ground plane plus scattered box-like structures over extent = (x, z).
+    """
+    n_ground = n_points // 2
+    ground = np.column_stack([rng.uniform(-2, extent[0] + 2, n_ground), np.zeros(n_ground),
+                              rng.uniform(-2, extent[1] + 2, n_ground)])
+    n_walls = n_points - n_ground
+    anchors = np.column_stack([rng.uniform(-2, extent[0] + 2, 64), rng.uniform(-2, extent[1] + 2, 64)])
+    pick = rng.integers(len(anchors), size=n_walls)
+    walls = np.column_stack([
+        anchors[pick, 0] + rng.uniform(-0.5, 0.5, n_walls) * (rng.random(n_walls) < 0.5),
+        rng.uniform(0, 2.5, n_walls),
+        anchors[pick, 1] + rng.uniform(-0.5, 0.5, n_walls),
+    ])
+    return np.vstack([ground, walls])
+
+
+def write_block_clouds(root: str, blocks, transforms, n_points: int, rng, radius: float = BLOCK_SPACING):
+    """
+    Writes each block's cloud (the scene within radius of the block, in block-local
+    coordinates) and an initial_transform.npy close to the true block-to-block
+    transform relative to the previous block. Returns {block: ply path}.
+    """
+    names = list(blocks)
+    centers = np.stack([transforms[b][:3, 3] for b in names])
+    extent = (centers[:, 0].max(), centers[:, 2].max())
+    per_block_density = n_points / (np.pi * radius ** 2)
+    area = (extent[0] + 4) * (extent[1] + 4)
+    world = scene_points(int(per_block_density * area), extent, rng)
+
+    ply_paths = {}
+    for i, name in enumerate(names):
+        block_dir = os.path.join(root, name)
+        os.makedirs(block_dir, exist_ok=True)
+        near = world[np.linalg.norm(world[:, [0, 2]] - centers[i, [0, 2]], axis=1) < radius]
+        local = se3.transform_points(se3.inverse(transforms[name]), near)
+        ply_paths[name] = os.path.join(block_dir, f"{name}.ply")
+        write_ply(ply_paths[name], local)
+
+        ref = names[max(i - 1, 0)]
+        init = se3.relative(transforms[name], transforms[ref])
+        noise = np.eye(4)
+        noise[:3, :3] = Rotation.from_rotvec(rng.normal(scale=0.01, size=3)).as_matrix()
+        noise[:3, 3] = rng.normal(scale=0.03, size=3)
+        np.save(os.path.join(block_dir, "initial_transform.npy"), noise @ init)
+    return ply_paths
+
+
+def synthetic_snapshot(n_bytes: int, rng) -> bytes:
+    """
+    msgpack payload shaped like an instant-ngp snapshot: small config values
+    plus network parameters (random float16) and a density grid (mostly
+    empty, so it compresses) splitting about n_bytes between them.
+    """
+    n_params = max(n_bytes // 4, 1)
+    grid = np.zeros(max(n_bytes - 2 * n_params, 1), dtype=np.uint8)
+    occupied = rng.random(len(grid)) < 0.05
+    grid[occupied] = rng.integers(1, 255, occupied.sum())
+    tree = {
+        "encoding": {"otype": "HashGrid", "n_levels": 16, "n_features_per_level": 2},
+        "network": {"otype": "FullyFusedMLP", "n_neurons": 64, "n_hidden_layers": 1},
+        "snapshot": {
+            "version": 1,
+            "aabb": {"min": [0.0, 0.0, 0.0], "max": [1.0, 1.0, 1.0]},
+            "params_type": "__half",
+            "params_binary": rng.standard_normal(n_params).astype(np.float16).tobytes(),
+            "density_grid_binary": grid.tobytes(),
+        },
+    }
+    return msgpack.packb(tree, use_bin_type=True)
+
+
+def generate_world(root: str, n_blocks: int, n_portals: int, n_points: int = 0,
+                   snapshot_bytes: int = 1024, seed: int = 0) -> SyntheticWorld:
+    """
+    Writes a complete synthetic world under root: metadata.sqlite with block
+    transforms, AABBs and portals, portals.csv, synthetic .msgpack snapshots and, when
+    n_points > 0, per-block .ply clouds of about n_points points.
+    """
+    rng = np.random.default_rng(seed)
+    os.makedirs(root, exist_ok=True)
+    db_path = os.path.join(root, "metadata.sqlite")
+    csv_path = os.path.join(root, "portals.csv")
+
+    transforms = random_block_transforms(n_blocks, rng)
+    blocks = list(transforms)
+    metadata_db.store_transforms(db_path, transforms)
+    metadata_db.store_aabbs(db_path, grid_aabbs(transforms))
+    write_portals_csv(csv_path, blocks, transforms, n_portals, rng)
+    add_portals_from_csv(db_path, csv_path)
+
+    world = SyntheticWorld(root, db_path, csv_path, blocks, transforms)
+    snapshot_dir = os.path.join(root, "snapshots")
+    os.makedirs(snapshot_dir, exist_ok=True)
+    for name in blocks:
+        path = os.path.join(snapshot_dir, f"{name}.msgpack")
+        with open(path, "wb") as f:
+            f.write(synthetic_snapshot(snapshot_bytes, rng))
+        world.snapshots.append((name, path))
+
+    if n_points > 0:
+        world.ply_paths = write_block_clouds(root, blocks, transforms, n_points, rng)
+    return world
@@ -0,0 +1,182 @@
+"""
+Offline tour planner: splits a world-space camera path into per-block
+segments of local camera matrices for rendering flythroughs.
+
+The path is cut with the same rules BlockManager applies frame by frame
+(portal entry first, then AABB membership when the camera leaves the
+current block's box), but each block's part of the path is transformed
+and tested in vectorized windows, so every frame is transformed about once. Segments are independent, so each can be
+rendered by a separate worker with only its block's snapshot loaded.
+"""
+import argparse
+import json
+import os
+from dataclasses import dataclass
+
+import numpy as np
+
+import se3
+import metadata_db
+from block_index import BlockIndex
+from camera_poses import load_poses
+from portal_table import PortalTable, open_table
+
+# Frames transformed per step while looking for the end of a segment; doubles each step
+WINDOW = 256
+
+
+@dataclass
+class TourSegment:
+    """
+    Frames [start, end) of the path rendered in block, with their
+    (end - start, 3, 4) camera matrices in that block's local frame.
+    """
+    block: str
+    start: int
+    end: int
+    camera_matrices: np.ndarray
+
+    def to_dict(self) -> dict:
+        return {
+            "block": self.block,
+            "start": self.start,
+            "end": self.end,
+            "camera_matrices": self.camera_matrices.tolist(),
+        }
+
+
+def load_path(path: str) -> np.ndarray:
+    """
+    Reads world-space camera-to-world poses from a .npy array ((N, 3, 4) or
+    (N, 4, 4)) or a transforms.json-style file with a "frames" list.
+    """
+    if path.endswith(".npy"):
+        return se3.as_transforms(np.load(path))
+    return load_poses(path).poses
+
+
+def _aabb_switch(block_index, block, world, start, end):
+    """
+    First frame in [start, end) where the camera is outside block's AABB and
+    inside another block's, with that block; (end, None) if there is none.
+    """
+    if block_index is None or block not in block_index or start >= end:
+        return end, None
+    outside = np.flatnonzero(~block_index.contains_points(block, world[start:end]))
+    for f in start + outside:
+        dest = block_index.locate(*world[f], current=block)
+        if dest is not None:
+            return int(f), dest
+    return end, None
+
+
+def plan_tour(world_poses, transforms: dict, portals: PortalTable = None,
+              block_index: BlockIndex = None, start_block: str = None):
+    """
+    Splits world_poses (N camera-to-world matrices) into TourSegments.
+    transforms: {block: world-from-local transform}
+    portals: compiled PortalTable (see portal_table.open_table)
+    block_index: BlockIndex of world AABBs
+    start_block defaults to the block whose AABB contains the first frame.
+    """
+    poses = se3.as_transforms(world_poses)
+    n = len(poses)
+    world = poses[:, :3, 3]
+
+    block = start_block
+    if block is None and block_index is not None and n:
+        block = block_index.locate(*world[0])
+    if block is None:
+        raise ValueError("Cannot tell which block the path starts in; pass start_block")
+
+    segments = []
+    i = 0
+    while i < n:
+        if block not in transforms:
+            raise ValueError(f"Transform for block '{block}' not found.")
+        end, dest, local = _segment_end(poses, world, i, block, se3.inverse(transforms[block]), portals, block_index)
+        segments.append(TourSegment(block, i, end, local[:end - i, :3, :4]))
+        if dest is None:
+            break
+        block, i = dest, end
+    return segments
+
+
+def _segment_end(poses, world, i, block, T_inv, portals, block_index):
+    """
+    (end, dest block or None, local poses from frame i) of the segment that
+    starts at frame i in block. Frames are moved into the block's frame a
+    window at a time until the segment ends, so a long path is only
+    transformed once in total rather than once per segment.
+    """
+    n = len(poses)
+    index = portals.index(block) if portals is not None else None
+    first_row = portals.span(block)[0] if portals is not None else 0
+    parts = []
+    a, window = i, WINDOW
+    while True:
+        b = min(a + window, n)
+        parts.append(T_inv @ poses[a:b])
+        # Include the window's previous frame so the segment into frame a is tested too
+        path = np.concatenate(parts[-2:])[-(b - a) - (a > i):]
+        base = b - len(path)
+
+        # A portal entered on segment k switches blocks at frame base + k + 1
+        end, dest = b, None
+        if index is not None:
+            k, hit = index.first_crossing_path(path[:, 0, 3], path[:, 2, 3])
+            if k >= 0:
+                end, dest = base + k + 1, portals.dest_block(first_row + hit)
+
+        # Leaving the block's AABB into another block switches earlier, if it happens first
+        f, aabb_dest = _aabb_switch(block_index, block, world, max(a, i + 1), end)
+        if aabb_dest is not None:
+            end, dest = f, aabb_dest
+
+        if dest is not None or b == n:
+            return end, dest, np.concatenate(parts)
+        a, window = b, 2 * window
+
+
+def save_plan(path: str, segments):
+    with open(path, "w") as f:
+        json.dump({"frames": segments[-1].end if segments else 0,
+                   "segments": [s.to_dict() for s in segments]}, f)
+
+
+def load_plan(path: str):
+    with open(path) as f:
+        data = json.load(f)
+    return [TourSegment(s["block"], s["start"], s["end"], np.asarray(s["camera_matrices"]))
+            for s in data["segments"]]
+
+
+def main(path_file, db_path, out_path, start_block=None, use_portals=True, use_aabbs=True, portal_table=None):
+    world_poses = load_path(path_file)
+    transforms = metadata_db.load_transforms(db_path)
+    portals = open_table(db_path, portal_table, transforms) if use_portals else None
+    aabbs = metadata_db.load_aabbs(db_path) if use_aabbs else {}
+    block_index = BlockIndex.from_aabbs(aabbs) if aabbs else None
+
+    segments = plan_tour(world_poses, transforms, portals, block_index, start_block)
+    for s in segments:
+        print(f" - {s.block}: frames {s.start}-{s.end - 1}")
+    save_plan(out_path, segments)
+    print(f"Saved {len(segments)} segments covering {len(world_poses)} frames to {out_path}")
+    return segments
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Split a world-space camera path into per-block local camera segments")
+    parser.add_argument("path", help="World-space camera path (.npy of poses or transforms.json-style frames)")
+    parser.add_argument("out", help="Output plan .json")
+    parser.add_argument("--db", default="metadata.sqlite", help="Metadata database with transforms, portals and AABBs")
+    parser.add_argument("--start_block", default=None, help="Block of the first frame (default: located by AABB)")
+    parser.add_argument("--no_portals", action="store_true", help="Segment by AABB membership only")
+    parser.add_argument("--no_aabbs", action="store_true", help="Segment by portals only")
+    parser.add_argument("--portal_table", default=None, help="Compiled portal table to memory-map (default: compile from the database)")
+    args = parser.parse_args()
+
+    if not os.path.exists(args.db):
+        raise RuntimeError(f"No database found at {args.db}.")
+    main(args.path, args.db, args.out, args.start_block, not args.no_portals, not args.no_aabbs, args.portal_table)
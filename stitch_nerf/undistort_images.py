@@ -0,0 +1,249 @@
+import argparse
+import hashlib
+import json
+import math
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from camera_poses import file_digest
+
+CACHE_MANIFEST = ".undistort_cache.json"
+TABLE_DIR = ".remap_tables"
+
+# Camera parameters a frame may override; together they define one remap table
+INTRINSIC_KEYS = ("w", "h", "fl_x", "fl_y", "cx", "cy", "k1", "k2", "k3", "k4", "p1", "p2", "is_fisheye")
+DISTORTION_KEYS = ("k1", "k2", "k3", "k4", "p1", "p2")
+
+# One entry per output pixel: flat index of the top-left source pixel, bilinear weights, inside the source
+REMAP_DTYPE = np.dtype([("idx", np.int32), ("wx", np.float32), ("wy", np.float32), ("valid", np.bool_)])
+
+
+def frame_intrinsics(data: dict, frame: dict) -> dict:
+    """
+    Camera parameters of one frame: its own values where present, else the
+    transforms.json's top-level ones. Missing distortion terms are 0.
+    """
+    intr = {}
+    for key in INTRINSIC_KEYS:
+        value = frame.get(key, data.get(key))
+        if key == "is_fisheye":
+            intr[key] = bool(value)
+        elif value is not None:
+            intr[key] = float(value)
+        elif key in DISTORTION_KEYS:
+            intr[key] = 0.0
+        elif key == "fl_y" and "fl_x" in intr:
+            intr[key] = intr["fl_x"]
+        else:
+            raise ValueError(f"No '{key}' for frame {frame.get('file_path')}")
+    return intr
+
+
+def intrinsics_key(intr: dict) -> str:
+    """
+    sha1 of the parameters that determine a remap table.
+    """
+    return hashlib.sha1(json.dumps([intr[k] for k in INTRINSIC_KEYS]).encode()).hexdigest()
+
+
+def undistorted_intrinsics(intr: dict, focal_scale: float = 1.0) -> dict:
+    """
+    Pinhole intrinsics of the undistorted images: same size and principal point,
+    focal lengths scaled by focal_scale and no distortion.
+    """
+    out = dict(intr, fl_x=intr["fl_x"] * focal_scale, fl_y=intr["fl_y"] * focal_scale, is_fisheye=False)
+    for key in DISTORTION_KEYS:
+        out[key] = 0.0
+    out["camera_angle_x"] = 2 * math.atan(out["w"] / (2 * out["fl_x"]))
+    out["camera_angle_y"] = 2 * math.atan(out["h"] / (2 * out["fl_y"]))
+    return out
+
+
+def distort(x: np.ndarray, y: np.ndarray, intr: dict):
+    """
+    Maps normalized pinhole coordinates to distorted normalized coordinates with
+    the OpenCV radial-tangential model, or the equidistant fisheye model.
+    """
+    k1, k2, k3, k4, p1, p2 = (intr[k] for k in DISTORTION_KEYS)
+    r2 = x * x + y * y
+    if intr["is_fisheye"]:
+        r = np.sqrt(r2)
+        theta = np.arctan(r)
+        t2 = theta * theta
+        theta_d = theta * (1 + t2 * (k1 + t2 * (k2 + t2 * (k3 + t2 * k4))))
+        scale = np.divide(theta_d, r, out=np.ones_like(r), where=r > 1e-12)
+        return x * scale, y * scale
+    radial = 1 + r2 * (k1 + r2 * (k2 + r2 * k3))
+    xd = x * radial + 2 * p1 * x * y + p2 * (r2 + 2 * x * x)
+    yd = y * radial + p1 * (r2 + 2 * y * y) + 2 * p2 * x * y
+    return xd, yd
+
+
+def build_remap(intr: dict, focal_scale: float = 1.0) -> np.ndarray:
+    """
+    (h, w) REMAP_DTYPE table sampling the distorted image at every pixel of the
+    undistorted one. Pixel centers are at +0.5, as in transforms.json.
+    """
+    new = undistorted_intrinsics(intr, focal_scale)
+    w, h = int(intr["w"]), int(intr["h"])
+    u, v = np.meshgrid(np.arange(w, dtype=np.float64) + 0.5, np.arange(h, dtype=np.float64) + 0.5)
+    xd, yd = distort((u - new["cx"]) / new["fl_x"], (v - new["cy"]) / new["fl_y"], intr)
+    # Continuous source coordinates relative to pixel centers
+    sx = xd * intr["fl_x"] + intr["cx"] - 0.5
+    sy = yd * intr["fl_y"] + intr["cy"] - 0.5
+
+    table = np.empty((h, w), dtype=REMAP_DTYPE)
+    table["valid"] = (sx >= -0.5) & (sx <= w - 0.5) & (sy >= -0.5) & (sy <= h - 0.5)
+    x0 = np.clip(np.floor(sx), 0, max(w - 2, 0))
+    y0 = np.clip(np.floor(sy), 0, max(h - 2, 0))
+    table["wx"] = np.clip(sx - x0, 0, 1)
+    table["wy"] = np.clip(sy - y0, 0, 1)
+    table["idx"] = y0.astype(np.int64) * w + x0.astype(np.int64)
+    return table
+
+
+def load_remap(intr: dict, table_dir: str, focal_scale: float = 1.0) -> str:
+    """
+    Path of the cached remap table for intr, building it on first use.
+    """
+    os.makedirs(table_dir, exist_ok=True)
+    key = intrinsics_key(intr)
+    path = os.path.join(table_dir, f"{key}_{focal_scale:g}.npy")
+    if not os.path.exists(path):
+        tmp = path + ".tmp.npy"
+        np.save(tmp, build_remap(intr, focal_scale))
+        os.replace(tmp, path)
+    return path
+
+
+def apply_remap(image: np.ndarray, table: np.ndarray) -> np.ndarray:
+    """
+    Bilinearly resamples an (h, w) or (h, w, c) image through a remap table.
+    Pixels that fall outside the source are black.
+    """
+    h, w = image.shape[:2]
+    src = image.reshape(h * w, -1).astype(np.float32)
+    idx = table["idx"].ravel()
+    wx = table["wx"].ravel()[:, None]
+    wy = table["wy"].ravel()[:, None]
+    dx = 1 if w > 1 else 0
+    dy = w if h > 1 else 0
+    top = src[idx] * (1 - wx) + src[idx + dx] * wx
+    bottom = src[idx + dy] * (1 - wx) + src[idx + dy + dx] * wx
+    out = top * (1 - wy) + bottom * wy
+    out[~table["valid"].ravel()] = 0
+    if np.issubdtype(image.dtype, np.integer):
+        info = np.iinfo(image.dtype)
+        out = np.clip(np.rint(out), info.min, info.max)
+    return out.astype(image.dtype).reshape(table.shape + image.shape[2:])
+
+
+def process_image(src: str, dst: str, table_path: str, quality: int):
+    """
+    Undistorts one image through a cached remap table. Runs in a worker process.
+    """
+    from PIL import Image
+
+    table = np.load(table_path, mmap_mode="r")
+    os.makedirs(os.path.dirname(dst), exist_ok=True)
+    with Image.open(src) as img:
+        if img.size != (table.shape[1], table.shape[0]):
+            raise ValueError(f"{src} is {img.size[0]}x{img.size[1]}, transforms.json says {table.shape[1]}x{table.shape[0]}")
+        if img.mode not in ("L", "RGB", "RGBA"):
+            img = img.convert("RGB")
+        out = Image.fromarray(apply_remap(np.asarray(img), table), img.mode)
+    if os.path.splitext(dst)[1].lower() in (".jpg", ".jpeg"):
+        out.convert("RGB").save(dst, quality=quality, optimize=True)
+    else:
+        out.save(dst)
+    return dst
+
+
+def _load_manifest(out_dir):
+    path = os.path.join(out_dir, CACHE_MANIFEST)
+    if not os.path.exists(path):
+        return {}
+    with open(path) as f:
+        return json.load(f)
+
+
+def _corrected(meta: dict, new: dict):
+    """
+    Copy of a transforms.json (or one frame) with the camera parameters it
+    carries replaced by the undistorted ones.
+    """
+    out = dict(meta)
+    for key in INTRINSIC_KEYS + ("camera_angle_x", "camera_angle_y"):
+        if key in out:
+            out[key] = new[key]
+    return out
+
+
+def undistort(transforms_path: str, out_dir: str, focal_scale: float = 1.0, quality: int = 95,
+              table_dir: str = None, workers: int = None):
+    """
+    Writes undistorted copies of a block's images to out_dir and a
+    transforms.json with pinhole intrinsics. One remap table is built per
+    distinct set of intrinsics and cached in table_dir; outputs whose source
+    content hash and table are unchanged since the last run are not regenerated.
+    """
+    with open(transforms_path) as f:
+        data = json.load(f)
+    src_dir = os.path.dirname(os.path.abspath(transforms_path))
+    os.makedirs(out_dir, exist_ok=True)
+    table_dir = table_dir or os.path.join(out_dir, TABLE_DIR)
+
+    tables, frame_tables = {}, []
+    for frame in data["frames"]:
+        intr = frame_intrinsics(data, frame)
+        key = intrinsics_key(intr)
+        if key not in tables:
+            tables[key] = (intr, load_remap(intr, table_dir, focal_scale))
+        frame_tables.append(key)
+    print(f"{len(tables)} remap table(s) for {len(data['frames'])} frames in {table_dir}")
+
+    manifest = _load_manifest(out_dir)
+    jobs, new_manifest = [], {}
+    for frame, key in zip(data["frames"], frame_tables):
+        rel = frame["file_path"]
+        src = os.path.normpath(os.path.join(src_dir, rel))
+        dst = os.path.normpath(os.path.join(out_dir, rel))
+        table_path = tables[key][1]
+        entry = {"sha1": file_digest(src), "table": os.path.basename(table_path), "quality": quality}
+        new_manifest[rel] = entry
+        if manifest.get(rel) != entry or not os.path.exists(dst):
+            jobs.append((src, dst, table_path))
+
+    print(f"Undistorting {len(jobs)} images ({len(data['frames']) - len(jobs)} cached)")
+    if jobs:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            futures = [pool.submit(process_image, src, dst, table_path, quality) for src, dst, table_path in jobs]
+            for future in futures:
+                future.result()
+
+    # Top-level values follow the first frame's table, which is the shared one
+    # unless every frame carries its own intrinsics
+    new = {key: undistorted_intrinsics(intr, focal_scale) for key, (intr, _) in tables.items()}
+    out = _corrected({k: v for k, v in data.items() if k != "frames"}, new[frame_tables[0]]) if frame_tables else dict(data)
+    out["frames"] = [_corrected(frame, new[key]) for frame, key in zip(data["frames"], frame_tables)]
+    with open(os.path.join(out_dir, "transforms.json"), "w") as f:
+        json.dump(out, f, indent=2)
+    with open(os.path.join(out_dir, CACHE_MANIFEST), "w") as f:
+        json.dump(new_manifest, f)
+    print(f"Saved {os.path.join(out_dir, 'transforms.json')}")
+    return out
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Undistort a block's images and write pinhole intrinsics to transforms.json")
+    parser.add_argument("transforms", help="Path to the block's transforms.json")
+    parser.add_argument("out_dir", help="Output directory for images and the rewritten transforms.json")
+    parser.add_argument("--focal_scale", type=float, default=1.0, help="Scale of the undistorted focal length (< 1 keeps more of a fisheye's field of view)")
+    parser.add_argument("--quality", type=int, default=95, help="JPEG quality")
+    parser.add_argument("--table_dir", default=None, help="Remap table cache directory (default: <out_dir>/.remap_tables)")
+    parser.add_argument("--workers", type=int, default=None, help="Number of worker processes (default: all cores)")
+    args = parser.parse_args()
+
+    undistort(args.transforms, args.out_dir, args.focal_scale, args.quality, args.table_dir, args.workers)
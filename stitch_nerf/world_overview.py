@@ -0,0 +1,207 @@
+"""
+Merged overview cloud of the whole site in world coordinates.
+
+Every block's cloud is streamed in chunks from the cloud_store cache,
+moved into world space with its entry in block_transforms and reduced to
+per-voxel sums (x, y, z, count) on a shared world grid, so memory is bounded
+by the number of occupied voxels rather than by the number of points.
+Each block's contribution is saved in a parts directory under a hash of its
+cloud, transform and voxel size; re-running after one block's transform
+changed only recomputes that block and re-merges the stored sums.
+"""
+import argparse
+import hashlib
+import json
+import os
+
+import numpy as np
+
+import se3
+import metadata_db
+from camera_poses import load_camera_centers
+from cloud_store import load_cloud, cache_dir, SOURCE_FILE
+from ply_io import write_ply
+
+OVERVIEW_VERSION = 1
+CHUNK_POINTS = 1 << 20
+# Voxel indices are packed into one int64 per voxel, KEY_BITS per axis
+KEY_BITS = 21
+KEY_OFFSET = 1 << (KEY_BITS - 1)
+CAMERA_COLOR = (255, 255, 255)
+
+
+def _pack(keys: np.ndarray) -> np.ndarray:
+    shifted = keys.astype(np.int64) + KEY_OFFSET
+    if shifted.size and (shifted.min() < 0 or shifted.max() >= 1 << KEY_BITS):
+        raise ValueError("World extent too large for the voxel size; use a larger voxel size")
+    return (shifted[:, 0] << (2 * KEY_BITS)) | (shifted[:, 1] << KEY_BITS) | shifted[:, 2]
+
+
+def _unpack(packed: np.ndarray) -> np.ndarray:
+    mask = (1 << KEY_BITS) - 1
+    keys = np.stack([packed >> (2 * KEY_BITS), (packed >> KEY_BITS) & mask, packed & mask], axis=1)
+    return keys - KEY_OFFSET
+
+
+def reduce_voxels(keys: np.ndarray, sums: np.ndarray):
+    """
+    Adds up the rows of sums that share a voxel key.
+    Returns (unique keys (M, 3), summed rows (M, C)).
+    """
+    packed, inverse = np.unique(_pack(keys), return_inverse=True)
+    inverse = inverse.ravel()
+    out = np.empty((len(packed), sums.shape[1]))
+    for c in range(sums.shape[1]):
+        out[:, c] = np.bincount(inverse, weights=sums[:, c], minlength=len(packed))
+    return _unpack(packed), out
+
+
+def block_contribution(ply_path: str, T: np.ndarray, voxel_size: float, chunk: int = CHUNK_POINTS):
+    """
+    World-space voxel sums of one block's cloud: (keys (M, 3), sums (M, 4))
+    where each row of sums is (sum x, sum y, sum z, count).
+    Points are transformed and reduced chunk by chunk.
+    """
+    points = load_cloud(ply_path).points
+    keys = np.empty((0, 3), dtype=np.int64)
+    sums = np.empty((0, 4))
+    for start in range(0, len(points), chunk):
+        world = se3.transform_points(T, np.asarray(points[start:start + chunk], dtype=np.float64))
+        chunk_keys = np.floor(world / voxel_size).astype(np.int64)
+        chunk_sums = np.hstack([world, np.ones((len(world), 1))])
+        keys, sums = reduce_voxels(np.vstack([keys, chunk_keys]), np.vstack([sums, chunk_sums]))
+    return keys, sums
+
+
+def contribution_key(ply_path: str, T: np.ndarray, voxel_size: float) -> str:
+    """
+    Hash of everything a block's contribution depends on. The cloud's content
+    hash comes from the cloud_store cache, so the .ply is not re-hashed.
+    """
+    load_cloud(ply_path)
+    with open(os.path.join(cache_dir(ply_path), SOURCE_FILE)) as f:
+        source_sha1 = json.load(f)["sha1"]
+    h = hashlib.sha1()
+    h.update(json.dumps([OVERVIEW_VERSION, float(voxel_size), source_sha1]).encode())
+    h.update(np.ascontiguousarray(T, dtype=np.float64).tobytes())
+    return h.hexdigest()
+
+
+def load_contribution(parts_dir: str, block: str, ply_path: str, T: np.ndarray, voxel_size: float):
+    """
+    The stored contribution of block if its inputs are unchanged, otherwise
+    a freshly computed one (which is then stored). Returns (keys, sums, reused).
+    """
+    key = contribution_key(ply_path, T, voxel_size)
+    part_path = os.path.join(parts_dir, block + ".npz")
+    if os.path.exists(part_path):
+        with np.load(part_path) as part:
+            if str(part["key"]) == key:
+                return part["keys"], part["sums"], True
+
+    keys, sums = block_contribution(ply_path, T, voxel_size)
+    tmp_path = part_path + ".tmp"
+    with open(tmp_path, "wb") as f:
+        np.savez(f, key=key, keys=keys.astype(np.int32), sums=sums)
+    os.replace(tmp_path, part_path)
+    return keys, sums, False
+
+
+def block_color(block: str):
+    """
+    Stable color of a block, derived from its name.
+    """
+    digest = hashlib.sha1(block.encode()).digest()
+    return np.array([64 + digest[i] % 192 for i in range(3)], dtype=np.float64)
+
+
+def coarsen(keys: np.ndarray, sums: np.ndarray, factor: int):
+    """
+    Merges the voxels of the grid into voxels factor times larger. Sums are
+    exact, so the centroids equal those of voxelizing the raw points at the
+    coarser size.
+    """
+    return reduce_voxels(np.floor_divide(keys, factor), sums)
+
+
+def build_overview(ply_paths: dict, transforms: dict, parts_dir: str, voxel_size: float = 0.05,
+                   max_points: int = 0, cameras: bool = True):
+    """
+    Merges every block in ply_paths ({block: .ply}) that has a transform into
+    one world-space cloud. Returns (points, colors, voxel_size used); with
+    max_points the grid is coarsened by powers of two until it fits.
+    Camera centers from each block's transforms.json are appended when cameras is set.
+    """
+    os.makedirs(parts_dir, exist_ok=True)
+    blocks = sorted(b for b in ply_paths if b in transforms)
+    for block in sorted(set(ply_paths) - set(blocks)):
+        print(f"Skipping {block}: no transform in the database")
+
+    # Columns: sum x, sum y, sum z, sum r, sum g, sum b, count
+    keys = np.empty((0, 3), dtype=np.int64)
+    sums = np.empty((0, 7))
+    for block in blocks:
+        block_keys, block_sums, reused = load_contribution(parts_dir, block, ply_paths[block], transforms[block],
+                                                           voxel_size)
+        count = block_sums[:, 3:4]
+        colored = np.hstack([block_sums[:, :3], count * block_color(block), count])
+        keys, sums = reduce_voxels(np.vstack([keys, block_keys]), np.vstack([sums, colored]))
+        print(f" - {block}: {len(block_keys)} voxels ({'reused' if reused else 'computed'})")
+
+    # Drop contributions of blocks that are no longer part of the site
+    for name in os.listdir(parts_dir):
+        if name.endswith(".npz") and name[:-4] not in blocks:
+            os.remove(os.path.join(parts_dir, name))
+
+    factor = 1
+    while max_points and len(keys) > max_points:
+        factor *= 2
+        keys, sums = coarsen(keys, sums, 2)
+    points = sums[:, :3] / sums[:, 6:7]
+    colors = np.round(sums[:, 3:6] / sums[:, 6:7])
+
+    if cameras:
+        centers = []
+        for block in blocks:
+            transforms_path = os.path.join(os.path.dirname(ply_paths[block]), "transforms.json")
+            if os.path.exists(transforms_path):
+                centers.append(se3.transform_points(transforms[block], load_camera_centers(transforms_path)))
+        if centers:
+            centers = np.vstack(centers)
+            points = np.vstack([points, centers])
+            colors = np.vstack([colors, np.tile(CAMERA_COLOR, (len(centers), 1))])
+    return points, colors.astype(np.uint8), voxel_size * factor
+
+
+def main(ply_files, db_path, out_path, voxel_size=0.05, max_points=0, parts_dir=None, cameras=True, view=False):
+    transforms = metadata_db.load_transforms(db_path)
+    ply_paths = {os.path.basename(os.path.dirname(path)): path for path in ply_files}
+    parts_dir = parts_dir or os.path.splitext(out_path)[0] + ".parts"
+
+    points, colors, used_voxel = build_overview(ply_paths, transforms, parts_dir, voxel_size, max_points, cameras)
+    write_ply(out_path, points, colors=colors)
+    print(f"Saved {len(points)} points ({used_voxel:g} m voxels) to {out_path}")
+
+    if view:
+        import open3d as o3d
+        pcd = o3d.geometry.PointCloud(o3d.utility.Vector3dVector(points))
+        pcd.colors = o3d.utility.Vector3dVector(colors / 255.0)
+        o3d.visualization.draw_geometries([pcd, o3d.geometry.TriangleMesh.create_coordinate_frame(size=1.0)])
+    return points, colors
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Merge every block's cloud and camera centers into one world-space overview PLY")
+    parser.add_argument("ply", nargs="+", help="Block .ply files (block name = parent directory)")
+    parser.add_argument("--out", default="world_overview.ply", help="Output .ply")
+    parser.add_argument("--db", default="metadata.sqlite", help="Metadata database with block transforms")
+    parser.add_argument("--voxel_size", type=float, default=0.05, help="Voxel size of the overview in meters")
+    parser.add_argument("--max_points", type=int, default=0, help="Coarsen the voxel size until the overview has at most this many points")
+    parser.add_argument("--parts_dir", default=None, help="Where per-block contributions are kept (default: <out>.parts)")
+    parser.add_argument("--no_cameras", action="store_true", help="Leave out camera centers")
+    parser.add_argument("--view", action="store_true", help="Show the overview in Open3D")
+    args = parser.parse_args()
+
+    if not os.path.exists(args.db):
+        raise RuntimeError(f"No database found at {args.db}.")
+    main(args.ply, args.db, args.out, args.voxel_size, args.max_points, args.parts_dir, not args.no_cameras, args.view)